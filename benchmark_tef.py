@@ -0,0 +1,353 @@
+"""
+Benchmarks do pipeline TEF.
+
+    python benchmark_tef.py [-n ITERACOES] [--json ARQUIVO] [--baseline ARQUIVO]
+
+Mede custo por chamada do codec, do SequenceManager e do journal,
+latência de ida e volta (p50/p95/p99) e vazão contra o simulador local do
+CTFClient, o tempo de atualizar_treeview com 10, 1k e 10k linhas
+(quando há display), a partida a frio com e sem tkinter e a gravação do
+IntPos.001 em cada política de durabilidade.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+import tef_codec
+from tef_protocolo import TefConfig, SequenceManager
+
+# Pedido e resposta típicos de um CRT com comprovante de 40 linhas
+PEDIDO_CRT = {
+    "000-000": "CRT",
+    "001-000": "0000000042",
+    "002-000": "1001",
+    "003-000": "10000",
+    "011-000": "10",
+    "099-000": "1",
+}
+
+RESPOSTA_CRT = tef_codec.serializar({
+    "000-000": "CRT",
+    "001-000": "0000000042",
+    "003-000": "10000",
+    "009-000": "0",
+    "010-000": "REDE",
+    "012-000": "123456",
+    "022-000": "17102026",
+    "023-000": "101530",
+    "027-000": "FINALIZACAO-0001",
+    "028-000": "40",
+    **{f"029-{i:03d}": f"\"LINHA DE COMPROVANTE {i:02d}\"" for i in range(1, 41)},
+    "030-000": "TRANSACAO APROVADA",
+}, validacao=False)
+
+
+def medir(func, n):
+    """Executa `func` n vezes e devolve o custo médio por chamada em µs"""
+    func()  # aquecimento
+    inicio = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def bench_codec(n):
+    return {
+        "encode_us": medir(lambda: tef_codec.serializar(PEDIDO_CRT), n),
+        "encode_sem_validacao_us": medir(lambda: tef_codec.serializar(PEDIDO_CRT, validacao=False), n),
+        "decode_us": medir(lambda: tef_codec.parse(RESPOSTA_CRT), n),
+        "decode_bytes": len(RESPOSTA_CRT),
+    }
+
+
+def bench_sequencia(n, dir_tmp):
+    caminho = os.path.join(dir_tmp, "seq.dat")
+    seq = SequenceManager(caminho)
+    resultado = {"get_next_id_us": medir(seq.get_next_id, n), "bloco": seq.bloco}
+    # Pior caso: bloco de 1 ID = um lock + fsync por ID
+    seq_1 = SequenceManager(caminho, bloco=1)
+    resultado["get_next_id_bloco_1_us"] = medir(seq_1.get_next_id, max(1, n // 100))
+    return resultado
+
+
+def bench_journal(dir_tmp, tamanhos=(1000, 20000), amostras=500):
+    """Custo de registrar e de buscar por NSU conforme o journal cresce"""
+    from tef_journal import TransacaoJournal
+    from tef_ledger import Transacao
+
+    journal = TransacaoJournal(os.path.join(dir_tmp, "journal.db"))
+    contador = [0]
+
+    def registrar():
+        contador[0] += 1
+        journal.registrar(Transacao(1000, "CREDITO", "CONFIRMADO", id_req=str(contador[0]),
+                                    nsu=str(contador[0]), rede="REDE", finalizacao="F", doc_fiscal="1001"))
+
+    resultado = {}
+    try:
+        for n in tamanhos:
+            while contador[0] < n - amostras:
+                registrar()
+            resultado[f"registrar_{n}_us"] = medir(registrar, amostras)
+            journal.flush()
+            resultado[f"buscar_nsu_{n}_us"] = medir(lambda: journal.buscar_nsu(str(n // 2)), amostras)
+    finally:
+        journal.close()
+    return resultado
+
+
+def percentil(valores, p):
+    """Percentil por interpolação linear sobre a lista ordenada"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    pos = (len(ordenados) - 1) * p / 100
+    i = int(pos)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (pos - i)
+
+
+def resumo_latencias(latencias):
+    return {
+        "amostras": len(latencias),
+        "p50_ms": percentil(latencias, 50) * 1e3,
+        "p95_ms": percentil(latencias, 95) * 1e3,
+        "p99_ms": percentil(latencias, 99) * 1e3,
+        "max_ms": max(latencias) * 1e3,
+    }
+
+
+def bench_ida_e_volta(transacoes, lanes, escala_latencia, dir_tmp):
+    """CRT + CNF contra o simulador: latência por transação e vazão agregada"""
+    import simulador_ctfclient
+    from tef_dispatcher import TefDispatcher
+
+    bases = [os.path.join(dir_tmp, f"lane{i}") for i in range(lanes)]
+    perfil = simulador_ctfclient.PerfilSimulador(taxa_recusa=0.0, semente=1)
+    perfil.escalar(escala_latencia)
+    dispatcher = TefDispatcher.from_config(bases, timeout=30)
+    dispatcher.setup_directories()
+    simuladores = simulador_ctfclient.iniciar(bases, perfil)
+
+    latencias = []
+    erros = []
+
+    async def uma(vagas):
+        # Uma transação por lane: a latência medida não inclui fila
+        async with vagas:
+            inicio = time.perf_counter()
+            try:
+                res = await dispatcher.credit(1000, "1001")
+                await dispatcher.confirm(res.rede, res.nsu, res.finalizacao, "1001", lane=res.lane)
+            except Exception as e:
+                erros.append(str(e))
+                return
+            latencias.append(time.perf_counter() - inicio)
+
+    async def todas():
+        vagas = asyncio.Semaphore(lanes)
+        inicio = time.perf_counter()
+        await asyncio.gather(*[uma(vagas) for _ in range(transacoes)])
+        return time.perf_counter() - inicio
+
+    try:
+        duracao = asyncio.run(todas())
+    finally:
+        for sim in simuladores:
+            sim.parar()
+        dispatcher.close()
+
+    resultado = resumo_latencias(latencias) if latencias else {"amostras": 0}
+    resultado.update({
+        "lanes": lanes,
+        "escala_latencia_simulador": escala_latencia,
+        "erros": len(erros),
+        "duracao_s": duracao,
+        "transacoes_por_s": len(latencias) / duracao if duracao else None,
+    })
+    return resultado
+
+
+def bench_treeview(tamanhos, dir_tmp, repeticoes=5):
+    """Tempo de atualizar_treeview e de uma mudança de status por tamanho de histórico"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {"indisponivel": str(e).splitlines()[0] if str(e) else type(e).__name__}
+
+    # Tudo o que o PDV grava fica em dir_tmp (nada no diretório de trabalho)
+    ui = os.path.join(dir_tmp, "ui")
+    config = {"DIR_REQ": os.path.join(ui, "REQ"), "DIR_RESP": os.path.join(ui, "RESP"),
+              "FILE_JOURNAL": os.path.join(ui, "journal.db"), "FILE_SEQ": os.path.join(ui, "tef_sequence.dat"),
+              "ARQUIVO_DIR": os.path.join(ui, "tef_arquivo")}
+    anteriores = {k: getattr(TefConfig, k) for k in config}
+    for k, v in config.items():
+        setattr(TefConfig, k, v)
+    from integracao_tef_ip import ModernPDV
+    from tef_ledger import Ledger, Transacao
+
+    root.withdraw()
+    app = None
+    resultado = {}
+    try:
+        app = ModernPDV(root)
+        for n in tamanhos:
+            app.ledger = Ledger()
+            for i in range(n):
+                app.ledger.adicionar(Transacao(
+                    1000, "CREDITO", "PENDENTE", id=n * 100000 + i, id_req=str(i).zfill(10),
+                    nsu=str(100000 + i), rede="REDE", finalizacao=f"F{i}",
+                    data_operacao="17102026", hora_operacao="101530"))
+            app.pagina = None
+            inicio = time.perf_counter()
+            app.atualizar_treeview()
+            root.update_idletasks()
+            resultado[f"linhas_{n}_ms"] = (time.perf_counter() - inicio) * 1e3
+
+            # Mudança de status de uma linha visível (caso comum durante a venda)
+            ultima = app.ledger.registros[-1]
+            tempos = []
+            for k in range(repeticoes):
+                app.ledger.mudar_status(ultima, "CONFIRMADO" if k % 2 == 0 else "PENDENTE")
+                inicio = time.perf_counter()
+                app.atualizar_transacoes([ultima])
+                root.update_idletasks()
+                tempos.append(time.perf_counter() - inicio)
+            resultado[f"status_{n}_ms"] = min(tempos) * 1e3
+    finally:
+        if app is not None and app._arquivando is not None:
+            app._arquivando.join()
+        root.destroy()
+        for k, v in anteriores.items():
+            setattr(TefConfig, k, v)
+    return resultado
+
+
+def bench_partida(dir_tmp, repeticoes=5, sobras=2000):
+    """Partida a frio (processo novo) e custo de tratar sobras em REQ/RESP"""
+    import subprocess
+    from tef_protocolo import TefFileHandler
+
+    def processo(codigo):
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            r = subprocess.run([sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True)
+            tempos.append(time.perf_counter() - inicio)
+            if r.returncode != 0:
+                return None
+        return min(tempos) * 1e3
+
+    resultado = {
+        "python_vazio_ms": processo("pass"),
+        "import_entrada_ms": processo("import tefip"),
+        "import_headless_ms": processo("import tefip, tef_client, tef_journal"),
+        "import_gui_ms": processo("import tkinter, integracao_tef_ip"),
+    }
+
+    handler = TefFileHandler(os.path.join(dir_tmp, "partida"))
+    for medir_fundo in (False, True):
+        os.makedirs(handler.dir_resp, exist_ok=True)
+        for i in range(sobras):
+            open(os.path.join(handler.dir_resp, f"IntPos.{i:03d}"), "wb").close()
+        inicio = time.perf_counter()
+        if medir_fundo:
+            thread = handler.iniciar_limpeza()
+            resultado[f"limpeza_fundo_{sobras}_ms"] = (time.perf_counter() - inicio) * 1e3
+            thread.join()
+        else:
+            handler.setup_directories()
+            resultado[f"limpeza_sincrona_{sobras}_ms"] = (time.perf_counter() - inicio) * 1e3
+    return resultado
+
+
+def bench_escrita(dir_tmp, amostras=300):
+    """Latência de publicação do IntPos.001 por política de durabilidade"""
+    from tef_protocolo import gravar_atomico, DURABILIDADES
+
+    destino = os.path.join(dir_tmp, "escrita", "IntPos.001")
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    payload = tef_codec.serializar({"000-000": "CRT", "001-000": "1", "002-000": "1001", "003-000": "10000"},
+                                   TefConfig.ENCODING, validacao=False)
+    resultado = {}
+    for durabilidade in DURABILIDADES:
+        latencias = []
+        for _ in range(amostras):
+            inicio = time.perf_counter()
+            gravar_atomico(destino, payload, durabilidade)
+            latencias.append(time.perf_counter() - inicio)
+        resultado[durabilidade] = resumo_latencias(latencias)
+    return resultado
+
+
+def comparar(atual, baseline, tolerancia, prefixo=""):
+    """Lista métricas de custo (_us/_ms) que pioraram além da tolerância"""
+    regressoes = []
+    for chave, valor in baseline.items():
+        nome = f"{prefixo}{chave}"
+        if isinstance(valor, dict) and isinstance(atual.get(chave), dict):
+            regressoes += comparar(atual[chave], valor, tolerancia, nome + ".")
+        elif (chave.endswith("_us") or chave.endswith("_ms")) and isinstance(valor, (int, float)) \
+                and isinstance(atual.get(chave), (int, float)) and valor > 0:
+            if atual[chave] > valor * (1 + tolerancia):
+                regressoes.append(f"{nome}: {valor:.3f} -> {atual[chave]:.3f}")
+    return regressoes
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-n", "--iteracoes", type=int, default=20000)
+    ap.add_argument("--transacoes", type=int, default=200)
+    ap.add_argument("--lanes", type=int, default=4)
+    ap.add_argument("--escala-latencia", type=float, default=0.0,
+                    help="escala das latências do simulador (0 = só o custo do pipeline)")
+    ap.add_argument("--secoes", default="codec,sequencia,journal,ida_e_volta,treeview,partida,escrita",
+                    help="seções a executar, separadas por vírgula")
+    ap.add_argument("--json", help="grava o resultado em JSON neste arquivo")
+    ap.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+    ap.add_argument("--tolerancia", type=float, default=0.2,
+                    help="piora relativa aceita antes de acusar regressão")
+    args = ap.parse_args(argv)
+    secoes = set(args.secoes.split(","))
+
+    resultado = {"python": sys.version.split()[0], "plataforma": sys.platform}
+    with tempfile.TemporaryDirectory(prefix="bench_tef_") as dir_tmp:
+        if "codec" in secoes:
+            resultado["codec"] = bench_codec(args.iteracoes)
+        if "sequencia" in secoes:
+            resultado["sequencia"] = bench_sequencia(args.iteracoes, dir_tmp)
+        if "journal" in secoes:
+            resultado["journal"] = bench_journal(dir_tmp)
+        if "ida_e_volta" in secoes:
+            resultado["ida_e_volta"] = bench_ida_e_volta(args.transacoes, args.lanes,
+                                                         args.escala_latencia, dir_tmp)
+        if "treeview" in secoes:
+            resultado["treeview"] = bench_treeview((10, 1000, 10000), dir_tmp)
+        if "partida" in secoes:
+            resultado["partida"] = bench_partida(dir_tmp)
+        if "escrita" in secoes:
+            resultado["escrita"] = bench_escrita(dir_tmp)
+
+    texto = json.dumps(resultado, indent=2)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(texto)
+    print(texto)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressoes = comparar(resultado, json.load(f), args.tolerancia)
+        for r in regressoes:
+            print(f"REGRESSÃO {r}", file=sys.stderr)
+        return 1 if regressoes else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
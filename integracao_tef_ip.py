@@ -1,118 +1,23 @@
-import os
-import time
+import asyncio
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 from datetime import datetime
 
-# =============================================================================
-# CONFIGURAÇÕES
-# =============================================================================
-class TefConfig:
-    DIR_BASE = r"C:\Auttar_TefIP"
-    DIR_REQ = os.path.join(DIR_BASE, "REQ")
-    DIR_RESP = os.path.join(DIR_BASE, "RESP")
-    FILE_SEQ = "tef_sequence.dat"
-
-class SequenceManager:
-    """
-    Gerencia o ID sequencial com Thread Lock para evitar números repetidos
-    no log em operações rápidas.
-    """
-    _lock = threading.Lock()
-
-    @staticmethod
-    def reset_sequence():
-        """Reseta para 0 apenas ao abrir o sistema"""
-        with SequenceManager._lock:
-            try:
-                with open(TefConfig.FILE_SEQ, "w") as f:
-                    f.write("0")
-            except: pass
-
-    @staticmethod
-    def get_next_id():
-        """Lê, incrementa e salva de forma atômica (Thread-Safe)"""
-        with SequenceManager._lock:
-            current_id = 0
-            if os.path.exists(TefConfig.FILE_SEQ):
-                try:
-                    with open(TefConfig.FILE_SEQ, "r") as f:
-                        content = f.read().strip()
-                        if content.isdigit():
-                            current_id = int(content)
-                except: pass
-            
-            next_id = current_id + 1
-            try:
-                with open(TefConfig.FILE_SEQ, "w") as f:
-                    f.write(str(next_id))
-            except: pass
-            
-            return str(next_id).zfill(10)
-
-class TefFileHandler:
-    @staticmethod
-    def setup_directories():
-        os.makedirs(TefConfig.DIR_REQ, exist_ok=True)
-        os.makedirs(TefConfig.DIR_RESP, exist_ok=True)
-        for p in [TefConfig.DIR_REQ, TefConfig.DIR_RESP]:
-            for f in os.listdir(p):
-                try: os.remove(os.path.join(p, f))
-                except: pass
-
-    @staticmethod
-    def write_request(data_dict):
-        tmp_path = os.path.join(TefConfig.DIR_REQ, "IntPos.tmp")
-        final_path = os.path.join(TefConfig.DIR_REQ, "IntPos.001")
-        try:
-            with open(tmp_path, 'w', encoding='mbcs') as f:
-                if "000-000" in data_dict:
-                    f.write(f"000-000 = {data_dict['000-000']}\n")
-                for k, v in data_dict.items():
-                    if k not in ["000-000", "999-999"] and v is not None:
-                        f.write(f"{k} = {v}\n")
-                f.write("999-999 = 0\n")
-            
-            if os.path.exists(final_path): os.remove(final_path)
-            os.rename(tmp_path, final_path)
-            return True
-        except Exception as e:
-            print(f"Erro escrita: {e}")
-            return False
-
-    @staticmethod
-    def wait_response(timeout=60):
-        start = time.time()
-        sts_path = os.path.join(TefConfig.DIR_RESP, "IntPos.Sts")
-        # Aguarda STS
-        while time.time() - start < 7:
-            if os.path.exists(sts_path):
-                try: os.remove(sts_path)
-                except: pass
-                break
-            time.sleep(0.1)
-        else:
-            return None, "Erro: CTFClient não respondeu (Sem STS)."
-
-        # Aguarda Resposta
-        resp_path = os.path.join(TefConfig.DIR_RESP, "IntPos.001")
-        start = time.time()
-        while time.time() - start < timeout:
-            if os.path.exists(resp_path):
-                time.sleep(0.3)
-                data = {}
-                try:
-                    with open(resp_path, 'r', encoding='mbcs') as f:
-                        for line in f:
-                            if '=' in line:
-                                k, v = line.strip().split('=', 1)
-                                data[k.strip()] = v.strip()
-                    os.remove(resp_path)
-                    return data, "Sucesso"
-                except: pass
-            time.sleep(0.5)
-        return None, "Timeout aguardando resposta TEF."
+import tef_metricas
+from tef_client import TefClient
+from tef_gateway import GatewayClient
+from tef_protocolo import TefConfig
+from tef_recuperacao import planejar, recuperar, status_final, CONFIRMANDO, ESTORNANDO
+from tef_fila import (FilaTef, FilaCheia, PRIORIDADE_FINALIZACAO, PRIORIDADE_CANCELAMENTO,
+                      PRIORIDADE_VENDA, PRIORIDADE_ADM)
+from tef_eventos import (BarramentoUI, Status, FilaAlterada, TransacoesAlteradas, TransacaoIncluida,
+                         InterfaceAlterada, Aviso, perguntar)
+from tef_journal import TransacaoJournal, TransacaoAmbigua
+from tef_arquivo import ArquivoTransacoes
+from tef_ledger import Ledger, Transacao, para_cents, formatar_cents
+
+TIPOS_VENDA = ("CREDITO", "CREDITO_PARCELADO", "DEBITO", "PIX_PAGAMENTO")
 
 # =============================================================================
 # JANELAS DE INPUT
@@ -148,27 +53,154 @@ class InputDialog(tk.Toplevel):
         self.result = data
         self.destroy()
 
+class CancelamentoDialog(InputDialog):
+    """Cancelamento manual: o NSU (inteiro ou parcial) é procurado no arquivo e o resto se preenche"""
+    MIN_DIGITOS = 3
+
+    def __init__(self, parent, title, fields, buscar):
+        super().__init__(parent, title, fields)
+        self.buscar = buscar
+        self.transacao = None
+        self.lbl_busca = tk.Label(self, fg="gray", font=("Segoe UI", 8))
+        self.lbl_busca.pack(pady=(0, 10))
+        self.entries['nsu'].bind("<KeyRelease>", self.ao_digitar_nsu)
+
+    def ao_digitar_nsu(self, event=None):
+        texto = self.entries['nsu'].get().strip()
+        self.transacao = None
+        if len(texto) < self.MIN_DIGITOS:
+            self.lbl_busca.config(text="")
+            return
+        achadas = self.buscar(texto)
+        if len(achadas) != 1:
+            self.lbl_busca.config(text=f"{len(achadas)} transações com esse NSU no arquivo" if achadas else "NSU não encontrado no arquivo")
+            return
+        t = self.transacao = achadas[0]
+        for chave, valor in (("data", t.data_operacao), ("hora", t.hora_operacao), ("valor", t.valor_display)):
+            self.entries[chave].delete(0, tk.END)
+            self.entries[chave].insert(0, valor or "")
+        self.lbl_busca.config(text=f"NSU {t.nsu} | {t.rede or '-'} | {t.tipo} | {t.status}")
+
+    def on_ok(self):
+        # NSU parcial que achou uma transação: vale o NSU completo dela
+        if self.transacao is not None:
+            self.entries['nsu'].delete(0, tk.END)
+            self.entries['nsu'].insert(0, self.transacao.nsu)
+        super().on_ok()
+        if self.result is not None:
+            self.result['rede'] = self.transacao.rede if self.transacao else ""
+
+class PerguntaDialog(tk.Toplevel):
+    """Sim/Não sem grab nem wait_window: a interface segue respondendo"""
+    def __init__(self, parent, pergunta):
+        super().__init__(parent)
+        self.title(pergunta.titulo)
+        self.pergunta = pergunta
+        self.restante = pergunta.prazo
+        self.protocol("WM_DELETE_WINDOW", lambda: self.responder(pergunta.padrao))
+
+        container = tk.Frame(self, padx=20, pady=20)
+        container.pack(fill=tk.BOTH, expand=True)
+        tk.Label(container, text=pergunta.mensagem, justify=tk.LEFT).pack(anchor="w")
+        self.lbl_prazo = tk.Label(container, fg="gray", font=("Segoe UI", 8))
+        self.lbl_prazo.pack(anchor="w", pady=(10, 0))
+
+        botoes = tk.Frame(container)
+        botoes.pack(fill=tk.X, pady=(10, 0))
+        tk.Button(botoes, text="Sim", bg="#27ae60", fg="white", command=lambda: self.responder(True)).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=5)
+        tk.Button(botoes, text="Não", bg="#e74c3c", fg="white", command=lambda: self.responder(False)).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=5)
+        self.contar()
+
+    def contar(self):
+        if self.pergunta.respondida:  # expirou do lado do motor
+            self.destroy()
+            return
+        if self.restante is not None:
+            if self.restante <= 0:
+                self.responder(self.pergunta.padrao)
+                return
+            padrao = "Sim" if self.pergunta.padrao else "Não"
+            self.lbl_prazo.config(text=f"Sem resposta em {int(self.restante)}s: {padrao}")
+            self.restante -= 1
+        self.after(1000, self.contar)
+
+    def responder(self, valor):
+        if not self.pergunta.respondida:
+            self.pergunta.responder(valor)
+        self.destroy()
+
+class AvisoDialog(tk.Toplevel):
+    """Aviso sem grab nem wait_window: o barramento segue drenando com ele aberto"""
+    CORES = {"info": "#2c3e50", "warning": "#d35400", "error": "#c0392b"}
+
+    def __init__(self, parent, aviso):
+        super().__init__(parent)
+        self.title(aviso.titulo)
+        self.protocol("WM_DELETE_WINDOW", self.destroy)
+
+        container = tk.Frame(self, padx=20, pady=20)
+        container.pack(fill=tk.BOTH, expand=True)
+        tk.Label(container, text=aviso.mensagem, justify=tk.LEFT,
+                 fg=self.CORES.get(aviso.nivel, self.CORES["info"])).pack(anchor="w")
+        tk.Button(container, text="OK", width=10, command=self.destroy).pack(pady=(15, 0))
+        self.bind("<Return>", lambda e: self.destroy())
+
 # =============================================================================
 # PDV PRINCIPAL
 # =============================================================================
 class ModernPDV:
+    LINHAS_POR_PAGINA = 200
+
     def __init__(self, root):
         self.root = root
         self.root.title("PDV TEF Auttar - Parcelado & Sequencial")
         self.root.geometry("1150x780") # Aumentei um pouco a altura
         self.root.configure(bg="#f4f6f9")
         
-        TefFileHandler.setup_directories()
-        SequenceManager.reset_sequence()
+        # Motor TEF sem interface: loop asyncio próprio em thread de fundo
+        if TefConfig.GATEWAY:
+            # REQ/RESP e sequência ficam com o processo gateway
+            self.tef = GatewayClient()
+        else:
+            self.tef = TefClient()
+            self.tef.handler.iniciar_limpeza()
+        tef_metricas.iniciar_exportadores()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._tarefas = set()  # tarefas soltas no loop (o asyncio só guarda referência fraca)
         
-        # Estrutura: {id_req, nsu, rede, finalizacao, valor, tipo, data_operacao, hora_operacao, status}
-        self.historico_transacoes = [] 
+        # Ledger: Transacao em centavos + totais por status/rede/tipo
+        # Pendentes de execuções anteriores (fechamento/crash) voltam do journal
+        self.journal = TransacaoJournal()
+        self.ledger = Ledger()
+        # Finalizadas de dias anteriores: busca por NSU no cancelamento manual
+        self.arquivo = ArquivoTransacoes()
+        self._arquivando = None
+        self.arquivar_fundo()
+        # Abertas no journal recebem CNF/NCN em segundo plano logo após a
+        # partida; ficam num ledger à parte, fora do total/restante da venda
+        self.anteriores = Ledger()
+        plano = planejar(self.journal.carregar_pendentes())
+        for t, _ in plano:
+            t.status = "PENDENTE"
+            self.anteriores.adicionar(t)
+
+        # Treeview: iid = id do journal; só a página exibida existe no Tk
+        self.pagina = None  # None = acompanha a última página
+        self.valores_tree = {}
         
-        self.valor_restante = 0.0
-        self.lock = False 
+        self.valor_restante_cents = 0
+        # Um pedido por vez no IntPos.001: tudo passa pela fila do terminal
+        self.fila = FilaTef(self.loop, TefConfig.FILA_CAPACIDADE, ao_mudar=self.fila_mudou)
         self.doc_fiscal = "1001"
+        # Motor -> interface só por eventos; a thread do Tk aplica em lotes
+        self.ui = BarramentoUI()
 
         self.setup_layout()
+        self.ui.iniciar(self.root, self.aplicar_eventos)
+        if plano:
+            self.fila.submeter(lambda: self.recuperar_pendentes(plano), PRIORIDADE_FINALIZACAO,
+                               chave="RECUPERACAO", descricao="RECUPERACAO")
 
     def setup_layout(self):
         style = ttk.Style()
@@ -226,6 +258,12 @@ class ModernPDV:
         self.lbl_status = tk.Label(left_panel, text="Caixa Livre", bg="white", fg="gray", font=("Segoe UI", 9))
         self.lbl_status.pack(side=tk.BOTTOM, pady=10)
 
+        fila_frame = tk.Frame(left_panel, bg="white")
+        fila_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.lbl_fila = tk.Label(fila_frame, text="Fila vazia", bg="white", fg="gray", font=("Segoe UI", 9))
+        self.lbl_fila.pack(side=tk.LEFT)
+        tk.Button(fila_frame, text="LIMPAR FILA", relief="flat", command=self.limpar_fila).pack(side=tk.RIGHT)
+
         # === DIREITA (HISTÓRICO) ===
         right_panel = ttk.Frame(container, style="Card.TFrame", padding=15)
         right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -248,7 +286,14 @@ class ModernPDV:
         self.tree.column("status", width=100)
         self.tree.column("data", width=80)
         
-        self.tree.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.tree.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+
+        paginacao = tk.Frame(right_panel, bg="white")
+        paginacao.pack(fill=tk.X, pady=(0, 10))
+        tk.Button(paginacao, text="◀", relief="flat", command=self.pagina_anterior).pack(side=tk.LEFT)
+        tk.Button(paginacao, text="▶", relief="flat", command=self.proxima_pagina).pack(side=tk.RIGHT)
+        self.lbl_pagina = tk.Label(paginacao, text="Página 1/1", bg="white", fg="gray", font=("Segoe UI", 9))
+        self.lbl_pagina.pack()
         
         self.context_menu = tk.Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="Copiar NSU", command=self.copiar_nsu)
@@ -266,30 +311,74 @@ class ModernPDV:
         tk.Button(footer, text="ESTORNAR PENDENTES", bg="#e74c3c", fg="white", font=("Segoe UI", 10, "bold"), command=lambda: self.finalizar_pendentes(False)).pack(side=tk.RIGHT, padx=5)
         tk.Button(footer, text="Nova Venda (Limpar)", command=self.nova_venda).pack(side=tk.LEFT)
 
+        self.atualizar_treeview()
         self.atualizar_interface()
 
     # =========================================================================
     # LÓGICA DE DADOS & UTILS
     # =========================================================================
-    def get_valor(self, entry):
-        try: return float(entry.get().replace(",", "."))
-        except: return 0.0
+    def marcar_original(self, dados_extras, status):
+        """
+        Muda o status da transação cancelada/devolvida (ledger + journal):
+        pelo id quando veio do histórico, senão por NSU + rede + data
+        """
+        id_transacao = dados_extras.get('id')
+        try:
+            if id_transacao is not None:
+                self.journal.atualizar_status(id_transacao, status, commit=True)
+            else:
+                id_transacao = self.journal.atualizar_status_nsu(
+                    dados_extras['nsu'], status, dados_extras.get('rede'), dados_extras.get('data'), commit=True)
+        except TransacaoAmbigua as e:
+            self.ui.publicar(Aviso("Journal", f"{e}\nStatus da transação original não alterado.", "warning"))
+            return
+        t = self.ledger.buscar(id_transacao)
+        if t is not None:
+            self.ledger.mudar_status(t, status)
+            self.ui.publicar(TransacoesAlteradas([t]))
+        self.ui.publicar(InterfaceAlterada())
+
+    def aplicar_eventos(self, lote):
+        """Thread do Tk: um lote do barramento, com cada widget tocado uma vez"""
+        for t in lote.incluidas:
+            self.adicionar_transacao(t)
+        if lote.alteradas:
+            self.atualizar_transacoes(lote.alteradas.values())
+        if lote.interface:
+            self.atualizar_interface()
+        if lote.status:
+            self.lbl_status.config(text=lote.status.texto, fg=lote.status.cor)
+        if lote.fila:
+            self.lbl_fila.config(text=lote.fila.texto)
+        for pergunta in lote.perguntas:
+            PerguntaDialog(self.root, pergunta)
+        for aviso in lote.avisos:
+            AvisoDialog(self.root, aviso)
+
+    def arquivar_fundo(self):
+        """Leva ao arquivo o que foi finalizado no journal (thread própria, sem travar a UI)"""
+        if self._arquivando is not None and self._arquivando.is_alive():
+            return
+        def arquivar():
+            try:
+                self.arquivo.arquivar(self.journal.caminho)
+            except Exception as e:
+                print(f"Erro arquivando transações: {e}")
+        self._arquivando = threading.Thread(target=arquivar, daemon=True, name="tef-arquivo")
+        self._arquivando.start()
+
+    def get_cents(self, entry):
+        return para_cents(entry.get())
 
     def atualizar_interface(self):
-        total = self.get_valor(self.entry_total)
-        pagos = [t['valor_float'] for t in self.historico_transacoes if t['status'] in ["PENDENTE", "CONFIRMADO"]]
-        pago_total = sum(pagos)
-        restante = round(max(0, total - pago_total), 2)
+        total = self.get_cents(self.entry_total)
+        restante = self.ledger.restante_cents(total)
         
-        self.valor_restante = restante
-        self.lbl_restante.config(text=f"RESTANTE: R$ {restante:.2f}", fg="#c0392b" if restante > 0 else "#27ae60")
+        self.valor_restante_cents = restante
+        self.lbl_restante.config(text=f"RESTANTE: R$ {formatar_cents(restante)}", fg="#c0392b" if restante > 0 else "#27ae60")
         
-        if restante > 0:
-            self.entry_pagamento.delete(0, tk.END)
-            self.entry_pagamento.insert(0, f"{restante:.2f}")
-        else:
-            self.entry_pagamento.delete(0, tk.END)
-            self.entry_pagamento.insert(0, "0.00")
+        self.entry_pagamento.delete(0, tk.END)
+        self.entry_pagamento.insert(0, formatar_cents(restante))
 
     def mostrar_menu_contexto(self, event):
         item = self.tree.identify_row(event.y)
@@ -311,16 +400,71 @@ class ModernPDV:
         self.root.clipboard_clear()
         self.root.clipboard_append(item['values'][2])
 
+    def valores_linha(self, t):
+        tipo_display = t.tipo
+        if tipo_display == "CREDITO_PARCELADO":
+            tipo_display = f"CRED PARC ({t.parcelas or '?'}x)"
+        return (t.rede, t.nsu, t.valor_display, tipo_display, t.status, t.data_operacao or '-')
+
+    def pagina_exibida(self):
+        total = max(1, -(-len(self.ledger) // self.LINHAS_POR_PAGINA))
+        pagina = total - 1 if self.pagina is None else min(self.pagina, total - 1)
+        return pagina, total
+
+    def sincronizar_linha(self, t, posicao="end"):
+        """Insere ou atualiza a linha da transação; sem mudança, nenhuma chamada ao Tk"""
+        iid = str(t.id)
+        valores = self.valores_linha(t)
+        anterior = self.valores_tree.get(iid)
+        if anterior is None:
+            self.tree.insert("", posicao, iid=iid, values=valores)
+        elif anterior != valores:
+            self.tree.item(iid, values=valores)
+        else:
+            return
+        self.valores_tree[iid] = valores
+
     def atualizar_treeview(self):
-        for i in self.tree.get_children(): self.tree.delete(i)
-        for t in self.historico_transacoes:
-            tipo_display = t['tipo']
-            if tipo_display == "CREDITO_PARCELADO":
-                tipo_display = f"CRED PARC ({t.get('parcelas', '?')}x)"
-            
-            self.tree.insert("", "end", values=(
-                t['rede'], t['nsu'], f"{t['valor_float']:.2f}", tipo_display, t['status'], t.get('data_operacao', '-')
-            ))
+        """Sincroniza a página exibida com o histórico (custo limitado à página)"""
+        pagina, total = self.pagina_exibida()
+        inicio = pagina * self.LINHAS_POR_PAGINA
+        registros = self.ledger.registros[inicio:inicio + self.LINHAS_POR_PAGINA]
+
+        desejados = {str(t.id) for t in registros}
+        remover = [iid for iid in self.valores_tree if iid not in desejados]
+        if remover:
+            self.tree.delete(*remover)
+            for iid in remover: del self.valores_tree[iid]
+
+        for posicao, t in enumerate(registros):
+            self.sincronizar_linha(t, posicao)
+        self.lbl_pagina.config(text=f"Página {pagina + 1}/{total}")
+
+    def atualizar_transacoes(self, transacoes):
+        """Reflete mudanças de status: O(1) por linha, qualquer que seja o histórico"""
+        for t in transacoes:
+            if str(t.id) in self.valores_tree:
+                self.sincronizar_linha(t)
+
+    def adicionar_transacao(self, t):
+        """Mostra uma transação recém-incluída no fim do histórico"""
+        pagina, total = self.pagina_exibida()
+        if self.pagina is None:
+            if (len(self.ledger) - 1) % self.LINHAS_POR_PAGINA == 0:
+                self.atualizar_treeview()  # abriu página nova
+                return
+            self.sincronizar_linha(t)
+        self.lbl_pagina.config(text=f"Página {pagina + 1}/{total}")
+
+    def pagina_anterior(self):
+        pagina, _ = self.pagina_exibida()
+        self.pagina = max(0, pagina - 1)
+        self.atualizar_treeview()
+
+    def proxima_pagina(self):
+        pagina, total = self.pagina_exibida()
+        self.pagina = None if pagina + 1 >= total - 1 else pagina + 1
+        self.atualizar_treeview()
 
     # =========================================================================
     # CANCELAMENTO INTELIGENTE
@@ -329,26 +473,24 @@ class ModernPDV:
         sel = self.tree.selection()
         
         if sel:
-            idx_tree = self.tree.index(sel[0])
-            if idx_tree < len(self.historico_transacoes):
-                transacao = self.historico_transacoes[idx_tree]
+            transacao = self.ledger.buscar(sel[0])
+            if transacao:
                 
-                if messagebox.askyesno("Cancelar", f"Cancelar transação?\n\nNSU: {transacao['nsu']}\nValor: {transacao['valor_float']}"):
-                    val_cents = str(int(round(transacao['valor_float'] * 100)))
-                    
-                    hora_padrao = datetime.now().strftime("%H%M%S")
+                if messagebox.askyesno("Cancelar", f"Cancelar transação?\n\nNSU: {transacao.nsu}\nValor: {transacao.valor_display}"):
+                    val_cents = transacao.valor_cents
                     
                     dados_extras = {
-                        'nsu': transacao['nsu'],
-                        'data': transacao.get('data_operacao', datetime.now().strftime("%d%m%Y")),
-                        'hora': transacao.get('hora_operacao', hora_padrao),
-                        'rede': transacao['rede']
+                        'nsu': transacao.nsu,
+                        'data': transacao.data_operacao or datetime.now().strftime("%d%m%Y"),
+                        'hora': transacao.hora_operacao or datetime.now().strftime("%H%M%S"),
+                        'rede': transacao.rede,
+                        'id': transacao.id,
                     }
 
-                    if "PIX" in transacao['tipo']:
-                        threading.Thread(target=self.thread_tef, args=("DEVOLUCAO_PIX", val_cents, dados_extras)).start()
+                    if "PIX" in transacao.tipo:
+                        self.enfileirar("DEVOLUCAO_PIX", val_cents, dados_extras)
                     else:
-                        threading.Thread(target=self.thread_tef, args=("CNC", val_cents, dados_extras)).start()
+                        self.enfileirar("CNC", val_cents, dados_extras)
             return
         
         self.popup_cancelamento_cnc_manual()
@@ -360,36 +502,55 @@ class ModernPDV:
             ("Hora Original (HHMMSS):", "hora"),
             ("Valor a Cancelar (Ex: 10.00):", "valor")
         ]
-        dialog = InputDialog(self.root, "Cancelamento Manual (Cartão)", fields)
+        dialog = CancelamentoDialog(self.root, "Cancelamento Manual (Cartão)", fields, self.arquivo.buscar)
         self.root.wait_window(dialog)
         
         if dialog.result:
-            try:
-                val_cents = str(int(round(float(dialog.result['valor'].replace(",", ".")) * 100)))
-                dialog.result['rede'] = "" 
-                threading.Thread(target=self.thread_tef, args=("CNC", val_cents, dialog.result)).start()
-            except ValueError:
+            val_cents = para_cents(dialog.result['valor'])
+            if val_cents <= 0:
                 messagebox.showerror("Erro", "Valor inválido")
+                return
+            self.enfileirar("CNC", val_cents, dialog.result)
 
     # =========================================================================
     # TEF CORE
     # =========================================================================
+    def enfileirar(self, tipo, valor_cents, dados_extras):
+        """Põe a operação na fila do terminal (repetir um pedido idêntico não duplica)"""
+        prioridade = {"CNC": PRIORIDADE_CANCELAMENTO, "DEVOLUCAO_PIX": PRIORIDADE_CANCELAMENTO,
+                      "ADM": PRIORIDADE_ADM}.get(tipo, PRIORIDADE_VENDA)
+        chave = (tipo, valor_cents, self.doc_fiscal, tuple(sorted((dados_extras or {}).items())))
+        total_cents = self.get_cents(self.entry_total)  # widget só na thread do Tk
+        try:
+            return self.fila.submeter(lambda: self.thread_tef(tipo, valor_cents, dados_extras, total_cents),
+                                      prioridade, chave, descricao=tipo)
+        except FilaCheia as e:
+            messagebox.showwarning("Fila TEF", str(e))
+
+    def fila_mudou(self, fila):
+        st = fila.status()
+        texto = f"Fila: {st['na_fila']} aguardando, {st['em_voo']} em execução" if fila.ocupada else "Fila vazia"
+        self.ui.publicar(FilaAlterada(texto))
+
+    def limpar_fila(self):
+        # CNF/NCN já enfileirados não são descartados
+        n = self.fila.cancelar_todos()
+        if n:
+            self.lbl_status.config(text=f"{n} pedido(s) removido(s) da fila", fg="gray")
+
     def iniciar_tef(self, tipo):
-        if self.lock: return
-        
         if tipo == "ADM_GENERICO":
-             threading.Thread(target=self.thread_tef, args=("ADM", 0, None)).start()
+             self.enfileirar("ADM", 0, None)
              return
 
-        val_pagar = self.get_valor(self.entry_pagamento)
-        if val_pagar <= 0: return
+        val_cents = self.get_cents(self.entry_pagamento)
+        if val_cents <= 0: return
 
-        if "PIX" in tipo or "CREDITO" in tipo or "DEBITO" in tipo:
-            if val_pagar > self.valor_restante + 0.01 and any(t['status'] == "PENDENTE" for t in self.historico_transacoes):
+        if tipo in TIPOS_VENDA:
+            if val_cents > self.valor_restante_cents + 1 and self.ledger.quantidade("PENDENTE"):
                 messagebox.showerror("Erro", "Valor excede o restante.")
                 return
 
-        val_cents = str(int(round(val_pagar * 100)))
         dados_extras = None
 
         # TRATAMENTO PARA PARCELADO
@@ -398,173 +559,203 @@ class ModernPDV:
             if not parcelas: return
             dados_extras = {'parcelas': parcelas}
 
-        threading.Thread(target=self.thread_tef, args=(tipo, val_cents, dados_extras)).start()
+        self.enfileirar(tipo, val_cents, dados_extras)
 
-    def thread_tef(self, tipo, valor_cents, dados_extras):
-        self.lock = True
-        self.lbl_status.config(text=f"Processando {tipo}...", fg="blue")
+    async def thread_tef(self, tipo, valor_cents, dados_extras, total_cents):
+        self.ui.publicar(Status(f"Processando {tipo}...", "blue"))
         
         try:
-            # Garante ID sequencial único para o log
-            id_req = SequenceManager.get_next_id()
-            req = {"001-000": id_req}
+            # Restante na hora de enviar: vendas que estavam na fila à frente
+            # já abateram do total (o valor conferido no clique envelhece)
+            restante = self.ledger.restante_cents(total_cents)
+            if tipo in TIPOS_VENDA and self.ledger.pago_cents and valor_cents > restante + 1:
+                self.ui.publicar(Aviso("Erro", f"{tipo} de R$ {formatar_cents(valor_cents)} excede o restante "
+                                               f"(R$ {formatar_cents(restante)}); não enviado.", "error"))
+                return
+
+            # Flag Múltiplos: pagamento parcial ou outras transações ainda pendentes
+            multiplos = valor_cents < restante or self.ledger.quantidade("PENDENTE") > 0
 
             if tipo == "ADM":
-                req["000-000"] = "ADM"
-            
+                res = await self.tef.admin()
             elif tipo == "DEVOLUCAO_PIX":
-                req["000-000"] = "ADM"
-                req["003-000"] = valor_cents
-                req["012-000"] = dados_extras['nsu']
-                req["719-000"] = dados_extras['data']
-                
+                res = await self.tef.pix_refund(valor_cents, dados_extras['nsu'], dados_extras['data'])
             elif tipo == "CNC":
-                req["000-000"] = "CNC"
-                req["002-000"] = self.doc_fiscal
-                req["003-000"] = valor_cents
-                req["012-000"] = dados_extras['nsu']
-                req["022-000"] = dados_extras['data']
-                if dados_extras.get('hora'):
-                     req["023-000"] = dados_extras['hora']
-                if dados_extras.get('rede'):
-                     req["010-000"] = dados_extras['rede']
-
+                res = await self.tef.cancel(valor_cents, dados_extras['nsu'], dados_extras['data'], self.doc_fiscal,
+                                            hora=dados_extras.get('hora'), rede=dados_extras.get('rede'))
             elif tipo == "PIX_PAGAMENTO":
-                req["000-000"] = "QRC"
-                req["002-000"] = self.doc_fiscal
-                req["003-000"] = valor_cents
-                
-            else: # CREDITO / DEBITO / PARCELADO
-                req["000-000"] = "CRT"
-                req["002-000"] = self.doc_fiscal
-                req["003-000"] = valor_cents
-                
-                if tipo == "CREDITO":
-                    req["011-000"] = "10"
-                elif tipo == "DEBITO":
-                    req["011-000"] = "20"
-                elif tipo == "CREDITO_PARCELADO":
-                    # 11 = Parcelado Loja (Sem Juros)
-                    req["011-000"] = "11" 
-                    # 018-000 = Quantidade de parcelas (formato 02, 03...)
-                    if dados_extras and 'parcelas' in dados_extras:
-                        req["018-000"] = str(dados_extras['parcelas']).zfill(2)
-
-            # Flag Múltiplos
-            pendentes = [t for t in self.historico_transacoes if t['status'] == "PENDENTE"]
-            if tipo in ["CRT", "PIX_PAGAMENTO", "CREDITO", "DEBITO", "CREDITO_PARCELADO"] and (float(valor_cents)/100 < self.valor_restante or pendentes):
-                req["099-000"] = "1"
-
-            if not TefFileHandler.write_request(req): raise Exception("Erro ao gravar arquivo.")
-            resp, status = TefFileHandler.wait_response()
-            if not resp: raise Exception(status)
-
-            cod = resp.get("009-000")
-            msg = resp.get("030-000", "")
-
-            if cod == "0":
+                res = await self.tef.pix(valor_cents, self.doc_fiscal, multiplos)
+            elif tipo == "CREDITO_PARCELADO":
+                res = await self.tef.installment(valor_cents, dados_extras['parcelas'], self.doc_fiscal, multiplos)
+            elif tipo == "DEBITO":
+                res = await self.tef.debit(valor_cents, self.doc_fiscal, multiplos)
+            else:
+                res = await self.tef.credit(valor_cents, self.doc_fiscal, multiplos)
+
+            msg = res.mensagem
+
+            if res.aprovado:
                 if tipo == "DEVOLUCAO_PIX":
-                    messagebox.showinfo("Sucesso", f"PIX Devolvido!\n{msg}")
+                    self.ui.publicar(Aviso("Sucesso", f"PIX Devolvido!\n{msg}"))
                     if dados_extras and dados_extras.get('nsu'):
-                        for t in self.historico_transacoes:
-                            if t['nsu'] == dados_extras['nsu']:
-                                t['status'] = "DEVOLVIDO (PIX)"
-                        self.root.after(0, self.atualizar_treeview)
+                        self.marcar_original(dados_extras, "DEVOLVIDO (PIX)")
                 
                 elif tipo == "CNC":
-                    if messagebox.askyesno("Confirmar Estorno", f"Estorno Aprovado.\n{msg}\nConfirmar operação?"):
-                        self.enviar_confirmacao_imediata(id_req, resp)
-                        if dados_extras and dados_extras.get('nsu'):
-                            for t in self.historico_transacoes:
-                                if t['nsu'] == dados_extras['nsu']:
-                                    t['status'] = "CANCELADO"
-                        self.root.after(0, self.atualizar_treeview)
+                    # A decisão do operador não segura o terminal: o CNF/NCN
+                    # entra na fila (prioridade de finalização) quando ela chegar
+                    self._acompanhar(self.decidir_estorno(res, dados_extras))
 
                 elif tipo == "ADM":
-                    messagebox.showinfo("ADM", f"{msg}")
+                    self.ui.publicar(Aviso("ADM", f"{msg}"))
 
                 else:
-                    data_op = resp.get("022-000") or resp.get("015-000")
-                    hora_op = resp.get("023-000") or resp.get("016-000")
-
-                    if data_op and len(data_op) > 8: data_op = data_op[:8] 
-                    if hora_op and len(hora_op) > 6: hora_op = hora_op[:6]
-
-                    dados = {
-                        "id_req": id_req,
-                        "nsu": resp.get("012-000"),
-                        "rede": resp.get("010-000"),
-                        "finalizacao": resp.get("027-000"),
-                        "valor_float": float(valor_cents)/100,
-                        "tipo": tipo,
-                        "parcelas": dados_extras['parcelas'] if dados_extras and 'parcelas' in dados_extras else "",
-                        "data_operacao": data_op if data_op else datetime.now().strftime("%d%m%Y"),
-                        "hora_operacao": hora_op if hora_op else datetime.now().strftime("%H%M%S"),
-                        "status": "PENDENTE"
-                    }
-                    self.historico_transacoes.append(dados)
-                    self.root.after(0, self.atualizar_treeview)
-                    self.root.after(0, self.atualizar_interface)
+                    transacao = Transacao(
+                        valor_cents, tipo, "PENDENTE",
+                        id_req=res.id_req,
+                        nsu=res.nsu,
+                        rede=res.rede,
+                        finalizacao=res.finalizacao,
+                        parcelas=dados_extras['parcelas'] if dados_extras and 'parcelas' in dados_extras else "",
+                        data_operacao=res.data_operacao,
+                        hora_operacao=res.hora_operacao,
+                        doc_fiscal=self.doc_fiscal,
+                        lane=res.lane,
+                    )
+                    # Grava já: até o CNF/NCN, o journal é o único registro da venda
+                    transacao.id = self.journal.registrar(transacao, commit=True)
+                    self.ledger.adicionar(transacao)
+                    self.ui.publicar(TransacaoIncluida(transacao))
+                    self.ui.publicar(InterfaceAlterada())
             else:
-                messagebox.showwarning("Recusado", f"Erro TEF: {msg}")
+                self.ui.publicar(Aviso("Recusado", f"Erro TEF: {msg}", "warning"))
 
         except Exception as e:
-            messagebox.showerror("Erro", str(e))
+            self.ui.publicar(Aviso("Erro", str(e), "error"))
         finally:
-            self.lock = False
-            self.root.after(0, lambda: self.lbl_status.config(text="Livre", fg="gray"))
-
-    def enviar_confirmacao_imediata(self, id_original, resp_dados):
-        id_cnf = SequenceManager.get_next_id()
-        req = {
-            "000-000": "CNF",
-            "001-000": id_cnf,
-            "002-000": self.doc_fiscal,
-            "010-000": resp_dados.get("010-000"),
-            "012-000": resp_dados.get("012-000"),
-            "027-000": resp_dados.get("027-000")
-        }
-        TefFileHandler.write_request(req)
+            self.ui.publicar(Status("Livre"))
+
+    def _acompanhar(self, coro):
+        """Loop TEF: agenda `coro` guardando a tarefa até ela terminar"""
+        tarefa = asyncio.ensure_future(coro)
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefa_concluida)
+
+    def _tarefa_concluida(self, tarefa):
+        self._tarefas.discard(tarefa)
+        if tarefa.cancelled() or tarefa.exception() is None:
+            return
+        e = tarefa.exception()
+        print(f"Erro em tarefa TEF: {e!r}")
+        self.ui.publicar(Aviso("Erro", f"{e}\nVerifique as pendências (tefip.py pendentes).", "error"))
+
+    async def decidir_estorno(self, res, dados_extras):
+        """Pergunta se confirma o CNC aprovado; sem resposta no prazo, desfaz (NCN)"""
+        confirmar = await perguntar(self.ui, "Confirmar Estorno",
+                                    f"Estorno Aprovado.\n{res.mensagem}\nConfirmar operação?",
+                                    TefConfig.PERGUNTA_PRAZO, padrao=False)
+        original = dados_extras if dados_extras and dados_extras.get('nsu') else None
+
+        async def finalizar():
+            finalizar_tef = self.tef.confirm if confirmar else self.tef.undo
+            fim = await finalizar_tef(res.rede, res.nsu, res.finalizacao, self.doc_fiscal)
+            if not fim.reconhecido:
+                self.ui.publicar(Aviso("Estorno", f"NSU {res.nsu}: {fim.mensagem}", "warning"))
+            elif confirmar and original:
+                self.marcar_original(original, "CANCELADO")
+                self.arquivar_fundo()
+
+        self.fila.submeter(finalizar, PRIORIDADE_FINALIZACAO, chave=("ESTORNO", res.nsu),
+                           descricao="CNF" if confirmar else "NCN")
+
+    async def recuperar_pendentes(self, plano):
+        """CNF/NCN das transações deixadas abertas por uma execução anterior"""
+        self.ui.publicar(Status(f"Recuperando {len(plano)} pendente(s)...", "blue"))
+
+        def ao_finalizar(t, confirmar, res):
+            if res.reconhecido:
+                novo_status = status_final(confirmar)
+                self.anteriores.mudar_status(t, novo_status)
+                self.journal.atualizar_status(t.id, novo_status)
+                self.ui.publicar(TransacoesAlteradas([t]))
+
+        try:
+            resultados = await recuperar({None: self.tef}, plano, TefConfig.RECUPERACAO_TRABALHADORES,
+                                         ao_finalizar=ao_finalizar)
+        finally:
+            self.journal.flush()
+            self.ui.publicar(Status("Livre"))
+
+        self.ui.publicar(InterfaceAlterada())
+        falhas = [r for r in resultados if not r.reconhecido]
+        if falhas:
+            detalhes = "\n".join(f"NSU {r.nsu} ({r.comando}): {r.mensagem}" for r in falhas)
+            msg = f"{len(falhas)} de {len(resultados)} pendências não recuperadas (continuam PENDENTE):\n{detalhes}"
+            self.ui.publicar(Aviso("Recuperação", msg, "warning"))
+
+    def _pendentes(self):
+        """PENDENTE da venda e das execuções anteriores (recuperação que falhou)"""
+        return self.anteriores.com_status("PENDENTE") + self.ledger.com_status("PENDENTE")
+
+    def _ledger_de(self, t):
+        return self.ledger if self.ledger.buscar(t.id) is t else self.anteriores
 
     def finalizar_pendentes(self, confirmar):
-        pendentes = [t for t in self.historico_transacoes if t['status'] == "PENDENTE"]
+        pendentes = self._pendentes()
         if not pendentes: return
         
         acao = "CONFIRMAR" if confirmar else "ESTORNAR"
         if not messagebox.askyesno("Finalizar", f"Deseja {acao} {len(pendentes)} transações?"): return
 
-        def process_batch():
-            self.lock = True
-            cmd = "CNF" if confirmar else "NCN"
+        async def process_batch():
             novo_status = "CONFIRMADO" if confirmar else "ESTORNADO"
+            # Relê na execução: a recuperação ou outro lote pode ter finalizado
+            # parte do que estava PENDENTE no clique
+            pendentes = self._pendentes()
+            if not pendentes:
+                self.ui.publicar(Aviso("Fim", "Nenhuma transação pendente."))
+                return
+            # Intenção no journal antes do primeiro CNF/NCN: um crash no meio
+            # do lote é retomado na próxima partida com o mesmo comando
+            for t in pendentes:
+                self.journal.atualizar_status(t.id, CONFIRMANDO if confirmar else ESTORNANDO)
+            self.journal.flush()
+
+            def ao_finalizar(i, res):
+                # Só marca o registro depois do STS do CTFClient
+                if res.reconhecido:
+                    self._ledger_de(pendentes[i]).mudar_status(pendentes[i], novo_status)
+                    self.journal.atualizar_status(pendentes[i].id, novo_status)
+                    self.ui.publicar(TransacoesAlteradas([pendentes[i]]))
+                self.ui.publicar(Status(f"{acao}: {i + 1}/{len(pendentes)}", "blue"))
+
+            # Cada item com o documento fiscal da venda dele
+            itens = [(t.rede, t.nsu, t.finalizacao, t.doc_fiscal) for t in pendentes]
+            try:
+                resultados = await self.tef.finalizar_lote(itens, confirmar, self.doc_fiscal, ao_finalizar=ao_finalizar)
+            finally:
+                self.journal.flush()
+                self.ui.publicar(Status("Livre"))
+
+            self.ui.publicar(InterfaceAlterada())
+            self.arquivar_fundo()
             
-            for item in pendentes:
-                # Cada CNF ganha um ID SEQUENCIAL ÚNICO
-                id_cnf = SequenceManager.get_next_id()
-                req = {
-                    "000-000": cmd,
-                    "001-000": id_cnf,
-                    "002-000": self.doc_fiscal,
-                    "010-000": item['rede'],
-                    "012-000": item['nsu'],
-                    "027-000": item['finalizacao'],
-                    "099-000": "1"
-                }
-                TefFileHandler.write_request(req)
-                item['status'] = novo_status
-                time.sleep(1.0) 
-
-            self.root.after(0, self.atualizar_treeview)
-            self.root.after(0, self.atualizar_interface)
-            
-            msg = "Finalizado com Sucesso!" if confirmar else "Estornos Solicitados."
-            self.root.after(0, lambda: messagebox.showinfo("Fim", msg))
-            self.lock = False
+            falhas = [r for r in resultados if not r.reconhecido]
+            if falhas:
+                detalhes = "\n".join(f"NSU {r.nsu}: {r.mensagem}" for r in falhas)
+                msg = f"{len(falhas)} de {len(resultados)} sem reconhecimento (continuam PENDENTE):\n{detalhes}"
+                self.ui.publicar(Aviso("Fim", msg, "warning"))
+            else:
+                msg = "Finalizado com Sucesso!" if confirmar else "Estornos Solicitados."
+                self.ui.publicar(Aviso("Fim", msg))
 
-        threading.Thread(target=process_batch).start()
+        # Uma finalização por vez na fila: CONFIRMAR e ESTORNAR nunca disputam os mesmos NSUs
+        pedido = self.fila.submeter(process_batch, PRIORIDADE_FINALIZACAO, chave="FINALIZAR", descricao=acao)
+        if pedido.descricao != acao:
+            messagebox.showwarning("Finalizar", f"Já há um lote {pedido.descricao} na fila; aguarde o fim dele.")
 
     def nova_venda(self):
-        self.historico_transacoes = []
+        self.ledger = Ledger()
+        self.pagina = None
         self.doc_fiscal = str(int(self.doc_fiscal) + 1)
         self.entry_total.config(state=tk.NORMAL)
         self.entry_total.delete(0, tk.END)
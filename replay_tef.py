@@ -0,0 +1,209 @@
+"""
+Replay de uma captura IntPos (TefConfig.CAPTURA) contra um respondedor local.
+
+    python replay_tef.py CAPTURA [--velocidade 1|N|0] [--json ARQUIVO] [--capturar ARQUIVO]
+    python replay_tef.py --verificar     # captura do simulador -> replay (ida e volta)
+
+Cada lane capturada ganha um diretório temporário atendido por um
+SimuladorLane que devolve, na ordem, o STS e a resposta gravados, com os
+mesmos atrasos divididos pela velocidade; a resposta leva o 001-000 do
+pedido vivo, já que a sequência do replay recomeça. Os pedidos passam pelo
+TefDispatcher/TefClient nos mesmos instantes relativos da captura
+(velocidade 0 = o mais rápido possível, sem esperas).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+import tef_codec
+import tef_captura
+from tef_protocolo import TefConfig
+from tef_client import TefError
+from tef_dispatcher import TefDispatcher
+from simulador_ctfclient import SimuladorLane, PerfilSimulador, SEM_RESPOSTA
+from benchmark_tef import resumo_latencias
+
+
+class RespondedorReplay(SimuladorLane):
+    """CTFClient que responde com as trocas capturadas, na ordem"""
+
+    def __init__(self, dir_base, trocas, velocidade):
+        super().__init__(dir_base, PerfilSimulador(semente=0))
+        self.trocas = deque(trocas)
+        self.fator = 1.0 / velocidade if velocidade else 0.0
+
+    def atender(self, pedido):
+        if not self.trocas:
+            self.contadores["sem_sts"] += 1
+            return
+        troca = self.trocas.popleft()
+        if troca.sts_apos is None:
+            self.contadores["sem_sts"] += 1
+            return
+        time.sleep(troca.sts_apos * self.fator)
+        self._gravar(os.path.join(self.dir_resp, "IntPos.Sts"),
+                     tef_codec.serializar({"000-000": pedido.get("000-000"), "001-000": pedido.get("001-000")},
+                                          self.perfil.encoding, validacao=False))
+        if troca.resposta is None:
+            return
+        time.sleep(max(0.0, troca.resposta_apos - troca.sts_apos) * self.fator)
+        self._gravar(os.path.join(self.dir_resp, "IntPos.001"), self._resposta(troca.resposta, pedido))
+
+    def _resposta(self, bruto, pedido):
+        """Resposta capturada com o 001-000 do pedido do replay (o wait_response recusa outro)"""
+        resposta = tef_codec.parse(bruto, self.perfil.encoding)
+        if "001-000" in resposta:
+            resposta["001-000"] = pedido.get("001-000")
+        quebra = "\r\n" if b"\r\n" in bruto else "\n"
+        return tef_codec.serializar(resposta, self.perfil.encoding, validacao=False, quebra=quebra)
+
+
+def _campos(troca):
+    req = tef_codec.parse(troca.pedido, TefConfig.ENCODING)
+    # 001-000 novo é atribuído pelo TefClient
+    return {k: v for k, v in req.items() if k not in ("001-000", tef_codec.TERMINADOR)}
+
+
+def executar_replay(caminho, velocidade=1.0, dir_tmp=None, timeout=None):
+    lista = tef_captura.trocas(caminho)
+    if not lista:
+        return {"trocas": 0}
+    lanes = sorted({t.lane for t in lista})
+    dir_tmp = dir_tmp or tempfile.mkdtemp(prefix="replay_tef_")
+    bases = {lane: os.path.join(dir_tmp, f"lane{i}") for i, lane in enumerate(lanes)}
+    dispatcher = TefDispatcher.from_config([bases[l] for l in lanes], timeout=timeout)
+    nomes = {lane: f"L{i + 1:02d}" for i, lane in enumerate(lanes)}
+    dispatcher.setup_directories()
+
+    respondedores = [RespondedorReplay(bases[l], [t for t in lista if t.lane == l], velocidade) for l in lanes]
+    for r in respondedores:
+        threading.Thread(target=r.executar, daemon=True, name=f"replay-{r.dir_req}").start()
+
+    t0 = lista[0].ts
+    latencias = {}
+    originais = {}
+    falhas = []
+
+    async def lane(nome_original, trocas_lane):
+        loop = asyncio.get_running_loop()
+        for troca in trocas_lane:
+            if velocidade:
+                espera = inicio + (troca.ts - t0) / velocidade - loop.time()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+            campos = _campos(troca)
+            comando = campos.get("000-000", "")
+            t = time.perf_counter()
+            try:
+                await dispatcher.submeter("executar", campos, comando not in SEM_RESPOSTA, lane=nomes[nome_original])
+            except TefError as e:
+                falhas.append(f"{comando}: {e}")
+                continue
+            latencias.setdefault(comando, []).append(time.perf_counter() - t)
+            original = troca.resposta_apos if troca.resposta_apos is not None else troca.sts_apos
+            if original is not None:
+                originais.setdefault(comando, []).append(original)
+
+    async def todas():
+        nonlocal inicio
+        inicio = asyncio.get_running_loop().time()
+        await asyncio.gather(*(lane(l, [t for t in lista if t.lane == l]) for l in lanes))
+
+    inicio = 0.0
+    comeco = time.perf_counter()
+    try:
+        asyncio.run(todas())
+    finally:
+        duracao = time.perf_counter() - comeco
+        for r in respondedores:
+            r.parar()
+        dispatcher.close()
+
+    return {
+        "trocas": len(lista),
+        "lanes": len(lanes),
+        "velocidade": velocidade,
+        "duracao_original_s": lista[-1].ts - t0,
+        "duracao_s": duracao,
+        "falhas": len(falhas),
+        "exemplos_falha": falhas[:5],
+        "por_comando": {c: {**resumo_latencias(v),
+                            "original_p50_ms": resumo_latencias(originais[c])["p50_ms"] if originais.get(c) else None}
+                        for c, v in sorted(latencias.items())},
+    }
+
+
+def verificar_ida_e_volta(dir_tmp, transacoes=3, inicio_sequencia=5000, timeout=10):
+    """
+    Captura CRT + CNF contra o simulador com a sequência em
+    `inicio_sequencia` e faz o replay da captura (sequência nova, a partir
+    de 1): toda troca precisa passar.
+    """
+    import simulador_ctfclient
+    from tef_client import TefClient
+    from tef_protocolo import TefFileHandler, arquivo_sequencia
+
+    base = os.path.join(dir_tmp, "origem")
+    caminho = os.path.join(dir_tmp, "captura.bin")
+    os.makedirs(base, exist_ok=True)
+    with open(arquivo_sequencia(base), "w") as f:
+        f.write(str(inicio_sequencia - 1))
+    perfil = PerfilSimulador(taxa_recusa=0.0, semente=1)
+    perfil.escalar(0.0)
+    simuladores = simulador_ctfclient.iniciar([base], perfil)
+    captura = tef_captura.CapturaIntPos(caminho)
+    handler = TefFileHandler(base, captura=captura)
+    tef = TefClient(handler, timeout=timeout)
+
+    async def capturar():
+        for _ in range(transacoes):
+            res = await tef.credit(1000, "1001")
+            await tef.confirm(res.rede, res.nsu, res.finalizacao, "1001")
+
+    try:
+        asyncio.run(capturar())
+    finally:
+        for sim in simuladores:
+            sim.parar()
+        handler.close()
+        captura.close()
+    return executar_replay(caminho, 0, os.path.join(dir_tmp, "replay"), timeout)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("captura", nargs="?")
+    ap.add_argument("--velocidade", type=float, default=1.0, help="1 = tempo real, N = N vezes, 0 = sem esperas")
+    ap.add_argument("--timeout", type=float, default=None,
+                    help="prazo fixo de resposta em segundos (padrão: adaptativo, TefConfig.TIMEOUT_LIMITES)")
+    ap.add_argument("--json", help="grava o resultado em JSON neste arquivo")
+    ap.add_argument("--capturar", help="captura o próprio replay neste arquivo")
+    ap.add_argument("--verificar", action="store_true",
+                    help="captura trocas do simulador e confere o replay delas")
+    args = ap.parse_args(argv)
+    if not args.captura and not args.verificar:
+        ap.error("informe a CAPTURA ou --verificar")
+
+    # Sem isso o replay gravaria na captura configurada do PDV
+    TefConfig.CAPTURA = args.capturar
+    with tempfile.TemporaryDirectory(prefix="replay_tef_") as dir_tmp:
+        if args.verificar:
+            resultado = verificar_ida_e_volta(dir_tmp, timeout=args.timeout or 10)
+        else:
+            resultado = executar_replay(args.captura, args.velocidade, dir_tmp, args.timeout)
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(texto)
+    print(texto)
+    return 1 if resultado.get("falhas") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
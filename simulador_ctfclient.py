@@ -0,0 +1,208 @@
+"""
+Simulador local do CTFClient para testes de carga do protocolo IntPos.
+
+    python simulador_ctfclient.py DIR_BASE [DIR_BASE ...] [opções]
+
+Observa DIR_BASE/REQ/IntPos.001, grava DIR_BASE/RESP/IntPos.Sts e, para
+comandos com resposta, DIR_BASE/RESP/IntPos.001. Aponte TefConfig.DIR_BASE
+(ou TefConfig.LANES) para os mesmos diretórios.
+"""
+import os
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+
+import tef_codec
+from tef_watcher import criar_watcher
+
+REDES = ("REDE", "CIELO", "GETNET", "STONE")
+
+# Comandos sem IntPos.001 de resposta: só o STS
+SEM_RESPOSTA = ("CNF", "NCN")
+
+
+class PerfilSimulador:
+    """Distribuições e taxas de falha configuráveis"""
+
+    def __init__(self, latencia_sts=(0.005, 0.002), latencia_resp=None, taxa_recusa=0.05,
+                 taxa_sem_sts=0.0, taxa_escrita_parcial=0.0, pausa_parcial=0.2,
+                 linhas_comprovante=20, encoding=tef_codec.ENCODING_PADRAO, semente=None):
+        # (média, desvio) em segundos, distribuição log-normal truncada em 0
+        self.latencia_sts = latencia_sts
+        self.latencia_resp = latencia_resp or {
+            "CRT": (1.5, 0.5),
+            "QRC": (6.0, 3.0),
+            "CNC": (1.5, 0.5),
+            "ADM": (0.5, 0.2),
+        }
+        self.taxa_recusa = taxa_recusa
+        self.taxa_sem_sts = taxa_sem_sts
+        self.taxa_escrita_parcial = taxa_escrita_parcial
+        self.pausa_parcial = pausa_parcial
+        self.linhas_comprovante = linhas_comprovante
+        self.encoding = encoding
+        self.rng = random.Random(semente)
+
+    def sortear(self, media_desvio):
+        media, desvio = media_desvio
+        if media <= 0:
+            return 0.0
+        if desvio <= 0:
+            return media
+        # Log-normal com a média/desvio pedidos: cauda longa como na vida real
+        sigma2 = math.log(1 + (desvio / media) ** 2)
+        mu = math.log(media) - sigma2 / 2
+        return self.rng.lognormvariate(mu, math.sqrt(sigma2))
+
+    def escalar(self, fator):
+        """Multiplica todas as latências (fator 0 = resposta imediata)"""
+        self.latencia_sts = (self.latencia_sts[0] * fator, self.latencia_sts[1] * fator)
+        self.latencia_resp = {k: (m * fator, d * fator) for k, (m, d) in self.latencia_resp.items()}
+
+
+class SimuladorLane:
+    """Um CTFClient simulado atendendo um diretório base"""
+
+    def __init__(self, dir_base, perfil):
+        self.dir_req = os.path.join(dir_base, "REQ")
+        self.dir_resp = os.path.join(dir_base, "RESP")
+        os.makedirs(self.dir_req, exist_ok=True)
+        os.makedirs(self.dir_resp, exist_ok=True)
+        self.perfil = perfil
+        self.watcher = criar_watcher([self.dir_req])
+        self._nsu = perfil.rng.randint(100000, 900000)
+        self._parar = threading.Event()
+        self.contadores = {"pedidos": 0, "aprovados": 0, "recusados": 0, "sem_sts": 0, "parciais": 0}
+
+    def parar(self):
+        self._parar.set()
+
+    def executar(self):
+        req_path = os.path.join(self.dir_req, "IntPos.001")
+        while not self._parar.is_set():
+            if not self.watcher.aguardar(req_path, 0.5, intervalo=0.01):
+                continue
+            try:
+                with open(req_path, "rb") as f:
+                    pedido = tef_codec.parse(f.read(), self.perfil.encoding)
+                os.remove(req_path)
+            except OSError:
+                continue
+            if not pedido.completa:
+                continue
+            self.contadores["pedidos"] += 1
+            self.atender(pedido)
+        self.watcher.close()
+
+    def atender(self, pedido):
+        perfil = self.perfil
+        comando = pedido.get("000-000", "")
+
+        time.sleep(perfil.sortear(perfil.latencia_sts))
+        if perfil.rng.random() < perfil.taxa_sem_sts:
+            self.contadores["sem_sts"] += 1
+            return
+        self._gravar(os.path.join(self.dir_resp, "IntPos.Sts"),
+                     tef_codec.serializar({"000-000": comando, "001-000": pedido.get("001-000")},
+                                          perfil.encoding, validacao=False))
+        if comando in SEM_RESPOSTA:
+            return
+
+        time.sleep(perfil.sortear(perfil.latencia_resp.get(comando, (1.0, 0.3))))
+        resposta = self.montar_resposta(pedido)
+        dados = tef_codec.serializar(resposta, perfil.encoding, validacao=False)
+        destino = os.path.join(self.dir_resp, "IntPos.001")
+
+        if perfil.rng.random() < perfil.taxa_escrita_parcial:
+            # Grava direto no destino, em duas metades, sem rename atômico
+            self.contadores["parciais"] += 1
+            meio = len(dados) // 2
+            with open(destino, "wb") as f:
+                f.write(dados[:meio])
+                f.flush()
+                time.sleep(perfil.pausa_parcial)
+                f.write(dados[meio:])
+        else:
+            self._gravar(destino, dados)
+
+    def montar_resposta(self, pedido):
+        perfil = self.perfil
+        comando = pedido.get("000-000", "")
+        agora = datetime.now()
+        recusado = perfil.rng.random() < perfil.taxa_recusa
+        self._nsu += 1
+
+        resp = {
+            "000-000": comando,
+            "001-000": pedido.get("001-000"),
+            "002-000": pedido.get("002-000"),
+            "003-000": pedido.get("003-000"),
+            "009-000": "5" if recusado else "0",
+            "010-000": pedido.get("010-000") or perfil.rng.choice(REDES),
+            "012-000": pedido.get("012-000") if comando == "CNC" else str(self._nsu),
+            "022-000": agora.strftime("%d%m%Y"),
+            "023-000": agora.strftime("%H%M%S"),
+        }
+        if recusado:
+            self.contadores["recusados"] += 1
+            resp["030-000"] = "TRANSACAO NEGADA"
+            return resp
+
+        resp["027-000"] = f"{agora:%Y%m%d%H%M%S}{self._nsu:08d}"
+        resp["028-000"] = str(perfil.linhas_comprovante)
+        for i in range(1, perfil.linhas_comprovante + 1):
+            resp[f"029-{i:03d}"] = f"\"COMPROVANTE {comando} LINHA {i:02d}\""
+        resp["030-000"] = "TRANSACAO APROVADA" if comando != "ADM" else "OPERACAO ADMINISTRATIVA OK"
+        self.contadores["aprovados"] += 1
+        return resp
+
+    def _gravar(self, destino, dados):
+        tmp = destino + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(dados)
+        os.replace(tmp, destino)
+
+
+def iniciar(bases, perfil=None):
+    """Sobe um simulador por diretório base em threads daemon"""
+    perfil = perfil or PerfilSimulador()
+    lanes = [SimuladorLane(b, perfil) for b in bases]
+    for lane in lanes:
+        threading.Thread(target=lane.executar, daemon=True, name=f"sim-{lane.dir_req}").start()
+    return lanes
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Simulador local do CTFClient (IntPos)")
+    ap.add_argument("bases", nargs="+", help="diretórios base (com REQ/RESP)")
+    ap.add_argument("--escala-latencia", type=float, default=1.0,
+                    help="multiplica as latências padrão (0 = imediato)")
+    ap.add_argument("--taxa-recusa", type=float, default=0.05)
+    ap.add_argument("--taxa-sem-sts", type=float, default=0.0)
+    ap.add_argument("--taxa-escrita-parcial", type=float, default=0.0)
+    ap.add_argument("--linhas-comprovante", type=int, default=20)
+    ap.add_argument("--encoding", default=tef_codec.ENCODING_PADRAO)
+    ap.add_argument("--semente", type=int)
+    args = ap.parse_args(argv)
+
+    perfil = PerfilSimulador(taxa_recusa=args.taxa_recusa, taxa_sem_sts=args.taxa_sem_sts,
+                             taxa_escrita_parcial=args.taxa_escrita_parcial,
+                             linhas_comprovante=args.linhas_comprovante,
+                             encoding=args.encoding, semente=args.semente)
+    perfil.escalar(args.escala_latencia)
+    lanes = iniciar(args.bases, perfil)
+    print(f"Simulando {len(lanes)} CTFClient(s). Ctrl+C para encerrar.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for lane in lanes:
+            lane.parar()
+            print(lane.dir_req, lane.contadores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""
+Arquivo das transações finalizadas, em fragmentos por dia, com índice de
+NSU ordenado e mapeado em memória.
+
+    python tef_arquivo.py [--journal ARQ] [--dir DIR]        # arquiva o que falta
+    python tef_arquivo.py --buscar NSU [--limite N]          # NSU inteiro ou parcial
+
+Fragmento DIR/AAAAMMDD.tefa: registros de tamanho fixo, só acrescentados.
+Índices DIR/nsu.idx (chave = NSU) e DIR/nsu_fim.idx (chave = NSU ao
+contrário, para buscar pelos últimos dígitos): entradas de tamanho fixo
+ordenadas pela chave. Cada arquivamento grava só um delta ordenado
+(nsu.idx.NNNNNN / nsu_fim.idx.NNNNNN) com as entradas novas; passando de
+DELTAS_MAX, os deltas são mesclados entre si, ou com a base quando já
+somam 1/FATOR_BASE dela. A busca é binária direto no mmap de cada camada;
+nada do arquivo é carregado na memória. estado.json lista as camadas e
+guarda o último eventos.seq do journal já arquivado.
+"""
+import os
+import sys
+import json
+import mmap
+import sqlite3
+import struct
+import heapq
+import argparse
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+from tef_protocolo import TefConfig
+from tef_journal import STATUS_ABERTOS
+from tef_ledger import Transacao
+
+# =============================================================================
+# FORMATO
+# =============================================================================
+MAGICO_FRAGMENTO = b"TEFA2\n\0\0"
+MAGICO_INDICE = b"TEFX2\n\0\0"
+VERSAO = 2  # v1: NSU cortado em 16 bytes e marca d'água por atualizado_em
+
+# id, valor_cents, nsu, rede, data (DDMMAAAA), hora (HHMMSS), parcelas, tipo, status
+_REGISTRO = struct.Struct("<qq20s16s8s6s2s20s20s")
+# chave (NSU, preenchida com \0), dia AAAAMMDD, posição no fragmento, id do journal
+_ENTRADA = struct.Struct("<20sIIq")
+_TAM_CHAVE = 20  # 012-000 tem até 20 caracteres (tef_codec)
+
+INDICE_NSU = "nsu.idx"
+INDICE_FIM = "nsu_fim.idx"
+ESTADO = "estado.json"
+DELTAS_MAX = 8
+FATOR_BASE = 4
+
+# Transações com evento novo desde a marca d'água, já finalizadas; o
+# último seq de cada uma vira a próxima marca d'água
+_SQL_FINALIZADAS = """
+SELECT t.id, t.valor_cents, t.nsu, t.rede, t.data_operacao, t.hora_operacao, t.parcelas, t.tipo, t.status,
+       t.criado_em, MAX(e.seq)
+  FROM eventos e JOIN transacoes t ON t.id = e.transacao_id
+ WHERE e.seq > ? AND t.status NOT IN ({abertos}) AND t.nsu <> ''
+ GROUP BY t.id
+ ORDER BY MAX(e.seq)
+"""
+
+
+def _b(texto, tamanho):
+    return str(texto or "").encode("utf-8")[:tamanho]
+
+
+def _s(dados):
+    return dados.rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+def _estado_novo():
+    return {"versao": VERSAO, "ultimo_seq": 0, "registros": 0, "deltas": [], "proximo_delta": 1}
+
+
+def _ler_entradas(caminho):
+    """Entradas de um .idx na ordem do arquivo, lidas do mmap aos poucos"""
+    try:
+        f = open(caminho, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        if os.fstat(f.fileno()).st_size <= len(MAGICO_INDICE):
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:len(MAGICO_INDICE)] != MAGICO_INDICE:
+                raise ValueError(f"{caminho}: não é um índice do arquivo TEF")
+            n = (len(mm) - len(MAGICO_INDICE)) // _ENTRADA.size
+            for i in range(n):
+                yield _ENTRADA.unpack_from(mm, len(MAGICO_INDICE) + i * _ENTRADA.size)
+        finally:
+            mm.close()
+
+
+def _rotular(entradas, camada):
+    for e in entradas:
+        yield (*e, camada)
+
+
+def _gravar_indice(caminho, entradas):
+    """Grava entradas já ordenadas num .idx (quem publica é o estado.json ou o os.replace de quem chama)"""
+    with open(caminho, "wb") as f:
+        f.write(MAGICO_INDICE)
+        bloco = []
+        for e in entradas:
+            bloco.append(_ENTRADA.pack(*e))
+            if len(bloco) >= 4096:
+                f.write(b"".join(bloco))
+                bloco.clear()
+        f.write(b"".join(bloco))
+
+
+def _dia(data_operacao, criado_em):
+    """DDMMAAAA do CTFClient -> AAAAMMDD; sem data, o dia do registro no journal"""
+    d = data_operacao or ""
+    if len(d) == 8 and d.isdigit():
+        return int(d[4:] + d[2:4] + d[:2])
+    return int(datetime.fromtimestamp(criado_em).strftime("%Y%m%d"))
+
+
+class _Indice:
+    """Entradas ordenadas de um arquivo .idx, lidas pelo mmap"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mm = None
+        self._assinatura = None
+        self.n = 0
+
+    def _abrir(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            self.fechar()
+            return
+        assinatura = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if assinatura == self._assinatura:
+            return
+        # Trocado por outro arquivamento (os.replace): remapeia
+        self.fechar()
+        if st.st_size <= len(MAGICO_INDICE):
+            self._assinatura = assinatura
+            return
+        with open(self.caminho, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGICO_INDICE)] != MAGICO_INDICE:
+            self.fechar()
+            raise ValueError(f"{self.caminho}: não é um índice do arquivo TEF")
+        self.n = (st.st_size - len(MAGICO_INDICE)) // _ENTRADA.size
+        self._assinatura = assinatura
+
+    def fechar(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = None
+        self._assinatura = None
+        self.n = 0
+
+    def _chave(self, i):
+        inicio = len(MAGICO_INDICE) + i * _ENTRADA.size
+        return self._mm[inicio:inicio + _TAM_CHAVE]
+
+    def prefixo(self, prefixo, limite):
+        """Entradas (chave, dia, posicao, id) cuja chave começa com `prefixo`"""
+        self._abrir()
+        if self._mm is None:
+            return []
+        lo, hi = 0, self.n
+        while lo < hi:
+            meio = (lo + hi) // 2
+            if self._chave(meio) < prefixo:
+                lo = meio + 1
+            else:
+                hi = meio
+        encontradas = []
+        while lo < self.n and len(encontradas) < limite:
+            entrada = _ENTRADA.unpack_from(self._mm, len(MAGICO_INDICE) + lo * _ENTRADA.size)
+            if not entrada[0].startswith(prefixo):
+                break
+            encontradas.append(entrada)
+            lo += 1
+        return encontradas
+
+
+
+# =============================================================================
+# ARQUIVO
+# =============================================================================
+class ArquivoTransacoes:
+    """
+    Arquivo das transações finalizadas (status fora de STATUS_ABERTOS).
+    `arquivar` acrescenta o que mudou no journal desde a última execução,
+    pelos eventos (uma transação que muda de status depois, p.ex.
+    CONFIRMADO -> CANCELADO, ganha registro novo; na busca vale a entrada
+    da camada de índice mais nova); `buscar` acha pelo NSU inteiro, pelo
+    começo ou pelos últimos dígitos. Pode arquivar numa thread enquanto
+    outra busca: o lock só cobre a troca dos arquivos mapeados.
+    """
+
+    def __init__(self, diretorio=None, fragmentos_abertos=512):
+        self.diretorio = diretorio or TefConfig.ARQUIVO_DIR
+        self.fragmentos_abertos = fragmentos_abertos
+        self._camadas = {}  # sufixo ("" = base) -> (_Indice do NSU, _Indice do fim)
+        self._fragmentos = OrderedDict()  # dia -> mmap (os mais usados)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            for camada in self._camadas.values():
+                for indice in camada:
+                    indice.fechar()
+            self._camadas.clear()
+            for mm in self._fragmentos.values():
+                mm.close()
+            self._fragmentos.clear()
+
+    def _caminho_fragmento(self, dia):
+        return os.path.join(self.diretorio, f"{dia:08d}.tefa")
+
+    def _caminho_indice(self, nome, sufixo):
+        return os.path.join(self.diretorio, nome + sufixo)
+
+    def _estado(self):
+        try:
+            with open(os.path.join(self.diretorio, ESTADO)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return _estado_novo()
+
+    def _gravar_estado(self, estado):
+        tmp = os.path.join(self.diretorio, ESTADO + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(estado, f)
+        os.replace(tmp, os.path.join(self.diretorio, ESTADO))
+
+    def _sufixos(self, estado):
+        """Camadas do índice, da base ao delta mais novo"""
+        if estado.get("versao") != VERSAO:
+            return []
+        return [""] + [f".{n:06d}" for n in estado["deltas"]]
+
+    def _abrir_camadas(self, sufixos):
+        """Sincroniza os índices mapeados com `sufixos` (chamar com o lock)"""
+        for sufixo in [s for s in self._camadas if s not in sufixos]:
+            self._fechar_camada(sufixo)
+        for sufixo in sufixos:
+            if sufixo not in self._camadas:
+                self._camadas[sufixo] = (_Indice(self._caminho_indice(INDICE_NSU, sufixo)),
+                                         _Indice(self._caminho_indice(INDICE_FIM, sufixo)))
+        return [self._camadas[s] for s in sufixos]
+
+    def _fechar_camada(self, sufixo):
+        """Desmapeia uma camada (chamar com o lock): Windows não substitui nem apaga arquivo mapeado"""
+        for indice in self._camadas.pop(sufixo, ()):
+            indice.fechar()
+
+    def _recomecar(self, estado):
+        """
+        Arquivo de versão anterior: fragmentos, índices e estado vão para
+        DIR/v<versão>-<data-hora>/ (nada é apagado) e o arquivo é refeito
+        a partir do journal, que guarda o histórico inteiro.
+        """
+        destino = os.path.join(self.diretorio, f"v{estado.get('versao', 1)}-{datetime.now():%Y%m%d-%H%M%S}")
+        self.close()
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith(".tefa") or ".idx" in nome or nome == ESTADO:
+                os.makedirs(destino, exist_ok=True)
+                os.replace(os.path.join(self.diretorio, nome), os.path.join(destino, nome))
+        return _estado_novo()
+
+    # -------------------------------------------------------------------------
+    # Arquivamento
+    # -------------------------------------------------------------------------
+    def arquivar(self, journal=None):
+        """Acrescenta as transações finalizadas/alteradas desde a última vez; devolve quantas"""
+        os.makedirs(self.diretorio, exist_ok=True)
+        estado = self._estado()
+        if estado.get("versao") != VERSAO:
+            estado = self._recomecar(estado)
+        caminho = os.path.abspath(journal or TefConfig.FILE_JOURNAL)
+        if not os.path.exists(caminho):
+            return 0
+        db = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        try:
+            abertos = ",".join("?" * len(STATUS_ABERTOS))
+            cur = db.execute(_SQL_FINALIZADAS.format(abertos=abertos), [estado["ultimo_seq"], *STATUS_ABERTOS])
+            linhas = cur.fetchall()
+        finally:
+            db.close()
+        if not linhas:
+            return 0
+
+        novas = []
+        por_dia = {}
+        for linha in linhas:
+            por_dia.setdefault(_dia(linha[4], linha[9]), []).append(linha)
+        for dia, grupo in sorted(por_dia.items()):
+            registros = b"".join(
+                _REGISTRO.pack(id_, valor, _b(nsu, _TAM_CHAVE), _b(rede, 16), _b(data, 8), _b(hora, 6),
+                               _b(parcelas, 2), _b(tipo, 20), _b(status, 20))
+                for id_, valor, nsu, rede, data, hora, parcelas, tipo, status, _, _ in grupo)
+            with self._lock:
+                # Um fragmento mapeado não pode crescer por baixo do mmap
+                mm = self._fragmentos.pop(dia, None)
+                if mm is not None:
+                    mm.close()
+                with open(self._caminho_fragmento(dia), "ab") as f:
+                    if f.tell() == 0:
+                        f.write(MAGICO_FRAGMENTO)
+                    posicao = (f.tell() - len(MAGICO_FRAGMENTO)) // _REGISTRO.size
+                    f.write(registros)
+            for i, linha in enumerate(grupo):
+                novas.append((_b(linha[2], _TAM_CHAVE), dia, posicao + i, linha[0]))
+
+        # Delta só com as entradas novas; o estado publica delta e marca d'água juntos
+        numero = estado["proximo_delta"]
+        sufixo = f".{numero:06d}"
+        _gravar_indice(self._caminho_indice(INDICE_NSU, sufixo), sorted(novas))
+        _gravar_indice(self._caminho_indice(INDICE_FIM, sufixo),
+                       sorted((e[0][::-1], e[1], e[2], e[3]) for e in novas))
+        estado["deltas"].append(numero)
+        estado["proximo_delta"] = numero + 1
+        estado["ultimo_seq"] = linhas[-1][10]
+        estado["registros"] += len(linhas)
+        self._gravar_estado(estado)
+        if len(estado["deltas"]) > DELTAS_MAX:
+            self._compactar(estado)
+        return len(linhas)
+
+    def _compactar(self, estado):
+        """
+        Mescla os deltas num só; se eles já somam 1/FATOR_BASE da base,
+        mescla tudo na base. Cada entrada é regravada O(log n) vezes, não
+        a cada arquivamento.
+        """
+        def tamanho(sufixo):
+            try:
+                return os.path.getsize(self._caminho_indice(INDICE_NSU, sufixo))
+            except FileNotFoundError:
+                return 0
+        deltas = [f".{n:06d}" for n in estado["deltas"]]
+        if sum(map(tamanho, deltas)) * FATOR_BASE >= tamanho(""):
+            origem, destino, restantes = [""] + deltas, "", []
+        else:
+            numero = estado["proximo_delta"]
+            origem, destino, restantes = deltas, f".{numero:06d}", [numero]
+            estado["proximo_delta"] = numero + 1
+        # Mesmo id em várias camadas: fica a entrada da mais nova
+        vencedora = {}
+        for i, sufixo in enumerate(origem[1:], 1):
+            for e in _ler_entradas(self._caminho_indice(INDICE_NSU, sufixo)):
+                vencedora[e[3]] = i
+        for nome in (INDICE_NSU, INDICE_FIM):
+            camadas = [_rotular(_ler_entradas(self._caminho_indice(nome, sufixo)), i)
+                       for i, sufixo in enumerate(origem)]
+            mescladas = (e[:4] for e in heapq.merge(*camadas) if vencedora.get(e[3], 0) == e[4])
+            if destino == "":
+                caminho = self._caminho_indice(nome, destino)
+                tmp = caminho + ".tmp"
+                _gravar_indice(tmp, mescladas)
+                with self._lock:
+                    self._fechar_camada("")
+                    os.replace(tmp, caminho)
+            else:
+                _gravar_indice(self._caminho_indice(nome, destino), mescladas)
+        estado["deltas"] = restantes
+        self._gravar_estado(estado)
+        for sufixo in deltas:
+            with self._lock:
+                self._fechar_camada(sufixo)
+            for nome in (INDICE_NSU, INDICE_FIM):
+                try:
+                    os.remove(self._caminho_indice(nome, sufixo))
+                except OSError:
+                    pass  # ainda mapeado por outro processo: fora do estado, não é mais lido
+
+    # -------------------------------------------------------------------------
+    # Busca
+    # -------------------------------------------------------------------------
+    def _registro(self, dia, posicao):
+        mm = self._fragmentos.get(dia)
+        if mm is None:
+            with open(self._caminho_fragmento(dia), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._fragmentos[dia] = mm
+            if len(self._fragmentos) > self.fragmentos_abertos:
+                self._fragmentos.popitem(last=False)[1].close()
+        else:
+            self._fragmentos.move_to_end(dia)
+        id_, valor, nsu, rede, data, hora, parcelas, tipo, status = _REGISTRO.unpack_from(
+            mm, len(MAGICO_FRAGMENTO) + posicao * _REGISTRO.size)
+        parcelas = _s(parcelas)
+        return Transacao(valor, _s(tipo), _s(status), id=id_, nsu=_s(nsu), rede=_s(rede),
+                         parcelas=int(parcelas) if parcelas.isdigit() else parcelas,
+                         data_operacao=_s(data), hora_operacao=_s(hora))
+
+    def buscar(self, nsu, limite=20):
+        """
+        Transações cujo NSU é `nsu`, começa com ele ou termina com ele (o
+        NSU exato primeiro; depois as mais recentes no journal).
+        """
+        nsu = str(nsu).strip()
+        if not nsu:
+            return []
+        chave = _b(nsu, _TAM_CHAVE)
+        sufixos = self._sufixos(self._estado())
+        entradas = {}
+        with self._lock:
+            # Da camada mais nova para a base: a primeira entrada de cada id vale
+            for indice_nsu, indice_fim in reversed(self._abrir_camadas(sufixos)):
+                for e in indice_nsu.prefixo(chave, limite):
+                    entradas.setdefault(e[3], e)
+                for e in indice_fim.prefixo(chave[::-1], limite):
+                    entradas.setdefault(e[3], e)
+            achadas = [self._registro(e[1], e[2]) for e in entradas.values()]
+        achadas.sort(key=lambda t: (t.nsu != nsu, -t.id))
+        return achadas[:limite]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Arquivo das transações TEF (fragmentos por dia + índice de NSU)")
+    ap.add_argument("--journal", default=TefConfig.FILE_JOURNAL)
+    ap.add_argument("--dir", default=TefConfig.ARQUIVO_DIR)
+    ap.add_argument("--buscar", metavar="NSU", help="NSU inteiro, começo ou últimos dígitos")
+    ap.add_argument("--limite", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    arquivo = ArquivoTransacoes(args.dir)
+    try:
+        if args.buscar:
+            achadas = arquivo.buscar(args.buscar, args.limite)
+            for t in achadas:
+                print(f"nsu={t.nsu} rede={t.rede} data={t.data_operacao} hora={t.hora_operacao} "
+                      f"valor={t.valor_display} tipo={t.tipo} status={t.status}")
+            return 0 if achadas else 1
+        print(f"{arquivo.arquivar(args.journal)} transação(ões) arquivada(s) em {args.dir}")
+        return 0
+    finally:
+        arquivo.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import time
+import struct
+import threading
+
+# =============================================================================
+# CAPTURA DAS TROCAS IntPos (TRACE SOMENTE-INCLUSÃO)
+# =============================================================================
+# Registro: <d ts> <B tipo> <H tamanho da lane> <I tamanho dos dados> lane dados
+REQ = 1    # bytes gravados em REQ/IntPos.001
+STS = 2    # IntPos.Sts recebido
+RESP = 3   # bytes lidos de RESP/IntPos.001
+FALHA = 4  # sem STS, timeout ou leitura parcial (mensagem em UTF-8)
+
+NOMES = {REQ: "REQ", STS: "STS", RESP: "RESP", FALHA: "FALHA"}
+
+_CABECALHO = struct.Struct("<dBHI")
+
+
+class CapturaIntPos:
+    """Grava cada troca com o horário, anexando ao arquivo (thread-safe)"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._f = open(caminho, "ab")
+
+    def registrar(self, tipo, lane, dados=b""):
+        lane_b = lane.encode("utf-8")
+        registro = _CABECALHO.pack(time.time(), tipo, len(lane_b), len(dados)) + lane_b + dados
+        with self._lock:
+            # Um write por registro: leitores nunca veem registros intercalados
+            self._f.write(registro)
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+_abertas = {}
+_abertas_lock = threading.Lock()
+
+
+def abrir(caminho):
+    """Uma CapturaIntPos por arquivo, compartilhada pelas lanes do processo"""
+    with _abertas_lock:
+        if caminho not in _abertas:
+            _abertas[caminho] = CapturaIntPos(caminho)
+        return _abertas[caminho]
+
+
+def ler(caminho):
+    """Gera (ts, tipo, lane, dados); um registro incompleto no fim é ignorado"""
+    with open(caminho, "rb") as f:
+        while True:
+            cab = f.read(_CABECALHO.size)
+            if len(cab) < _CABECALHO.size:
+                return
+            ts, tipo, n_lane, n_dados = _CABECALHO.unpack(cab)
+            corpo = f.read(n_lane + n_dados)
+            if len(corpo) < n_lane + n_dados:
+                return
+            yield ts, tipo, corpo[:n_lane].decode("utf-8"), corpo[n_lane:]
+
+
+class Troca:
+    """Um pedido e o que o CTFClient fez com ele, com tempos relativos ao pedido"""
+    __slots__ = ("lane", "ts", "pedido", "sts_apos", "resposta", "resposta_apos", "falha")
+
+    def __init__(self, lane, ts, pedido):
+        self.lane = lane
+        self.ts = ts
+        self.pedido = pedido
+        self.sts_apos = None
+        self.resposta = None
+        self.resposta_apos = None
+        self.falha = None
+
+
+def trocas(caminho):
+    """Agrupa os registros da captura em Trocas, na ordem dos pedidos"""
+    abertas = {}  # lane -> Troca em andamento
+    resultado = []
+    for ts, tipo, lane, dados in ler(caminho):
+        if tipo == REQ:
+            t = abertas[lane] = Troca(lane, ts, dados)
+            resultado.append(t)
+            continue
+        t = abertas.get(lane)
+        if t is None:
+            continue
+        if tipo == STS and t.sts_apos is None:
+            t.sts_apos = ts - t.ts
+        elif tipo == RESP:
+            t.resposta, t.resposta_apos = dados, ts - t.ts
+            del abertas[lane]
+        elif tipo == FALHA:
+            t.falha = dados.decode("utf-8", errors="replace")
+            del abertas[lane]
+    return resultado
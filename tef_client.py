@@ -0,0 +1,266 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import tef_metricas
+from tef_timeouts import TimeoutsAdaptativos, STS, RESPOSTA
+from tef_protocolo import SequenceManager, TefFileHandler, arquivo_sequencia
+
+# =============================================================================
+# RESULTADOS
+# =============================================================================
+class TefError(Exception):
+    """Falha de comunicação com o CTFClient (gravação, sem STS, timeout)"""
+
+
+# Modalidades do campo 011-000
+MODALIDADE_CREDITO = "10"
+MODALIDADE_PARCELADO_LOJA = "11"  # Parcelado Loja (Sem Juros)
+MODALIDADE_DEBITO = "20"
+
+
+@dataclass
+class TefResultado:
+    comando: str
+    id_req: str
+    codigo: str = None
+    mensagem: str = ""
+    nsu: str = None
+    rede: str = None
+    finalizacao: str = None
+    data_operacao: str = None
+    hora_operacao: str = None
+    lane: str = None
+    reconhecido: bool = False  # STS recebido (CNF/NCN)
+    tentativas: int = 1
+    resposta: dict = field(default_factory=dict)
+
+    @property
+    def aprovado(self):
+        return self.codigo == "0"
+
+    @classmethod
+    def from_resposta(cls, comando, id_req, resp):
+        data_op = resp.get("022-000") or resp.get("015-000")
+        hora_op = resp.get("023-000") or resp.get("016-000")
+
+        if data_op and len(data_op) > 8: data_op = data_op[:8]
+        if hora_op and len(hora_op) > 6: hora_op = hora_op[:6]
+
+        return cls(
+            comando=comando,
+            id_req=id_req,
+            codigo=resp.get("009-000"),
+            mensagem=resp.get("030-000", ""),
+            nsu=resp.get("012-000"),
+            rede=resp.get("010-000"),
+            finalizacao=resp.get("027-000"),
+            data_operacao=data_op if data_op else datetime.now().strftime("%d%m%Y"),
+            hora_operacao=hora_op if hora_op else datetime.now().strftime("%H%M%S"),
+            resposta=resp,
+        )
+
+
+# =============================================================================
+# CLIENTE TEF (SEM INTERFACE)
+# =============================================================================
+class TefClient:
+    """
+    Motor do protocolo IntPos com API asyncio, sem dependência de Tk.
+    Um cliente corresponde a um par REQ/RESP: as trocas são serializadas
+    por um asyncio.Lock, e a E/S bloqueante roda no executor do loop.
+    """
+
+    def __init__(self, handler=None, sequencia=None, timeout=None, executor=None, nome=None, metricas=None):
+        self.handler = handler or TefFileHandler()
+        self.sequencia = sequencia or SequenceManager(arquivo_sequencia(self.handler.lane))
+        self.timeout = timeout
+        self.timeouts = TimeoutsAdaptativos(timeout)  # por comando, desta lane
+        self.executor = executor
+        self.nome = nome  # rótulo "lane" nas métricas
+        self.metricas = metricas or tef_metricas.METRICAS
+        self._lock = None
+
+    def _get_lock(self):
+        # Criado sob demanda para ficar associado ao loop em execução
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    # -------------------------------------------------------------------------
+    # Núcleo
+    # -------------------------------------------------------------------------
+    def _trocar(self, req, aguardar_resposta):
+        # Lock da lane durante a troca inteira (quarentena e outros processos esperam)
+        with self.handler.troca():
+            return self._trocar_arquivos(req, aguardar_resposta)
+
+    def _trocar_arquivos(self, req, aguardar_resposta):
+        medicao = self.metricas.iniciar(req.get("000-000"), self.nome)
+        prazo_sts = None
+        try:
+            req = {"001-000": self.sequencia.get_next_id(), **req}
+            medicao.id_req = req["001-000"]
+            comando = req.get("000-000")
+            prazo_sts = self.timeouts.prazo(comando, STS)
+            intervalo_sts = self.timeouts.intervalo(comando, STS, 0.1)
+            if not self.handler.write_request(req, medicao):
+                raise TefError("Erro ao gravar arquivo.")
+            if not aguardar_resposta:
+                # CNF/NCN não têm IntPos.001 de resposta: o STS é a confirmação
+                if not self.handler.wait_status(prazo_sts, medicao, intervalo_sts):
+                    raise TefError("Erro: CTFClient não reconheceu o pedido (Sem STS).")
+                medicao.resultado = tef_metricas.RECONHECIDO
+                self._observar(comando, medicao)
+                return req["001-000"], {}
+            prazo_resposta = self.timeouts.prazo(comando, RESPOSTA)
+            resp, status = self.handler.wait_response(prazo_resposta, medicao, prazo_sts,
+                                                      self.timeouts.intervalo(comando, RESPOSTA, 0.5), intervalo_sts,
+                                                      id_req=req["001-000"])
+            if not resp:
+                if medicao.resultado == tef_metricas.TIMEOUT:
+                    # O prazo esgotado entra como amostra: a janela só desce com trocas rápidas
+                    self.timeouts.observar(comando, RESPOSTA, prazo_resposta)
+                raise TefError(status)
+            medicao.resultado = tef_metricas.APROVADO if resp.get("009-000") == "0" else tef_metricas.RECUSADO
+            self._observar(comando, medicao)
+            return req["001-000"], resp
+        except Exception as e:
+            medicao.detalhe = medicao.detalhe or str(e)
+            if medicao.resultado == tef_metricas.SEM_STS and prazo_sts is not None:
+                self.timeouts.observar(medicao.comando, STS, prazo_sts)
+            raise
+        finally:
+            self.metricas.concluir(medicao)
+
+    def _observar(self, comando, medicao):
+        """Alimenta os prazos adaptativos com uma troca bem-sucedida (timeouts entram em _trocar)"""
+        fases = medicao.fases
+        if "aguardar_sts" in fases:
+            self.timeouts.observar(comando, STS, fases["aguardar_sts"])
+        if "aguardar_resposta" in fases:
+            self.timeouts.observar(comando, RESPOSTA, fases["aguardar_resposta"] + fases.get("leitura", 0.0))
+
+    async def executar(self, req, aguardar_resposta=True):
+        """Grava o pedido (sem 001-000), aguarda a resposta e devolve TefResultado"""
+        loop = asyncio.get_running_loop()
+        async with self._get_lock():
+            id_req, resp = await loop.run_in_executor(self.executor, self._trocar, req, aguardar_resposta)
+        if not aguardar_resposta:
+            return TefResultado(comando=req["000-000"], id_req=id_req, mensagem="Reconhecido", reconhecido=True,
+                                nsu=req.get("012-000"), rede=req.get("010-000"), finalizacao=req.get("027-000"))
+        return TefResultado.from_resposta(req["000-000"], id_req, resp)
+
+    # -------------------------------------------------------------------------
+    # Vendas
+    # -------------------------------------------------------------------------
+    def _req_venda(self, comando, valor_cents, doc_fiscal, multiplos):
+        req = {
+            "000-000": comando,
+            "002-000": doc_fiscal,
+            "003-000": str(valor_cents),
+        }
+        if multiplos:
+            req["099-000"] = "1"
+        return req
+
+    async def credit(self, valor_cents, doc_fiscal, multiplos=False):
+        req = self._req_venda("CRT", valor_cents, doc_fiscal, multiplos)
+        req["011-000"] = MODALIDADE_CREDITO
+        return await self.executar(req)
+
+    async def debit(self, valor_cents, doc_fiscal, multiplos=False):
+        req = self._req_venda("CRT", valor_cents, doc_fiscal, multiplos)
+        req["011-000"] = MODALIDADE_DEBITO
+        return await self.executar(req)
+
+    async def installment(self, valor_cents, parcelas, doc_fiscal, multiplos=False):
+        req = self._req_venda("CRT", valor_cents, doc_fiscal, multiplos)
+        req["011-000"] = MODALIDADE_PARCELADO_LOJA
+        # 018-000 = Quantidade de parcelas (formato 02, 03...)
+        req["018-000"] = str(parcelas).zfill(2)
+        return await self.executar(req)
+
+    async def pix(self, valor_cents, doc_fiscal, multiplos=False):
+        req = self._req_venda("QRC", valor_cents, doc_fiscal, multiplos)
+        return await self.executar(req)
+
+    # -------------------------------------------------------------------------
+    # Cancelamento / Administrativo
+    # -------------------------------------------------------------------------
+    async def cancel(self, valor_cents, nsu, data, doc_fiscal, hora=None, rede=None):
+        req = {
+            "000-000": "CNC",
+            "002-000": doc_fiscal,
+            "003-000": str(valor_cents),
+            "012-000": nsu,
+            "022-000": data,
+        }
+        if hora:
+            req["023-000"] = hora
+        if rede:
+            req["010-000"] = rede
+        return await self.executar(req)
+
+    async def pix_refund(self, valor_cents, nsu, data):
+        req = {
+            "000-000": "ADM",
+            "003-000": str(valor_cents),
+            "012-000": nsu,
+            "719-000": data,
+        }
+        return await self.executar(req)
+
+    async def admin(self):
+        return await self.executar({"000-000": "ADM"})
+
+    # -------------------------------------------------------------------------
+    # Finalização (CNF / NCN)
+    # -------------------------------------------------------------------------
+    def _req_finalizacao(self, comando, rede, nsu, finalizacao, doc_fiscal, multiplos):
+        req = {
+            "000-000": comando,
+            "002-000": doc_fiscal,
+            "010-000": rede,
+            "012-000": nsu,
+            "027-000": finalizacao,
+        }
+        if multiplos:
+            req["099-000"] = "1"
+        return req
+
+    async def confirm(self, rede, nsu, finalizacao, doc_fiscal, multiplos=False):
+        req = self._req_finalizacao("CNF", rede, nsu, finalizacao, doc_fiscal, multiplos)
+        return await self.executar(req, aguardar_resposta=False)
+
+    async def undo(self, rede, nsu, finalizacao, doc_fiscal, multiplos=False):
+        req = self._req_finalizacao("NCN", rede, nsu, finalizacao, doc_fiscal, multiplos)
+        return await self.executar(req, aguardar_resposta=False)
+
+    async def finalizar_lote(self, itens, confirmar, doc_fiscal, tentativas=3, ao_finalizar=None):
+        """
+        Envia CNF (ou NCN) para cada (rede, nsu, finalizacao[, doc_fiscal])
+        de `itens` (sem doc_fiscal no item vale o do lote), emendando o
+        próximo assim que o CTFClient reconhece o anterior (STS).
+        Itens sem reconhecimento são reenviados (novo 001-000) até
+        `tentativas` vezes. `ao_finalizar(indice, resultado)` é chamado a
+        cada item concluído. Retorna os TefResultado na ordem de `itens`.
+        """
+        finalizar = self.confirm if confirmar else self.undo
+        comando = "CNF" if confirmar else "NCN"
+        resultados = []
+        for i, item in enumerate(itens):
+            rede, nsu, finalizacao = item[:3]
+            doc_item = (item[3] if len(item) > 3 else None) or doc_fiscal
+            for tentativa in range(1, tentativas + 1):
+                try:
+                    res = await finalizar(rede, nsu, finalizacao, doc_item, multiplos=True)
+                    break
+                except TefError as e:
+                    res = TefResultado(comando=comando, id_req=None, mensagem=str(e), nsu=nsu,
+                                       rede=rede, finalizacao=finalizacao)
+            res.tentativas = tentativa
+            resultados.append(res)
+            if ao_finalizar:
+                ao_finalizar(i, res)
+        return resultados
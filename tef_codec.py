@@ -0,0 +1,191 @@
+import re
+
+# =============================================================================
+# CODEC INTPOS (ARQUIVOS IntPos.001)
+# =============================================================================
+# Cada linha: "NNN-III = valor". NNN é o campo e III o índice (000 para campos
+# simples, 001..999 para campos repetidos como as linhas de comprovante 029).
+ENCODING_PADRAO = "cp1252"
+
+N = "N"  # numérico
+A = "A"  # alfanumérico
+
+# campo -> (descrição, tipo, tamanho máximo)
+CAMPOS = {
+    "000-000": ("Comando", A, 3),
+    "001-000": ("Identificação (sequencial)", N, 10),
+    "002-000": ("Documento fiscal", A, 12),
+    "003-000": ("Valor total (centavos)", N, 12),
+    "004-000": ("Moeda", N, 1),
+    "009-000": ("Status da transação", A, 3),
+    "010-000": ("Rede adquirente", A, 20),
+    "011-000": ("Tipo de transação", N, 2),
+    "012-000": ("NSU", A, 20),
+    "013-000": ("Código de autorização", A, 12),
+    "015-000": ("Data da transação (alternativa)", A, 14),
+    "016-000": ("Hora da transação (alternativa)", A, 14),
+    "017-000": ("Tipo de parcelamento", N, 1),
+    "018-000": ("Quantidade de parcelas", N, 2),
+    "022-000": ("Data do comprovante (DDMMAAAA)", A, 14),
+    "023-000": ("Hora do comprovante (HHMMSS)", A, 14),
+    "027-000": ("Código de finalização", A, 40),
+    "028-000": ("Quantidade de linhas do comprovante", N, 3),
+    "029": ("Linha do comprovante", A, 80),
+    "030-000": ("Mensagem para o operador", A, 256),
+    "099-000": ("Múltiplas transações", N, 1),
+    "719-000": ("Data da transação original (PIX)", A, 14),
+    "999-999": ("Fim de registro", N, 1),
+}
+
+# comando -> campos obrigatórios no pedido
+OBRIGATORIOS = {
+    "CRT": ("001-000", "002-000", "003-000"),
+    "QRC": ("001-000", "002-000", "003-000"),
+    "CNC": ("001-000", "003-000", "012-000", "022-000"),
+    "ADM": ("001-000",),
+    # Rede/NSU/finalização vêm da resposta original e podem faltar (PIX)
+    "CNF": ("001-000",),
+    "NCN": ("001-000",),
+}
+
+_RE_CHAVE = re.compile(r"^\d{3}-\d{3}$")
+TERMINADOR = "999-999"
+
+
+class IntPosError(ValueError):
+    """Mensagem IntPos inválida (campo desconhecido, formato ou tamanho)"""
+
+
+def definicao(chave):
+    """Definição do campo; campos indexados (029-001...) usam a do grupo"""
+    return CAMPOS.get(chave) or CAMPOS.get(chave[:3])
+
+
+def validar(campos):
+    """Valida chaves e valores de um pedido; levanta IntPosError"""
+    comando = campos.get("000-000")
+    if comando is None:
+        raise IntPosError("Campo 000-000 (comando) ausente")
+    for obrig in OBRIGATORIOS.get(comando, ()):
+        if campos.get(obrig) in (None, ""):
+            raise IntPosError(f"{comando}: campo obrigatório {obrig} ausente")
+
+    for k, v in campos.items():
+        if v is None:
+            continue
+        if not _RE_CHAVE.match(k):
+            raise IntPosError(f"Chave inválida: {k!r}")
+        v = str(v)
+        if "\n" in v or "\r" in v:
+            raise IntPosError(f"{k}: quebra de linha no valor")
+        d = definicao(k)
+        if d is None:
+            continue  # campo fora da tabela: repassado sem validação de tipo
+        _, tipo, tamanho = d
+        if len(v) > tamanho:
+            raise IntPosError(f"{k}: tamanho {len(v)} > {tamanho}")
+        if tipo == N and v and not v.isdigit():
+            raise IntPosError(f"{k}: valor numérico esperado, recebido {v!r}")
+
+
+def serializar(campos, encoding=ENCODING_PADRAO, validacao=True, quebra="\n"):
+    """
+    Monta o arquivo inteiro num único buffer: 000-000 primeiro, demais campos
+    na ordem do dict (None é omitido) e 999-999 = 0 no final.
+    """
+    if validacao:
+        validar(campos)
+    linhas = []
+    if "000-000" in campos:
+        linhas.append(f"000-000 = {campos['000-000']}")
+    for k, v in campos.items():
+        if k not in ("000-000", TERMINADOR) and v is not None:
+            linhas.append(f"{k} = {v}")
+    linhas.append("999-999 = 0")
+    linhas.append("")
+    try:
+        return quebra.join(linhas).encode(encoding)
+    except UnicodeEncodeError as e:
+        raise IntPosError(f"Valor não representável em {encoding}: {e}")
+
+
+# =============================================================================
+# PARSE
+# =============================================================================
+class IntPosMensagem(dict):
+    """
+    Campos de uma resposta. O dict guarda a primeira ocorrência de cada
+    chave (compatível com resp.get("009-000")); `repetidos` guarda todas as
+    ocorrências das chaves que se repetiram.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.repetidos = {}
+        self.completa = False
+
+    def adicionar(self, chave, valor):
+        if chave in self:
+            self.repetidos.setdefault(chave, [self[chave]]).append(valor)
+        else:
+            self[chave] = valor
+
+    def indexados(self, grupo):
+        """Valores de um campo multi-índice ("029") na ordem do índice"""
+        prefixo = grupo + "-"
+        return [v for k, v in sorted(self.items()) if k.startswith(prefixo) and k != grupo + "-000"]
+
+    @property
+    def comprovante(self):
+        return self.indexados("029")
+
+
+class IntPosParser:
+    """
+    Parser incremental sobre bytes: aceita pedaços arbitrários (inclusive
+    linhas cortadas no meio) e marca a mensagem como completa ao ver 999-999.
+    """
+
+    def __init__(self, encoding=ENCODING_PADRAO):
+        self.encoding = encoding
+        self.mensagem = IntPosMensagem()
+        self._resto = b""
+        self.bytes_lidos = 0
+
+    def feed(self, dados):
+        """Consome bytes; retorna True quando o terminador foi recebido"""
+        self.bytes_lidos += len(dados)
+        buf = self._resto + dados
+        fim = buf.rfind(b"\n") + 1
+        self._resto = buf[fim:]
+        if fim:
+            # Um único decode por pedaço recebido
+            self._linhas(buf[:fim].decode(self.encoding, errors="replace").split("\n"))
+        return self.mensagem.completa
+
+    def close(self):
+        """Processa uma última linha sem quebra e devolve a mensagem"""
+        if self._resto:
+            self._linhas([self._resto.decode(self.encoding, errors="replace")])
+            self._resto = b""
+        return self.mensagem
+
+    def _linhas(self, linhas):
+        msg = self.mensagem
+        for texto in linhas:
+            if msg.completa:
+                return
+            k, sep, v = texto.partition("=")
+            if not sep:
+                continue
+            k = k.strip()
+            msg.adicionar(k, v.strip())
+            if k == TERMINADOR:
+                msg.completa = True
+
+
+def parse(dados, encoding=ENCODING_PADRAO):
+    """Parse de um arquivo inteiro (bytes)"""
+    parser = IntPosParser(encoding)
+    parser.feed(dados)
+    return parser.close()
@@ -0,0 +1,288 @@
+"""
+Conciliação de fim de dia sobre o journal de transações.
+
+    python tef_conciliacao.py [--journal ARQ] [--dia DDMMAAAA] [--por rede,status]
+                              [--csv ARQ] [--colunar ARQ] [--agregados ARQ]
+
+Os totais (quantidade e centavos por dia, rede, tipo, parcelas e status)
+são mantidos em um arquivo de estado e atualizados só com os eventos
+novos do journal; as exportações percorrem o histórico em lotes, sem
+carregá-lo na memória.
+"""
+import os
+import csv
+import sys
+import json
+import zlib
+import struct
+import sqlite3
+import argparse
+from array import array
+
+from tef_protocolo import TefConfig
+from tef_ledger import formatar_cents
+
+# =============================================================================
+# AGREGADOS INCREMENTAIS
+# =============================================================================
+DIMENSOES = ("dia", "rede", "tipo", "parcelas", "status")
+
+COLUNAS_EXPORTACAO = ("id", "id_req", "nsu", "rede", "finalizacao", "valor_cents", "tipo", "parcelas",
+                      "data_operacao", "hora_operacao", "status", "doc_fiscal", "lane")
+COLUNAS_INTEIRAS = ("id", "valor_cents")
+
+LOTE = 5000
+
+# Cada evento com o status anterior da mesma transação (para estornar o grupo antigo)
+_SQL_EVENTOS = """
+SELECT e.seq, e.status,
+       (SELECT a.status FROM eventos a
+         WHERE a.transacao_id = e.transacao_id AND a.seq < e.seq
+         ORDER BY a.seq DESC LIMIT 1),
+       t.data_operacao, t.rede, t.tipo, t.parcelas, t.valor_cents
+  FROM eventos e JOIN transacoes t ON t.id = e.transacao_id
+ WHERE e.seq > ?
+ ORDER BY e.seq
+"""
+
+
+def _abrir(caminho):
+    # Somente leitura: convive com o PDV gravando (WAL)
+    return sqlite3.connect(f"file:{os.path.abspath(caminho)}?mode=ro", uri=True)
+
+
+def _lotes(cur, tamanho=LOTE):
+    while True:
+        linhas = cur.fetchmany(tamanho)
+        if not linhas:
+            return
+        yield from linhas
+
+
+class Conciliacao:
+    """
+    Totais por (dia, rede, tipo, parcelas, status), persistidos em
+    `caminho_estado` junto com o último evento processado. A memória é
+    proporcional ao número de grupos, não ao de transações.
+    """
+
+    def __init__(self, journal=None, caminho_estado=None):
+        self.journal = journal or TefConfig.FILE_JOURNAL
+        self.caminho_estado = caminho_estado or os.path.splitext(self.journal)[0] + ".conciliacao.json"
+        self.ultimo_seq = 0
+        self.grupos = {}  # chave DIMENSOES -> [quantidade, cents]
+        self._carregar_estado()
+
+    def _carregar_estado(self):
+        try:
+            with open(self.caminho_estado, encoding="utf-8") as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.ultimo_seq = estado.get("ultimo_seq", 0)
+        self.grupos = {tuple(g["chave"]): [g["quantidade"], g["cents"]] for g in estado.get("grupos", [])}
+
+    def _salvar_estado(self):
+        tmp = self.caminho_estado + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "ultimo_seq": self.ultimo_seq,
+                "grupos": [{"chave": list(k), "quantidade": q, "cents": c}
+                           for k, (q, c) in self.grupos.items() if q or c],
+            }, f)
+        os.replace(tmp, self.caminho_estado)
+
+    def _somar(self, chave, quantidade, cents):
+        g = self.grupos.get(chave)
+        if g is None:
+            g = self.grupos[chave] = [0, 0]
+        g[0] += quantidade
+        g[1] += cents
+
+    def atualizar(self):
+        """Processa os eventos desde a última execução; devolve quantos"""
+        db = _abrir(self.journal)
+        processados = 0
+        try:
+            cur = db.execute(_SQL_EVENTOS, (self.ultimo_seq,))
+            for seq, status, anterior, dia, rede, tipo, parcelas, cents in _lotes(cur):
+                base = (dia or "", rede or "", tipo or "", parcelas or "")
+                if anterior is not None:
+                    self._somar(base + (anterior,), -1, -cents)
+                self._somar(base + (status,), 1, cents)
+                self.ultimo_seq = seq
+                processados += 1
+        finally:
+            db.close()
+        if processados:
+            self._salvar_estado()
+        return processados
+
+    def refazer(self):
+        """Descarta o estado e reprocessa o journal inteiro"""
+        self.ultimo_seq = 0
+        self.grupos = {}
+        return self.atualizar()
+
+    def totais(self, por=("rede", "status"), dia=None):
+        """Soma os grupos pelas dimensões em `por` -> {chave: (quantidade, cents)}"""
+        indices = [DIMENSOES.index(d) for d in por]
+        resultado = {}
+        for chave, (q, c) in self.grupos.items():
+            if dia is not None and chave[0] != dia:
+                continue
+            k = tuple(chave[i] for i in indices)
+            atual = resultado.get(k, (0, 0))
+            resultado[k] = (atual[0] + q, atual[1] + c)
+        return {k: v for k, v in sorted(resultado.items()) if v[0] or v[1]}
+
+    def exportar_agregados_csv(self, destino, por=DIMENSOES, dia=None):
+        with open(destino, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(list(por) + ["quantidade", "valor"])
+            for chave, (q, c) in self.totais(por, dia).items():
+                w.writerow(list(chave) + [q, formatar_cents(c)])
+
+
+# =============================================================================
+# EXPORTAÇÃO POR TRANSAÇÃO (NSU / FINALIZAÇÃO)
+# =============================================================================
+def iterar_transacoes(journal=None, dia=None, desde_id=0):
+    """Linhas do journal em ordem de id, lidas em lotes de LOTE"""
+    db = _abrir(journal or TefConfig.FILE_JOURNAL)
+    try:
+        where, params = "id > ?", [desde_id]
+        if dia:
+            where += " AND data_operacao = ?"
+            params.append(dia)
+        cur = db.execute(f"SELECT {', '.join(COLUNAS_EXPORTACAO)} FROM transacoes WHERE {where} ORDER BY id", params)
+        yield from _lotes(cur)
+    finally:
+        db.close()
+
+
+def exportar_csv(destino, journal=None, dia=None, desde_id=0):
+    """CSV (;) para conciliação com a adquirente; devolve o último id exportado"""
+    ultimo = desde_id
+    with open(destino, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(COLUNAS_EXPORTACAO)
+        for linha in iterar_transacoes(journal, dia, desde_id):
+            w.writerow(linha)
+            ultimo = linha[0]
+    return ultimo
+
+
+# -----------------------------------------------------------------------------
+# Formato colunar compacto (.tefc)
+# -----------------------------------------------------------------------------
+# Cabeçalho: MAGICO + JSON das colunas + "\n". Em seguida, blocos de até
+# LOTE linhas: <I quantidade de linhas> e, por coluna, <I tamanho> + zlib
+# do conteúdo. Inteiros são array("q"); textos, dicionário do bloco (JSON)
+# + índices array("I").
+MAGICO = b"TEFC1\n"
+
+
+def _codificar_coluna(nome, valores):
+    if nome in COLUNAS_INTEIRAS:
+        bruto = array("q", (v or 0 for v in valores)).tobytes()
+    else:
+        dicionario, indices = {}, array("I")
+        for v in valores:
+            indices.append(dicionario.setdefault(v, len(dicionario)))
+        cabecalho = json.dumps(list(dicionario), ensure_ascii=False).encode("utf-8")
+        bruto = struct.pack("<I", len(cabecalho)) + cabecalho + indices.tobytes()
+    return zlib.compress(bruto, 6)
+
+
+def _decodificar_coluna(nome, dados):
+    bruto = zlib.decompress(dados)
+    if nome in COLUNAS_INTEIRAS:
+        valores = array("q")
+        valores.frombytes(bruto)
+        return list(valores)
+    (tamanho,) = struct.unpack_from("<I", bruto)
+    dicionario = json.loads(bruto[4:4 + tamanho].decode("utf-8"))
+    indices = array("I")
+    indices.frombytes(bruto[4 + tamanho:])
+    return [dicionario[i] for i in indices]
+
+
+def exportar_colunar(destino, journal=None, dia=None, desde_id=0):
+    """Grava o histórico no formato .tefc; devolve o último id exportado"""
+    ultimo = desde_id
+    bloco = []
+
+    def gravar_bloco(f):
+        f.write(struct.pack("<I", len(bloco)))
+        for i, nome in enumerate(COLUNAS_EXPORTACAO):
+            dados = _codificar_coluna(nome, [linha[i] for linha in bloco])
+            f.write(struct.pack("<I", len(dados)))
+            f.write(dados)
+        bloco.clear()
+
+    with open(destino, "wb") as f:
+        f.write(MAGICO + json.dumps(COLUNAS_EXPORTACAO).encode() + b"\n")
+        for linha in iterar_transacoes(journal, dia, desde_id):
+            bloco.append(linha)
+            ultimo = linha[0]
+            if len(bloco) >= LOTE:
+                gravar_bloco(f)
+        if bloco:
+            gravar_bloco(f)
+    return ultimo
+
+
+def ler_colunar(caminho, colunas=None):
+    """Gera dicionários {coluna: valor}; `colunas` limita o que é descomprimido"""
+    with open(caminho, "rb") as f:
+        if f.read(len(MAGICO)) != MAGICO:
+            raise ValueError(f"{caminho}: não é um arquivo .tefc")
+        nomes = json.loads(f.readline())
+        pedidas = set(colunas or nomes)
+        while True:
+            cab = f.read(4)
+            if len(cab) < 4:
+                return
+            (n,) = struct.unpack("<I", cab)
+            dados = {}
+            for nome in nomes:
+                (tamanho,) = struct.unpack("<I", f.read(4))
+                if nome in pedidas:
+                    dados[nome] = _decodificar_coluna(nome, f.read(tamanho))
+                else:
+                    f.seek(tamanho, os.SEEK_CUR)
+            for i in range(n):
+                yield {nome: valores[i] for nome, valores in dados.items()}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Conciliação de fim de dia (journal TEF)")
+    ap.add_argument("--journal", default=TefConfig.FILE_JOURNAL)
+    ap.add_argument("--estado", help="arquivo de estado incremental (padrão: ao lado do journal)")
+    ap.add_argument("--dia", help="data_operacao (DDMMAAAA)")
+    ap.add_argument("--por", default="rede,status", help=f"dimensões: {','.join(DIMENSOES)}")
+    ap.add_argument("--refazer", action="store_true", help="ignora o estado e reprocessa tudo")
+    ap.add_argument("--csv", help="exporta as transações (NSU/finalização) em CSV")
+    ap.add_argument("--colunar", help="exporta as transações no formato .tefc")
+    ap.add_argument("--agregados", help="exporta os totais em CSV")
+    args = ap.parse_args(argv)
+
+    conc = Conciliacao(args.journal, args.estado)
+    novos = conc.refazer() if args.refazer else conc.atualizar()
+    por = tuple(d for d in args.por.split(",") if d)
+    print(f"{novos} eventos novos processados")
+    for chave, (q, c) in conc.totais(por, args.dia).items():
+        print(f"{' | '.join(chave):<50} {q:>8} {formatar_cents(c):>14}")
+
+    if args.agregados:
+        conc.exportar_agregados_csv(args.agregados, dia=args.dia)
+    if args.csv:
+        exportar_csv(args.csv, args.journal, args.dia)
+    if args.colunar:
+        exportar_colunar(args.colunar, args.journal, args.dia)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
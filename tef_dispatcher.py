@@ -0,0 +1,182 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tef_protocolo import TefConfig, SequenceManager, TefFileHandler, arquivo_sequencia
+from tef_client import TefClient, TefError
+
+# =============================================================================
+# LANES (UM CTFCLIENT POR DIRETÓRIO BASE)
+# =============================================================================
+class TefLane:
+    """
+    Um terminal: diretório base próprio, sequência própria e estado de voo.
+    Falhas consecutivas de comunicação colocam a lane em quarentena.
+    """
+
+    def __init__(self, nome, dir_base, timeout=None, executor=None, max_falhas=3, quarentena=30.0):
+        self.nome = nome
+        self.dir_base = dir_base
+        self.handler = TefFileHandler(dir_base)
+        self.sequencia = SequenceManager(arquivo_sequencia(self.handler.lane))
+        self.client = TefClient(self.handler, self.sequencia, timeout, executor, nome=nome)
+
+        self.max_falhas = max_falhas
+        self.quarentena = quarentena
+        self.em_andamento = None  # comando em voo ("CRT", "CNF"...)
+        self.falhas_consecutivas = 0
+        self.bloqueada_ate = 0.0
+        self.total_ok = 0
+        self.total_falhas = 0
+
+    @property
+    def saudavel(self):
+        return time.monotonic() >= self.bloqueada_ate
+
+    @property
+    def livre(self):
+        return self.em_andamento is None
+
+    def registrar_sucesso(self):
+        self.total_ok += 1
+        self.falhas_consecutivas = 0
+
+    def registrar_falha(self):
+        self.total_falhas += 1
+        self.falhas_consecutivas += 1
+        if self.falhas_consecutivas >= self.max_falhas:
+            self.bloqueada_ate = time.monotonic() + self.quarentena
+
+    def status(self):
+        return {
+            "lane": self.nome,
+            "dir_base": self.dir_base,
+            "em_andamento": self.em_andamento,
+            "saudavel": self.saudavel,
+            "falhas_consecutivas": self.falhas_consecutivas,
+            "total_ok": self.total_ok,
+            "total_falhas": self.total_falhas,
+            "prazos": self.client.timeouts.status(),
+        }
+
+
+# =============================================================================
+# DESPACHANTE
+# =============================================================================
+class TefDispatcher:
+    """
+    Distribui operações entre N lanes a partir de um único loop asyncio.
+    Vendas vão para a primeira lane livre e saudável; confirmações,
+    desfazimentos e cancelamentos devem ser fixados (`lane=`) no terminal
+    que fez a venda original.
+    """
+
+    def __init__(self, lanes):
+        if not lanes:
+            raise ValueError("Nenhuma lane configurada")
+        self.lanes = {lane.nome: lane for lane in lanes}
+        self._cond = None
+
+    @classmethod
+    def from_config(cls, bases=None, timeout=None, **kwargs):
+        bases = bases or TefConfig.LANES
+        executor = ThreadPoolExecutor(max_workers=len(bases), thread_name_prefix="tef-lane")
+        lanes = [TefLane(f"L{i + 1:02d}", base, timeout, executor, **kwargs) for i, base in enumerate(bases)]
+        return cls(lanes)
+
+    def setup_directories(self):
+        for lane in self.lanes.values():
+            lane.handler.setup_directories()
+
+    def iniciar_limpeza(self):
+        """Quarentena das sobras de todas as lanes em segundo plano"""
+        return [lane.handler.iniciar_limpeza() for lane in self.lanes.values()]
+
+    def close(self):
+        for lane in self.lanes.values():
+            lane.handler.close()
+
+    def status(self):
+        return [lane.status() for lane in self.lanes.values()]
+
+    def _get_cond(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _escolher(self, nome):
+        if nome is not None:
+            lane = self.lanes[nome]
+            # Lane fixada: só ela tem a transação, ignora a quarentena
+            return lane if lane.livre else None
+        candidatas = [l for l in self.lanes.values() if l.livre and l.saudavel]
+        if not candidatas:
+            return None
+        # Prefere a lane com menos falhas recentes
+        return min(candidatas, key=lambda l: l.falhas_consecutivas)
+
+    async def _reservar(self, nome, comando):
+        cond = self._get_cond()
+        async with cond:
+            while True:
+                lane = self._escolher(nome)
+                if lane is not None:
+                    lane.em_andamento = comando
+                    return lane
+                if nome is None and not any(l.saudavel for l in self.lanes.values()):
+                    # Todas em quarentena: reavalia quando a primeira liberar
+                    espera = min(l.bloqueada_ate for l in self.lanes.values()) - time.monotonic()
+                    try: await asyncio.wait_for(cond.wait(), max(0.0, espera))
+                    except asyncio.TimeoutError: pass
+                else:
+                    await cond.wait()
+
+    async def _liberar(self, lane):
+        cond = self._get_cond()
+        async with cond:
+            lane.em_andamento = None
+            cond.notify_all()
+
+    async def submeter(self, operacao, *args, lane=None, **kwargs):
+        """Executa `TefClient.<operacao>` numa lane livre (ou na lane indicada)"""
+        escolhida = await self._reservar(lane, operacao)
+        try:
+            res = await getattr(escolhida.client, operacao)(*args, **kwargs)
+        except TefError:
+            escolhida.registrar_falha()
+            raise
+        finally:
+            await self._liberar(escolhida)
+        escolhida.registrar_sucesso()
+        res.lane = escolhida.nome
+        return res
+
+    # -------------------------------------------------------------------------
+    # Atalhos com a mesma assinatura do TefClient
+    # -------------------------------------------------------------------------
+    async def credit(self, *args, lane=None, **kwargs):
+        return await self.submeter("credit", *args, lane=lane, **kwargs)
+
+    async def debit(self, *args, lane=None, **kwargs):
+        return await self.submeter("debit", *args, lane=lane, **kwargs)
+
+    async def installment(self, *args, lane=None, **kwargs):
+        return await self.submeter("installment", *args, lane=lane, **kwargs)
+
+    async def pix(self, *args, lane=None, **kwargs):
+        return await self.submeter("pix", *args, lane=lane, **kwargs)
+
+    async def cancel(self, *args, lane=None, **kwargs):
+        return await self.submeter("cancel", *args, lane=lane, **kwargs)
+
+    async def pix_refund(self, *args, lane=None, **kwargs):
+        return await self.submeter("pix_refund", *args, lane=lane, **kwargs)
+
+    async def admin(self, *args, lane=None, **kwargs):
+        return await self.submeter("admin", *args, lane=lane, **kwargs)
+
+    async def confirm(self, *args, lane, **kwargs):
+        return await self.submeter("confirm", *args, lane=lane, **kwargs)
+
+    async def undo(self, *args, lane, **kwargs):
+        return await self.submeter("undo", *args, lane=lane, **kwargs)
@@ -0,0 +1,174 @@
+import queue
+import asyncio
+
+# =============================================================================
+# BARRAMENTO DE EVENTOS DA INTERFACE (THREADS DO MOTOR -> THREAD DO TK)
+# =============================================================================
+# Workers só publicam eventos; quem toca em widget é a thread do Tk, que
+# drena o barramento em lotes via root.after.
+
+
+class Status:
+    """Texto da linha de status (no lote, vale o último)"""
+    __slots__ = ("texto", "cor")
+
+    def __init__(self, texto, cor="gray"):
+        self.texto = texto
+        self.cor = cor
+
+
+class FilaAlterada:
+    """Texto do indicador da fila (no lote, vale o último)"""
+    __slots__ = ("texto",)
+
+    def __init__(self, texto):
+        self.texto = texto
+
+
+class TransacoesAlteradas:
+    """Status de transações já exibidas mudou (o lote junta todas)"""
+    __slots__ = ("transacoes",)
+
+    def __init__(self, transacoes):
+        self.transacoes = list(transacoes)
+
+
+class TransacaoIncluida:
+    """Transação nova no fim do histórico"""
+    __slots__ = ("transacao",)
+
+    def __init__(self, transacao):
+        self.transacao = transacao
+
+
+class InterfaceAlterada:
+    """Totais/restante precisam ser recalculados (uma vez por lote)"""
+    __slots__ = ()
+
+
+class Aviso:
+    """Mensagem ao operador; quem publica não espera o clique"""
+    __slots__ = ("titulo", "mensagem", "nivel")
+
+    def __init__(self, titulo, mensagem, nivel="info"):
+        self.titulo = titulo
+        self.mensagem = mensagem
+        self.nivel = nivel  # "info", "warning" ou "error"
+
+
+class Pergunta:
+    """
+    Sim/Não ao operador. A resposta chega por `responder(valor)` (qualquer
+    thread); sem resposta em `prazo` segundos vale `padrao`.
+    """
+    __slots__ = ("titulo", "mensagem", "prazo", "padrao", "responder", "respondida")
+
+    def __init__(self, titulo, mensagem, responder, prazo=None, padrao=False):
+        self.titulo = titulo
+        self.mensagem = mensagem
+        self.responder = responder
+        self.prazo = prazo
+        self.padrao = padrao
+        self.respondida = False
+
+
+class Lote:
+    """Eventos drenados num ciclo, já consolidados"""
+    __slots__ = ("status", "fila", "alteradas", "incluidas", "interface", "avisos", "perguntas")
+
+    def __init__(self, eventos):
+        self.status = None
+        self.fila = None
+        self.alteradas = {}  # id -> Transacao (a mesma linha uma vez só)
+        self.incluidas = []
+        self.interface = False
+        self.avisos = []
+        self.perguntas = []
+        for ev in eventos:
+            if isinstance(ev, Status):
+                self.status = ev
+            elif isinstance(ev, FilaAlterada):
+                self.fila = ev
+            elif isinstance(ev, TransacoesAlteradas):
+                for t in ev.transacoes:
+                    self.alteradas[t.id] = t
+            elif isinstance(ev, TransacaoIncluida):
+                self.incluidas.append(ev.transacao)
+            elif isinstance(ev, InterfaceAlterada):
+                self.interface = True
+            elif isinstance(ev, Aviso):
+                self.avisos.append(ev)
+            elif isinstance(ev, Pergunta):
+                self.perguntas.append(ev)
+
+
+class BarramentoUI:
+    """
+    Fila thread-safe de eventos para a interface. `publicar` pode ser
+    chamado de qualquer thread e nunca bloqueia; `iniciar(root, aplicar)`
+    agenda na thread do Tk um ciclo que, a cada `intervalo_ms`, drena até
+    `lote` eventos e chama `aplicar(Lote)` uma vez.
+    """
+
+    def __init__(self, intervalo_ms=50, lote=1000):
+        self.intervalo_ms = intervalo_ms
+        self.lote = lote
+        self._fila = queue.SimpleQueue()
+        self._root = None
+        self._aplicar = None
+        self.publicados = 0
+        self.aplicados = 0
+
+    def publicar(self, evento):
+        self.publicados += 1
+        self._fila.put(evento)
+
+    def drenar(self):
+        eventos = []
+        while len(eventos) < self.lote:
+            try:
+                eventos.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return eventos
+
+    def iniciar(self, root, aplicar):
+        self._root = root
+        self._aplicar = aplicar
+        root.after(self.intervalo_ms, self._ciclo)
+
+    def _ciclo(self):
+        try:
+            eventos = self.drenar()
+            if eventos:
+                self.aplicados += len(eventos)
+                self._aplicar(Lote(eventos))
+        finally:
+            # Sobrou evento (lote cheio): volta logo, sem esperar o intervalo
+            self._root.after(0 if not self._fila.empty() else self.intervalo_ms, self._ciclo)
+
+
+async def perguntar(barramento, titulo, mensagem, prazo=None, padrao=False):
+    """
+    Pergunta Sim/Não sem bloquear o loop nem a interface: publica a
+    Pergunta e aguarda a resposta; esgotado o `prazo`, devolve `padrao`.
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def resolver(valor):
+        if not fut.done():
+            fut.set_result(valor)
+
+    def responder(valor):
+        pergunta.respondida = True
+        loop.call_soon_threadsafe(resolver, valor)
+
+    pergunta = Pergunta(titulo, mensagem, responder, prazo, padrao)
+    barramento.publicar(pergunta)
+    try:
+        return await asyncio.wait_for(fut, prazo)
+    except asyncio.TimeoutError:
+        # O diálogo se fecha sozinho no mesmo prazo; resposta tardia é ignorada
+        pergunta.respondida = True
+        return padrao
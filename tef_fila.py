@@ -0,0 +1,191 @@
+import heapq
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future
+
+# =============================================================================
+# FILA DE PEDIDOS TEF (PRIORIDADE + CONTRAPRESSÃO)
+# =============================================================================
+# Menor valor sai primeiro
+PRIORIDADE_FINALIZACAO = 0  # CNF / NCN / recuperação
+PRIORIDADE_CANCELAMENTO = 1  # CNC / devolução PIX
+PRIORIDADE_VENDA = 2
+PRIORIDADE_ADM = 3
+
+NA_FILA = "NA_FILA"
+EXECUTANDO = "EXECUTANDO"
+CONCLUIDO = "CONCLUIDO"
+CANCELADO = "CANCELADO"
+
+
+class FilaCheia(Exception):
+    """Capacidade esgotada: o pedido não foi aceito"""
+
+
+class Pedido:
+    __slots__ = ("seq", "prioridade", "chave", "descricao", "tarefa", "future", "estado")
+
+    def __init__(self, seq, prioridade, chave, descricao, tarefa):
+        self.seq = seq
+        self.prioridade = prioridade
+        self.chave = chave
+        self.descricao = descricao
+        self.tarefa = tarefa  # callable sem argumentos que devolve a corrotina
+        self.future = Future()
+        self.estado = NA_FILA
+
+    def __lt__(self, outro):
+        return (self.prioridade, self.seq) < (outro.prioridade, outro.seq)
+
+
+class FilaTef:
+    """
+    Agenda as operações TEF de um terminal no loop asyncio do motor.
+    `submeter` pode ser chamado de qualquer thread (inclusive a do Tk):
+    - capacidade limitada (FilaCheia), exceto finalizações, que nunca são
+      recusadas;
+    - CNF/NCN antes de cancelamentos, e estes antes de vendas (FIFO dentro
+      da mesma prioridade);
+    - pedido com a mesma `chave` de outro na fila ou em execução devolve o
+      Pedido existente (duplo clique);
+    - pedidos ainda na fila podem ser cancelados;
+    - `em_voo` conta exatamente o que está em execução (no máximo
+      `concorrencia`, 1 para um único IntPos.001).
+    `ao_mudar(fila)` é chamado (na thread do loop) a cada mudança.
+    """
+
+    def __init__(self, loop, capacidade=8, concorrencia=1, ao_mudar=None):
+        self.loop = loop
+        self.capacidade = capacidade
+        self.concorrencia = concorrencia
+        self.ao_mudar = ao_mudar
+        self._lock = threading.Lock()
+        self._heap = []
+        self._por_chave = {}
+        self._seq = itertools.count()
+        self._acordar = None
+        self.na_fila = 0
+        self.em_voo = 0
+        self.contadores = {"aceitos": 0, "duplicados": 0, "recusados": 0, "concluidos": 0, "cancelados": 0}
+        self._trabalhadores = [asyncio.run_coroutine_threadsafe(self._trabalhador(), loop)
+                               for _ in range(concorrencia)]
+
+    # -------------------------------------------------------------------------
+    # Entrada (qualquer thread)
+    # -------------------------------------------------------------------------
+    def submeter(self, tarefa, prioridade=PRIORIDADE_VENDA, chave=None, descricao=""):
+        with self._lock:
+            if chave is not None and chave in self._por_chave:
+                self.contadores["duplicados"] += 1
+                return self._por_chave[chave]
+            if prioridade != PRIORIDADE_FINALIZACAO and self.na_fila >= self.capacidade:
+                self.contadores["recusados"] += 1
+                raise FilaCheia(f"Fila TEF cheia ({self.na_fila} pedidos aguardando)")
+            pedido = Pedido(next(self._seq), prioridade, chave, descricao, tarefa)
+            heapq.heappush(self._heap, pedido)
+            self.na_fila += 1
+            if chave is not None:
+                self._por_chave[chave] = pedido
+            self.contadores["aceitos"] += 1
+        self.loop.call_soon_threadsafe(self._sinalizar)
+        return pedido
+
+    def cancelar(self, pedido):
+        """Tira da fila um pedido que ainda não começou; True se cancelou"""
+        with self._lock:
+            if pedido.estado != NA_FILA:
+                return False
+            pedido.estado = CANCELADO
+            self.na_fila -= 1
+            self._esquecer(pedido)
+            self.contadores["cancelados"] += 1
+        # O item cancelado fica no heap e é descartado ao ser retirado
+        pedido.future.cancel()
+        self.loop.call_soon_threadsafe(self._sinalizar)
+        return True
+
+    def cancelar_todos(self, prioridade_minima=PRIORIDADE_CANCELAMENTO):
+        """Cancela o que está na fila com prioridade >= `prioridade_minima`"""
+        with self._lock:
+            alvos = [p for p in self._heap if p.estado == NA_FILA and p.prioridade >= prioridade_minima]
+        return sum(self.cancelar(p) for p in alvos)
+
+    def status(self):
+        with self._lock:
+            return {
+                "na_fila": self.na_fila,
+                "em_voo": self.em_voo,
+                "capacidade": self.capacidade,
+                **self.contadores,
+            }
+
+    @property
+    def ocupada(self):
+        with self._lock:
+            return self.em_voo > 0 or self.na_fila > 0
+
+    # -------------------------------------------------------------------------
+    # Execução (thread do loop)
+    # -------------------------------------------------------------------------
+    def _esquecer(self, pedido):
+        if pedido.chave is not None and self._por_chave.get(pedido.chave) is pedido:
+            del self._por_chave[pedido.chave]
+
+    def _sinalizar(self):
+        if self._acordar is not None:
+            self._acordar.set()
+        if self.ao_mudar:
+            self.ao_mudar(self)
+
+    def _retirar(self):
+        with self._lock:
+            while self._heap:
+                pedido = heapq.heappop(self._heap)
+                if pedido.estado == NA_FILA:
+                    pedido.estado = EXECUTANDO
+                    self.na_fila -= 1
+                    self.em_voo += 1
+                    return pedido
+        return None
+
+    async def _trabalhador(self):
+        if self._acordar is None:
+            self._acordar = asyncio.Event()
+        while True:
+            pedido = self._retirar()
+            if pedido is None:
+                self._acordar.clear()
+                # Reconfere: um submeter pode ter chegado entre o _retirar e o clear
+                pedido = self._retirar()
+                if pedido is None:
+                    await self._acordar.wait()
+                    continue
+            if self.ao_mudar:
+                self.ao_mudar(self)
+            try:
+                resultado = await pedido.tarefa()
+            except Exception as e:
+                pedido.future.set_exception(e)
+            except asyncio.CancelledError:
+                pedido.future.cancel()
+                raise
+            else:
+                pedido.future.set_result(resultado)
+            finally:
+                with self._lock:
+                    pedido.estado = CONCLUIDO
+                    self.em_voo -= 1
+                    self._esquecer(pedido)
+                    self.contadores["concluidos"] += 1
+                if self.ao_mudar:
+                    self.ao_mudar(self)
+
+    async def aguardar(self, pedido):
+        """Aguarda o resultado de um pedido a partir de outra corrotina do loop"""
+        try:
+            return await asyncio.wrap_future(pedido.future)
+        except asyncio.CancelledError:
+            if pedido.estado == CANCELADO:
+                return None
+            raise
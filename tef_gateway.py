@@ -0,0 +1,326 @@
+"""
+Gateway TEF local: um processo dono dos diretórios REQ/RESP e das
+sequências, compartilhado por vários PDVs.
+
+    python tef_gateway.py [--endereco unix:/tmp/tefip.sock | 127.0.0.1:8765] [BASE ...]
+
+Protocolo: uma mensagem JSON por linha, em conexões persistentes. Pedido
+{"id": n, "op": "credit", "args": [...], "kwargs": {...}}; resposta
+{"id": n, "ok": true, "resultado": {...}} ou {"id": n, "ok": false,
+"erro": "...", "tipo": "TefError"}. Vários pedidos podem estar em voo na
+mesma conexão; as respostas chegam na ordem em que terminam.
+"""
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+from collections import OrderedDict
+from dataclasses import fields
+
+import tef_codec
+from tef_protocolo import TefConfig
+from tef_client import TefClient, TefError, TefResultado
+
+# Operações aceitas (as mesmas do TefDispatcher) + status
+OPERACOES = ("credit", "debit", "installment", "pix", "cancel", "pix_refund", "admin", "confirm", "undo")
+FINALIZACOES = ("confirm", "undo")
+LIMITE_LINHA = 1024 * 1024
+
+
+def _endereco(texto):
+    """"unix:/caminho" -> ("unix", caminho); "host:porta" -> ("tcp", (host, porta))"""
+    if texto.startswith("unix:"):
+        return "unix", texto[5:]
+    host, _, porta = texto.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(porta))
+
+
+def resultado_para_json(res):
+    dados = {f.name: getattr(res, f.name) for f in fields(res) if f.name != "resposta"}
+    resp = res.resposta or {}
+    dados["resposta"] = {"campos": dict(resp), "repetidos": getattr(resp, "repetidos", {}),
+                         "completa": getattr(resp, "completa", False)}
+    return dados
+
+
+def resultado_de_json(dados):
+    bruto = dados.pop("resposta", None) or {}
+    resp = tef_codec.IntPosMensagem()
+    resp.update(bruto.get("campos", {}))
+    resp.repetidos = bruto.get("repetidos", {})
+    resp.completa = bruto.get("completa", False)
+    return TefResultado(resposta=resp, **dados)
+
+
+# =============================================================================
+# SERVIDOR
+# =============================================================================
+class TefGateway:
+    """
+    Recebe pedidos de vários processos e os distribui pelas lanes do
+    TefDispatcher (que cuida de 001-000, STS e de um pedido por vez em cada
+    IntPos.001). CNF/NCN sem `lane` vão para a lane que aprovou o NSU.
+    """
+
+    def __init__(self, dispatcher, memoria_nsu=10000):
+        self.dispatcher = dispatcher
+        self.memoria_nsu = memoria_nsu
+        self._lane_por_nsu = OrderedDict()
+        self._servidor = None
+        self.conexoes = 0
+        self.pedidos = 0
+
+    def _lembrar(self, res):
+        if res.nsu and res.lane:
+            self._lane_por_nsu[res.nsu] = res.lane
+            self._lane_por_nsu.move_to_end(res.nsu)
+            while len(self._lane_por_nsu) > self.memoria_nsu:
+                self._lane_por_nsu.popitem(last=False)
+
+    def _lane_da_finalizacao(self, args, kwargs):
+        if kwargs.get("lane"):
+            return kwargs.pop("lane")
+        kwargs.pop("lane", None)
+        nsu = args[1] if len(args) > 1 else kwargs.get("nsu")
+        if nsu in self._lane_por_nsu:
+            return self._lane_por_nsu[nsu]
+        if len(self.dispatcher.lanes) == 1:
+            return next(iter(self.dispatcher.lanes))
+        raise TefError(f"NSU {nsu}: lane de origem desconhecida (informe lane=)")
+
+    async def executar(self, op, args, kwargs):
+        if op == "status":
+            return self.dispatcher.status()
+        if op not in OPERACOES:
+            raise ValueError(f"Operação desconhecida: {op}")
+        if op in FINALIZACOES:
+            lane = self._lane_da_finalizacao(args, kwargs)
+        else:
+            lane = kwargs.pop("lane", None)
+        res = await self.dispatcher.submeter(op, *args, lane=lane, **kwargs)
+        self._lembrar(res)
+        return resultado_para_json(res)
+
+    async def _atender_pedido(self, pedido, writer, lock_escrita):
+        resposta = {"id": pedido.get("id")}
+        try:
+            resposta["resultado"] = await self.executar(pedido.get("op"), list(pedido.get("args", [])),
+                                                        dict(pedido.get("kwargs", {})))
+            resposta["ok"] = True
+        except Exception as e:
+            resposta.update(ok=False, erro=str(e), tipo=type(e).__name__)
+        linha = json.dumps(resposta, ensure_ascii=False).encode("utf-8") + b"\n"
+        async with lock_escrita:
+            writer.write(linha)
+            await writer.drain()
+
+    async def _conexao(self, reader, writer):
+        self.conexoes += 1
+        lock_escrita = asyncio.Lock()
+        tarefas = set()
+        try:
+            while True:
+                try:
+                    linha = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not linha:
+                    break
+                try:
+                    pedido = json.loads(linha)
+                except ValueError:
+                    continue
+                self.pedidos += 1
+                tarefa = asyncio.ensure_future(self._atender_pedido(pedido, writer, lock_escrita))
+                tarefas.add(tarefa)
+                tarefa.add_done_callback(tarefas.discard)
+            # Cliente fechou a escrita: termina o que já estava em voo
+            if tarefas:
+                await asyncio.gather(*tarefas, return_exceptions=True)
+        finally:
+            self.conexoes -= 1
+            writer.close()
+
+    async def iniciar(self, endereco=None):
+        tipo, alvo = _endereco(endereco or TefConfig.GATEWAY)
+        if tipo == "unix":
+            import os
+            if os.path.exists(alvo):
+                # Só remove socket órfão: se alguém atende, outro gateway é dono das lanes
+                try:
+                    _, writer = await asyncio.open_unix_connection(alvo)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove(alvo)
+                else:
+                    writer.close()
+                    raise OSError(f"Outro gateway TEF já atende em {alvo}")
+            self._servidor = await asyncio.start_unix_server(self._conexao, alvo, limit=LIMITE_LINHA)
+        else:
+            self._servidor = await asyncio.start_server(self._conexao, *alvo, limit=LIMITE_LINHA)
+        return self._servidor
+
+    async def servir(self, endereco=None):
+        servidor = await self.iniciar(endereco)
+        async with servidor:
+            await servidor.serve_forever()
+
+
+# =============================================================================
+# CLIENTE
+# =============================================================================
+class _Conexao:
+    """Conexão persistente com pedidos em paralelo (casados pelo id)"""
+
+    def __init__(self, endereco):
+        self.endereco = endereco
+        self._reader = self._writer = None
+        self._abrindo = None
+        self._ids = itertools.count(1)
+        self._pendentes = {}
+
+    async def _abrir(self):
+        tipo, alvo = _endereco(self.endereco)
+        if tipo == "unix":
+            self._reader, self._writer = await asyncio.open_unix_connection(alvo, limit=LIMITE_LINHA)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(*alvo, limit=LIMITE_LINHA)
+        asyncio.ensure_future(self._ler(self._reader))
+
+    async def _garantir(self):
+        if self._writer is None or self._writer.is_closing():
+            if self._abrindo is None:
+                self._abrindo = asyncio.ensure_future(self._abrir())
+            try:
+                await self._abrindo
+            finally:
+                self._abrindo = None
+
+    async def _ler(self, reader):
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha:
+                    break
+                resposta = json.loads(linha)
+                fut = self._pendentes.pop(resposta.get("id"), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(resposta)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            # Conexão caiu: quem esperava recebe erro; a próxima chamada reconecta
+            self._writer = None
+            for fut in self._pendentes.values():
+                if not fut.done():
+                    fut.set_exception(TefError("Conexão com o gateway TEF perdida."))
+            self._pendentes.clear()
+
+    @property
+    def em_voo(self):
+        return len(self._pendentes)
+
+    async def chamar(self, op, args, kwargs):
+        try:
+            await self._garantir()
+        except OSError as e:
+            raise TefError(f"Gateway TEF indisponível: {e}")
+        id_pedido = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pendentes[id_pedido] = fut
+        self._writer.write(json.dumps({"id": id_pedido, "op": op, "args": args, "kwargs": kwargs},
+                                      ensure_ascii=False).encode("utf-8") + b"\n")
+        await self._writer.drain()
+        resposta = await fut
+        if not resposta.get("ok"):
+            if resposta.get("tipo") == "TefError":
+                raise TefError(resposta.get("erro"))
+            raise RuntimeError(resposta.get("erro"))
+        return resposta.get("resultado")
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class GatewayClient:
+    """
+    Mesma API assíncrona do TefClient, falando com o TefGateway. Mantém
+    `conexoes` conexões persistentes e usa a menos ocupada em cada pedido.
+    """
+
+    def __init__(self, endereco=None, conexoes=1):
+        self.endereco = endereco or TefConfig.GATEWAY
+        self._pool = [_Conexao(self.endereco) for _ in range(conexoes)]
+
+    async def chamar(self, op, *args, **kwargs):
+        conexao = min(self._pool, key=lambda c: c.em_voo)
+        dados = await conexao.chamar(op, list(args), kwargs)
+        return dados if op == "status" else resultado_de_json(dados)
+
+    def close(self):
+        for c in self._pool:
+            c.close()
+
+    async def status(self):
+        return await self.chamar("status")
+
+    async def credit(self, *args, **kwargs):
+        return await self.chamar("credit", *args, **kwargs)
+
+    async def debit(self, *args, **kwargs):
+        return await self.chamar("debit", *args, **kwargs)
+
+    async def installment(self, *args, **kwargs):
+        return await self.chamar("installment", *args, **kwargs)
+
+    async def pix(self, *args, **kwargs):
+        return await self.chamar("pix", *args, **kwargs)
+
+    async def cancel(self, *args, **kwargs):
+        return await self.chamar("cancel", *args, **kwargs)
+
+    async def pix_refund(self, *args, **kwargs):
+        return await self.chamar("pix_refund", *args, **kwargs)
+
+    async def admin(self, *args, **kwargs):
+        return await self.chamar("admin", *args, **kwargs)
+
+    async def confirm(self, *args, **kwargs):
+        return await self.chamar("confirm", *args, **kwargs)
+
+    async def undo(self, *args, **kwargs):
+        return await self.chamar("undo", *args, **kwargs)
+
+    # Mesmo lote do cliente local (usa confirm/undo acima)
+    finalizar_lote = TefClient.finalizar_lote
+
+
+def main(argv=None):
+    import tef_metricas
+    from tef_dispatcher import TefDispatcher
+
+    ap = argparse.ArgumentParser(description="Gateway TEF local (REQ/RESP compartilhados)")
+    ap.add_argument("bases", nargs="*", help="diretórios base (padrão: TefConfig.LANES)")
+    ap.add_argument("--endereco", default=TefConfig.GATEWAY or "127.0.0.1:8765",
+                    help="unix:/caminho.sock ou host:porta")
+    ap.add_argument("--timeout", type=float, default=None,
+                    help="prazo fixo de resposta em segundos (padrão: adaptativo, TefConfig.TIMEOUT_LIMITES)")
+    args = ap.parse_args(argv)
+
+    dispatcher = TefDispatcher.from_config(args.bases or None, timeout=args.timeout)
+    dispatcher.iniciar_limpeza()
+    tef_metricas.iniciar_exportadores()
+    gateway = TefGateway(dispatcher)
+    print(f"Gateway TEF em {args.endereco} com {len(dispatcher.lanes)} lane(s). Ctrl+C para encerrar.")
+    try:
+        asyncio.run(gateway.servir(args.endereco))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
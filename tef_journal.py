@@ -0,0 +1,175 @@
+import time
+import sqlite3
+import threading
+
+from tef_protocolo import TefConfig
+from tef_ledger import Transacao
+
+# =============================================================================
+# JOURNAL PERSISTENTE DE TRANSAÇÕES (SQLite WAL)
+# =============================================================================
+# Status que ainda exigem CNF/NCN (CONFIRMANDO/ESTORNANDO: lote interrompido)
+STATUS_ABERTOS = ("PENDENTE", "CONFIRMANDO", "ESTORNANDO")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transacoes (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_req          TEXT,
+    nsu             TEXT,
+    rede            TEXT,
+    finalizacao     TEXT,
+    valor_cents     INTEGER NOT NULL,
+    tipo            TEXT NOT NULL,
+    parcelas        TEXT,
+    data_operacao   TEXT,
+    hora_operacao   TEXT,
+    status          TEXT NOT NULL,
+    doc_fiscal      TEXT,
+    lane            TEXT,
+    criado_em       REAL NOT NULL,
+    atualizado_em   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_transacoes_nsu ON transacoes (nsu);
+CREATE INDEX IF NOT EXISTS ix_transacoes_rede ON transacoes (rede);
+CREATE INDEX IF NOT EXISTS ix_transacoes_doc_fiscal ON transacoes (doc_fiscal);
+CREATE INDEX IF NOT EXISTS ix_transacoes_status ON transacoes (status);
+
+-- Log somente-inclusão: cada registro e cada mudança de status
+CREATE TABLE IF NOT EXISTS eventos (
+    seq             INTEGER PRIMARY KEY AUTOINCREMENT,
+    transacao_id    INTEGER NOT NULL,
+    status          TEXT NOT NULL,
+    ts              REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_eventos_transacao ON eventos (transacao_id, seq);
+"""
+
+_COLUNAS = ("id", "id_req", "nsu", "rede", "finalizacao", "valor_cents", "tipo", "parcelas",
+            "data_operacao", "hora_operacao", "status", "doc_fiscal", "lane")
+
+
+class TransacaoAmbigua(LookupError):
+    """A chave informada não identifica exatamente uma transação"""
+
+
+class TransacaoJournal:
+    """
+    Histórico de transações em SQLite (WAL) com índices por NSU, rede,
+    documento fiscal e status. As escritas entram na transação aberta e são
+    gravadas em lote (a cada `intervalo_commit` segundos ou `lote` escritas);
+    `commit=True` força a gravação imediata dos registros críticos.
+    """
+
+    def __init__(self, caminho=None, intervalo_commit=0.2, lote=500):
+        self.caminho = caminho or TefConfig.FILE_JOURNAL
+        self.intervalo_commit = intervalo_commit
+        self.lote = lote
+        self._lock = threading.RLock()
+        self._nao_gravados = 0
+        self._db = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level="DEFERRED")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+        self._fechado = threading.Event()
+        threading.Thread(target=self._gravador, daemon=True, name="tef-journal").start()
+
+    # -------------------------------------------------------------------------
+    # Gravação em lote
+    # -------------------------------------------------------------------------
+    def _gravador(self):
+        while not self._fechado.wait(self.intervalo_commit):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._nao_gravados:
+                self._db.commit()
+                self._nao_gravados = 0
+
+    def _escrita(self, commit):
+        self._nao_gravados += 1
+        if commit or self._nao_gravados >= self.lote:
+            self._db.commit()
+            self._nao_gravados = 0
+
+    def close(self):
+        self._fechado.set()
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    # -------------------------------------------------------------------------
+    # Escrita
+    # -------------------------------------------------------------------------
+    def registrar(self, t, commit=False):
+        """Inclui uma Transacao e devolve o id estável"""
+        agora = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO transacoes (id_req, nsu, rede, finalizacao, valor_cents, tipo, parcelas,"
+                " data_operacao, hora_operacao, status, doc_fiscal, lane, criado_em, atualizado_em)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (t.id_req, t.nsu, t.rede, t.finalizacao, t.valor_cents, t.tipo, str(t.parcelas or ""),
+                 t.data_operacao, t.hora_operacao, t.status, t.doc_fiscal, t.lane, agora, agora))
+            id_transacao = cur.lastrowid
+            self._db.execute("INSERT INTO eventos (transacao_id, status, ts) VALUES (?, ?, ?)",
+                             (id_transacao, t.status, agora))
+            self._escrita(commit)
+        return id_transacao
+
+    def atualizar_status(self, id_transacao, status, commit=False):
+        agora = time.time()
+        with self._lock:
+            self._db.execute("UPDATE transacoes SET status = ?, atualizado_em = ? WHERE id = ?",
+                             (status, agora, id_transacao))
+            self._db.execute("INSERT INTO eventos (transacao_id, status, ts) VALUES (?, ?, ?)",
+                             (id_transacao, status, agora))
+            self._escrita(commit)
+
+    def atualizar_status_nsu(self, nsu, status, rede=None, data_operacao=None, commit=False):
+        """
+        Muda o status da transação do NSU (mais `rede` e `data_operacao`,
+        quando informados) e devolve o id. NSU se repete entre dias e
+        adquirentes: nenhuma ou mais de uma transação casando é
+        TransacaoAmbigua, sem alterar nada.
+        """
+        with self._lock:
+            candidatas = [t for t in self.buscar_nsu(nsu)
+                          if (not rede or t.rede == rede) and (not data_operacao or t.data_operacao == data_operacao)]
+            if len(candidatas) != 1:
+                raise TransacaoAmbigua(
+                    f"NSU {nsu} (rede={rede or '-'}, data={data_operacao or '-'}): "
+                    f"{len(candidatas)} transações no journal, esperada 1")
+            self.atualizar_status(candidatas[0].id, status, commit=commit)
+        return candidatas[0].id
+
+    # -------------------------------------------------------------------------
+    # Consulta
+    # -------------------------------------------------------------------------
+    def _consultar(self, where, params):
+        with self._lock:
+            linhas = self._db.execute(
+                f"SELECT {', '.join(_COLUNAS)} FROM transacoes WHERE {where} ORDER BY id", params).fetchall()
+        return [self._para_transacao(l) for l in linhas]
+
+    @staticmethod
+    def _para_transacao(linha):
+        campos = dict(zip(_COLUNAS, linha))
+        parcelas = campos["parcelas"] or ""
+        campos["parcelas"] = int(parcelas) if parcelas.isdigit() else parcelas
+        return Transacao(**campos)
+
+    def buscar_nsu(self, nsu):
+        return self._consultar("nsu = ?", (nsu,))
+
+    def buscar_doc_fiscal(self, doc_fiscal):
+        return self._consultar("doc_fiscal = ?", (doc_fiscal,))
+
+    def buscar_status(self, *status):
+        return self._consultar(f"status IN ({', '.join('?' * len(status))})", status)
+
+    def carregar_pendentes(self):
+        """Transações não finalizadas (sobrevivem a fechamento/crash do app)"""
+        return self.buscar_status(*STATUS_ABERTOS)
@@ -0,0 +1,122 @@
+from decimal import Decimal, InvalidOperation
+
+# =============================================================================
+# LEDGER DE PAGAMENTOS (CENTAVOS INTEIROS)
+# =============================================================================
+# Status que abatem do total da venda
+STATUS_PAGOS = ("PENDENTE", "CONFIRMADO")
+
+
+def para_cents(texto):
+    """ "100,50" / "100.50" / "100" -> 10050; inválido -> 0 (sem passar por float)"""
+    try:
+        valor = Decimal(str(texto).strip().replace(",", "."))
+    except InvalidOperation:
+        return 0
+    if not valor.is_finite():
+        return 0
+    return int((valor * 100).to_integral_value())
+
+
+def formatar_cents(cents):
+    sinal = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sinal}{cents // 100}.{cents % 100:02d}"
+
+
+class Transacao:
+    """Registro compacto de uma transação do histórico"""
+    __slots__ = ("id", "id_req", "nsu", "rede", "finalizacao", "valor_cents", "tipo", "parcelas",
+                 "data_operacao", "hora_operacao", "status", "doc_fiscal", "lane")
+
+    def __init__(self, valor_cents, tipo, status, id=None, id_req=None, nsu=None, rede=None,
+                 finalizacao=None, parcelas="", data_operacao=None, hora_operacao=None,
+                 doc_fiscal=None, lane=None):
+        self.id = id
+        self.id_req = id_req
+        self.nsu = nsu
+        self.rede = rede
+        self.finalizacao = finalizacao
+        self.valor_cents = int(valor_cents)
+        self.tipo = tipo
+        self.parcelas = parcelas
+        self.data_operacao = data_operacao
+        self.hora_operacao = hora_operacao
+        self.status = status
+        self.doc_fiscal = doc_fiscal
+        self.lane = lane
+
+    @property
+    def valor_display(self):
+        return formatar_cents(self.valor_cents)
+
+    def __repr__(self):
+        return f"Transacao(id={self.id}, nsu={self.nsu}, valor={self.valor_display}, status={self.status})"
+
+
+class Ledger:
+    """
+    Transações da venda com totais correntes (em centavos) por status, rede
+    e tipo, atualizados em O(1) a cada inclusão ou mudança de status.
+    """
+
+    def __init__(self):
+        self.registros = []
+        self.por_id = {}
+        self._por_nsu = {}
+        self._por_status = {}  # status -> {id: Transacao}
+        self.total_status = {}
+        self.total_rede = {}   # (rede, status) -> cents
+        self.total_tipo = {}   # (tipo, status) -> cents
+
+    def __len__(self):
+        return len(self.registros)
+
+    def __iter__(self):
+        return iter(self.registros)
+
+    def _somar(self, t, sinal):
+        v = sinal * t.valor_cents
+        self.total_status[t.status] = self.total_status.get(t.status, 0) + v
+        chave_rede = (t.rede, t.status)
+        self.total_rede[chave_rede] = self.total_rede.get(chave_rede, 0) + v
+        chave_tipo = (t.tipo, t.status)
+        self.total_tipo[chave_tipo] = self.total_tipo.get(chave_tipo, 0) + v
+        if sinal > 0:
+            self._por_status.setdefault(t.status, {})[t.id] = t
+        else:
+            self._por_status.get(t.status, {}).pop(t.id, None)
+
+    def adicionar(self, t):
+        self.registros.append(t)
+        self.por_id[str(t.id)] = t
+        if t.nsu:
+            self._por_nsu.setdefault(t.nsu, []).append(t)
+        self._somar(t, +1)
+
+    def mudar_status(self, t, status):
+        if t.status == status:
+            return
+        self._somar(t, -1)
+        t.status = status
+        self._somar(t, +1)
+
+    def buscar(self, id_transacao):
+        return self.por_id.get(str(id_transacao))
+
+    def por_nsu(self, nsu):
+        return self._por_nsu.get(nsu, [])
+
+    def com_status(self, status):
+        """Transações no status, em ordem de inclusão (custo proporcional ao resultado)"""
+        return list(self._por_status.get(status, {}).values())
+
+    def quantidade(self, status):
+        return len(self._por_status.get(status, ()))
+
+    @property
+    def pago_cents(self):
+        return sum(self.total_status.get(s, 0) for s in STATUS_PAGOS)
+
+    def restante_cents(self, total_cents):
+        return max(0, total_cents - self.pago_cents)
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# =============================================================================
+# MÉTRICAS E TRACE POR TRANSAÇÃO
+# =============================================================================
+# Limites dos histogramas (segundos)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Resultados possíveis de uma troca
+APROVADO = "aprovado"
+RECUSADO = "recusado"
+RECONHECIDO = "reconhecido"  # CNF/NCN com STS
+SEM_STS = "sem_sts"
+TIMEOUT = "timeout"
+PARCIAL = "parcial"  # IntPos.001 não completou no prazo
+ERRO = "erro"
+
+
+class Histograma:
+    __slots__ = ("contagens", "soma", "total")
+
+    def __init__(self):
+        self.contagens = [0] * len(BUCKETS)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.soma += valor
+        self.total += 1
+        for i, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+
+
+class Medicao:
+    """Fases de uma troca IntPos, identificada por 001-000 e 000-000"""
+
+    def __init__(self, comando, lane=None):
+        self.comando = comando
+        self.lane = lane or ""
+        self.id_req = None
+        self.inicio = time.perf_counter()
+        self.ts = time.time()
+        self.fases = {}
+        self.resultado = None
+        self.detalhe = None
+
+    @property
+    def duracao(self):
+        return time.perf_counter() - self.inicio
+
+    def registrar(self, fase, segundos):
+        self.fases[fase] = self.fases.get(fase, 0.0) + segundos
+
+
+@contextmanager
+def fase(medicao, nome):
+    """Cronometra um trecho dentro da medição (medicao=None não mede nada)"""
+    if medicao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.registrar(nome, time.perf_counter() - inicio)
+
+
+class Metricas:
+    """Histogramas por fase/comando/lane e contadores por resultado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fases = {}        # (fase, comando, lane) -> Histograma
+        self.duracoes = {}     # (comando, lane) -> Histograma
+        self.resultados = {}   # (comando, lane, resultado) -> int
+        self._trace = None
+
+    def configurar_trace(self, caminho, max_bytes=10 * 1024 * 1024, backups=5):
+        """Log estruturado (JSON por linha) de cada transação, com rotação"""
+        import logging
+        import logging.handlers
+
+        logger = logging.getLogger(f"tef.trace.{id(self)}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(caminho, maxBytes=max_bytes,
+                                                       backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        self._trace = logger
+
+    def iniciar(self, comando, lane=None):
+        return Medicao(comando, lane)
+
+    def concluir(self, medicao, resultado=None):
+        if resultado is not None and medicao.resultado is None:
+            medicao.resultado = resultado
+        medicao.resultado = medicao.resultado or ERRO
+        total = medicao.duracao
+        with self._lock:
+            for nome, segundos in medicao.fases.items():
+                chave = (nome, medicao.comando, medicao.lane)
+                self.fases.setdefault(chave, Histograma()).observar(segundos)
+            self.duracoes.setdefault((medicao.comando, medicao.lane), Histograma()).observar(total)
+            chave = (medicao.comando, medicao.lane, medicao.resultado)
+            self.resultados[chave] = self.resultados.get(chave, 0) + 1
+
+        if self._trace is not None:
+            self._trace.info(json.dumps({
+                "ts": medicao.ts,
+                "id_req": medicao.id_req,
+                "comando": medicao.comando,
+                "lane": medicao.lane,
+                "resultado": medicao.resultado,
+                "detalhe": medicao.detalhe,
+                "total_ms": round(total * 1e3, 3),
+                "fases_ms": {k: round(v * 1e3, 3) for k, v in medicao.fases.items()},
+            }, ensure_ascii=False))
+
+    # -------------------------------------------------------------------------
+    # Exportação (formato texto do Prometheus)
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _rotulos(**rotulos):
+        return ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in rotulos.items())
+
+    def _histograma(self, linhas, nome, rotulos, h):
+        acumulado = 0
+        for limite, n in zip(BUCKETS, h.contagens):
+            acumulado += n
+            linhas.append(f"{nome}_bucket{{{rotulos},le=\"{limite}\"}} {acumulado}")
+        linhas.append(f"{nome}_bucket{{{rotulos},le=\"+Inf\"}} {h.total}")
+        linhas.append(f"{nome}_sum{{{rotulos}}} {h.soma:.6f}")
+        linhas.append(f"{nome}_count{{{rotulos}}} {h.total}")
+
+    def exportar_prometheus(self):
+        linhas = []
+        with self._lock:
+            linhas.append("# HELP tef_fase_segundos Duração de cada fase da troca IntPos")
+            linhas.append("# TYPE tef_fase_segundos histogram")
+            for (nome, comando, lane), h in sorted(self.fases.items()):
+                self._histograma(linhas, "tef_fase_segundos", self._rotulos(fase=nome, comando=comando, lane=lane), h)
+
+            linhas.append("# HELP tef_transacao_segundos Duração total da troca IntPos")
+            linhas.append("# TYPE tef_transacao_segundos histogram")
+            for (comando, lane), h in sorted(self.duracoes.items()):
+                self._histograma(linhas, "tef_transacao_segundos", self._rotulos(comando=comando, lane=lane), h)
+
+            linhas.append("# HELP tef_transacoes_total Trocas IntPos por resultado "
+                          "(aprovado, recusado, reconhecido, sem_sts, timeout, parcial, erro)")
+            linhas.append("# TYPE tef_transacoes_total counter")
+            for (comando, lane, resultado), n in sorted(self.resultados.items()):
+                linhas.append(f"tef_transacoes_total{{{self._rotulos(comando=comando, lane=lane, resultado=resultado)}}} {n}")
+        return "\n".join(linhas) + "\n"
+
+    def gravar_arquivo(self, caminho):
+        """Grava o texto Prometheus de forma atômica (textfile collector)"""
+        tmp = caminho + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.exportar_prometheus())
+        os.replace(tmp, caminho)
+
+
+# Registro global usado pelo TefClient quando nenhum outro é informado
+METRICAS = Metricas()
+
+
+def iniciar_servidor(metricas=None, porta=9464, host="127.0.0.1"):
+    """Endpoint local GET /metrics em thread daemon"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    metricas = metricas or METRICAS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            corpo = metricas.exportar_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, porta), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="tef-metricas").start()
+    return servidor
+
+
+def iniciar_gravacao_periodica(caminho, metricas=None, intervalo=15.0):
+    """Regrava o arquivo de métricas a cada `intervalo` segundos (thread daemon)"""
+    metricas = metricas or METRICAS
+    parar = threading.Event()
+
+    def laco():
+        while not parar.wait(intervalo):
+            try: metricas.gravar_arquivo(caminho)
+            except OSError: pass
+
+    threading.Thread(target=laco, daemon=True, name="tef-metricas-arquivo").start()
+    return parar
+
+
+def iniciar_exportadores(metricas=None):
+    """Liga o que estiver configurado no TefConfig (porta, arquivo, trace)"""
+    from tef_protocolo import TefConfig
+    metricas = metricas or METRICAS
+    if TefConfig.TRACE_LOG:
+        metricas.configurar_trace(TefConfig.TRACE_LOG)
+    if TefConfig.METRICAS_ARQUIVO:
+        iniciar_gravacao_periodica(TefConfig.METRICAS_ARQUIVO, metricas)
+    if TefConfig.METRICAS_PORTA:
+        iniciar_servidor(metricas, TefConfig.METRICAS_PORTA)
@@ -0,0 +1,478 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import tef_codec
+import tef_captura
+from tef_metricas import fase, SEM_STS, TIMEOUT, PARCIAL, ERRO
+from tef_watcher import criar_watcher
+
+# =============================================================================
+# CONFIGURAÇÕES
+# =============================================================================
+class TefConfig:
+    DIR_BASE = r"C:\Auttar_TefIP"
+    DIR_REQ = os.path.join(DIR_BASE, "REQ")
+    DIR_RESP = os.path.join(DIR_BASE, "RESP")
+    FILE_SEQ = "tef_sequence.dat"
+    FILE_JOURNAL = "tef_journal.db"
+    SEQ_BLOCO = 1000  # IDs reservados por acesso ao arquivo de sequência
+    ENCODING = tef_codec.ENCODING_PADRAO  # "mbcs" reproduz o comportamento antigo no Windows
+    QUEBRA_LINHA = os.linesep  # CRLF no Windows, como o modo texto gravava
+    TIMEOUT_STS = 7  # segundos para o CTFClient reconhecer o pedido (IntPos.Sts)
+    # Prazos adaptativos: percentil da janela de latências x margem, entre piso e teto
+    TIMEOUT_ADAPTATIVO = True
+    TIMEOUT_PERCENTIL = 99
+    TIMEOUT_MARGEM = 3.0
+    TIMEOUT_AMOSTRAS_MIN = 20  # abaixo disso vale o prazo fixo
+    TIMEOUT_LIMITES = {  # (piso, teto) em segundos; None = demais comandos
+        "STS": (1.0, 15.0),
+        "CRT": (60.0, 180.0),  # digitação de senha: nunca abaixo do antigo prazo fixo
+        "CNC": (60.0, 180.0),
+        "QRC": (120.0, 600.0),  # PIX: QR na tela até o cliente pagar
+        "ADM": (30.0, 900.0),   # menus operados no CTFClient
+        None: (10.0, 180.0),
+    }
+    # Gravação do pedido: "nenhuma" (só os buffers do SO), "arquivo" (fsync do
+    # IntPos.001) ou "diretorio" (fsync do arquivo e do diretório REQ)
+    DURABILIDADE = "nenhuma"
+    LEITURA_PRAZO = 5  # segundos para o IntPos.001 ficar completo depois de aparecer
+    LEITURA_ESTAVEL = 0.25  # sem 999-999: tamanho/mtime parados por este tempo
+    WATCHER = "auto"  # "auto" (inotify no Linux), "inotify" ou "polling"
+    # Self-checkout: um diretório base por CTFClient (cada um com REQ/RESP)
+    LANES = [DIR_BASE]
+    # Partida: PENDENTE sem intenção gravada recebe "NCN" (desfaz) ou "CNF"
+    RECUPERACAO = "NCN"
+    RECUPERACAO_TRABALHADORES = 4  # lanes recuperadas em paralelo
+    # Gateway compartilhado: "unix:/tmp/tefip.sock" ou "127.0.0.1:8765" (None = acesso direto)
+    GATEWAY = None
+    FILA_CAPACIDADE = 8  # pedidos aguardando no PDV (CNF/NCN nunca são recusados)
+    PERGUNTA_PRAZO = 60  # segundos para o operador confirmar um estorno (sem resposta: NCN)
+    # Instrumentação (None = desligado)
+    METRICAS_PORTA = None  # endpoint local http://127.0.0.1:<porta>/metrics
+    METRICAS_ARQUIVO = None  # arquivo .prom regravado periodicamente
+    TRACE_LOG = None  # JSON por transação, com rotação
+    CAPTURA = None  # arquivo da captura binária das trocas IntPos (replay_tef.py)
+    ARQUIVO_DIR = "tef_arquivo"  # transações finalizadas por dia + índice de NSU (tef_arquivo.py)
+
+DURABILIDADE_NENHUMA = "nenhuma"
+DURABILIDADE_ARQUIVO = "arquivo"
+DURABILIDADE_DIRETORIO = "diretorio"
+DURABILIDADES = (DURABILIDADE_NENHUMA, DURABILIDADE_ARQUIVO, DURABILIDADE_DIRETORIO)
+
+def gravar_atomico(destino, dados, durabilidade=None, medicao=None, tmp=None):
+    """
+    Grava `dados` num temporário com um único write e publica com
+    os.replace: quem lê `destino` vê o arquivo anterior ou o novo inteiro,
+    nunca um arquivo pela metade nem a ausência dele. `durabilidade`
+    (padrão TefConfig.DURABILIDADE) decide os fsyncs; os tempos vão para
+    as fases escrita / fsync / publicar da `medicao`.
+    """
+    durabilidade = durabilidade or TefConfig.DURABILIDADE
+    if durabilidade not in DURABILIDADES:
+        raise ValueError(f"Durabilidade desconhecida: {durabilidade}")
+    tmp = tmp or destino + ".tmp"
+    with fase(medicao, "escrita"):
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            visao = memoryview(dados)
+            while visao:  # uma chamada na prática; o laço cobre write curto
+                visao = visao[os.write(fd, visao):]
+            if durabilidade != DURABILIDADE_NENHUMA:
+                with fase(medicao, "fsync"):
+                    os.fsync(fd)
+        finally:
+            os.close(fd)
+    with fase(medicao, "publicar"):
+        os.replace(tmp, destino)
+        # Windows não abre diretório para fsync; lá o rename já é metadado journaled (NTFS)
+        if durabilidade == DURABILIDADE_DIRETORIO and os.name != "nt":
+            fd = os.open(os.path.dirname(destino) or ".", os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+def _travar_arquivo(f):
+    """Lock exclusivo entre processos (bloqueante, sem prazo)"""
+    if os.name == "nt":
+        # LK_LOCK desiste com OSError depois de ~10 tentativas de 1 s; uma
+        # troca na lane segura o lock por até o teto do CRT
+        espera = 0.001
+        while not _tentar_travar(f):
+            time.sleep(espera)
+            espera = min(espera * 2, 0.1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+def _tentar_travar(f):
+    """Lock exclusivo entre processos sem esperar; False se outro processo o tem"""
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+    else:
+        import fcntl
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+    return True
+
+def _destravar_arquivo(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def arquivo_sequencia(lane=None):
+    """Arquivo de sequência de um CTFClient: um só por lane, venha o acesso de onde vier"""
+    if lane is None:
+        lane = os.path.dirname(TefConfig.DIR_REQ)
+    return os.path.join(lane, TefConfig.FILE_SEQ)
+
+class SequenceManager:
+    """
+    Aloca o ID sequencial (001-000) em memória, reservando blocos de IDs no
+    arquivo de sequência sob lock de arquivo. O arquivo (padrão: o da lane
+    do TefConfig, ver `arquivo_sequencia`) guarda apenas a marca d'água
+    (último ID já reservado, o mesmo formato do antigo "último ID usado"),
+    gravada com fsync antes de o bloco ser usado: após um crash ou
+    reinício, ou com vários PDVs no mesmo arquivo, nenhum ID é
+    reaproveitado (sobras do bloco viram lacuna).
+    """
+    MAX_ID = 10 ** 10 - 1  # 001-000 tem 10 dígitos
+    LARGURA = 20
+
+    def __init__(self, caminho=None, bloco=None):
+        self.caminho = caminho or arquivo_sequencia()
+        self.bloco = bloco or TefConfig.SEQ_BLOCO
+        self._lock = threading.Lock()
+        self._proximo = 0
+        self._limite = 0  # exclusivo
+
+    def _reservar_bloco(self):
+        """Reserva [marca + 1, marca + bloco] no arquivo e grava a nova marca (o último do bloco)"""
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        fd = os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            _travar_arquivo(f)
+            try:
+                f.seek(0)
+                content = f.read().strip() or self._ler_legado()
+                inicio = int(content) + 1 if content.isdigit() else 1
+                if inicio + self.bloco - 1 > self.MAX_ID:
+                    inicio = 1
+                limite = inicio + self.bloco
+
+                f.seek(0)
+                f.write(str(limite - 1).zfill(self.LARGURA))
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                _destravar_arquivo(f)
+        self._proximo, self._limite = inicio, limite
+
+    def _ler_legado(self):
+        """Arquivo novo na lane: continua de onde parou o antigo, relativo ao diretório de trabalho"""
+        legado = os.path.abspath(TefConfig.FILE_SEQ)
+        if legado == os.path.abspath(self.caminho):
+            return ""
+        try:
+            with open(legado) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def get_next_id(self):
+        """Próximo ID em memória; toca o disco só a cada `bloco` IDs (Thread-Safe)"""
+        with self._lock:
+            if self._proximo >= self._limite:
+                self._reservar_bloco()
+            next_id = self._proximo
+            self._proximo += 1
+            return str(next_id).zfill(10)
+
+class LaneOcupada(RuntimeError):
+    """Outro processo está no meio de uma troca nesta lane"""
+
+
+class TefFileHandler:
+    """
+    Troca de arquivos IntPos com um CTFClient. Sem argumentos usa os
+    diretórios do TefConfig; com `dir_base` atende uma lane própria.
+    Cada troca roda sob o lock de arquivo <lane>/tefip.lock (ver `troca`),
+    compartilhado por todos os processos que usam a lane.
+    """
+
+    def __init__(self, dir_base=None, captura=None):
+        if dir_base is None:
+            self.dir_req, self.dir_resp = TefConfig.DIR_REQ, TefConfig.DIR_RESP
+        else:
+            self.dir_req = os.path.join(dir_base, "REQ")
+            self.dir_resp = os.path.join(dir_base, "RESP")
+        self.dir_quarentena = os.path.join(os.path.dirname(self.dir_req), "QUARENTENA")
+        self._limpeza = None
+        self.lane = os.path.dirname(self.dir_req)
+        if captura is None and TefConfig.CAPTURA:
+            captura = tef_captura.abrir(TefConfig.CAPTURA)
+        self.captura = captura
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self.arquivo_trava = os.path.join(self.lane, "tefip.lock")
+
+    def get_watcher(self):
+        """Observador de REQ/RESP da lane, criado sob demanda"""
+        with self._watcher_lock:
+            if self._watcher is None:
+                os.makedirs(self.dir_req, exist_ok=True)
+                os.makedirs(self.dir_resp, exist_ok=True)
+                self._watcher = criar_watcher([self.dir_req, self.dir_resp], TefConfig.WATCHER)
+            return self._watcher
+
+    def close(self):
+        with self._watcher_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+    def _abrir_trava(self):
+        os.makedirs(self.lane, exist_ok=True)
+        return open(self.arquivo_trava, "a+b")
+
+    @contextmanager
+    def troca(self):
+        """
+        Lock da lane do pedido gravado até a resposta consumida: a
+        quarentena (deste ou de outro processo) não leva arquivos de uma
+        troca em andamento, e dois clientes diretos na mesma lane não
+        disputam o IntPos.001.
+        """
+        # A limpeza deste handler precisa do mesmo lock: termina antes
+        if self._limpeza is not None:
+            self._limpeza.join()
+        with self._abrir_trava() as f:
+            _travar_arquivo(f)
+            try:
+                yield
+            finally:
+                _destravar_arquivo(f)
+
+    def setup_directories(self):
+        """
+        Cria REQ/RESP e move os IntPos.* que sobraram de uma execução
+        interrompida para QUARENTENA/<data-hora>/ (nada é apagado: uma
+        resposta do CTFClient pode ser a única prova de uma venda aprovada).
+        Com uma troca em andamento na lane (PDV ou gateway segurando o
+        lock de `troca`) levanta LaneOcupada sem mover nada.
+        Retorna os caminhos movidos.
+        """
+        os.makedirs(self.dir_req, exist_ok=True)
+        os.makedirs(self.dir_resp, exist_ok=True)
+        with self._abrir_trava() as f:
+            if not _tentar_travar(f):
+                raise LaneOcupada(f"Troca TEF em andamento em {self.lane}; quarentena recusada")
+            try:
+                return self._mover_quarentena()
+            finally:
+                _destravar_arquivo(f)
+
+    def _mover_quarentena(self):
+        destino = os.path.join(self.dir_quarentena, time.strftime("%Y%m%d-%H%M%S"))
+        movidos = []
+        for p in [self.dir_req, self.dir_resp]:
+            prefixo = os.path.basename(p)
+            for f in os.listdir(p):
+                if not f.startswith("IntPos."):
+                    continue
+                novo = os.path.join(destino, f"{prefixo}_{f}")
+                try:
+                    os.makedirs(destino, exist_ok=True)
+                    os.replace(os.path.join(p, f), novo)
+                    movidos.append(novo)
+                except OSError as e:
+                    print(f"Erro quarentena {f}: {e}")
+        return movidos
+
+    def _quarentenar(self, caminho, sufixo=""):
+        """Move um IntPos.* isolado para QUARENTENA/<data-hora>/ (nada é apagado)"""
+        destino = os.path.join(self.dir_quarentena, time.strftime("%Y%m%d-%H%M%S"))
+        prefixo = os.path.basename(os.path.dirname(caminho))
+        novo = os.path.join(destino, f"{prefixo}_{os.path.basename(caminho)}{sufixo}")
+        try:
+            os.makedirs(destino, exist_ok=True)
+            os.replace(caminho, novo)
+            return novo
+        except OSError as e:
+            print(f"Erro quarentena {caminho}: {e}")
+            return None
+
+    def iniciar_limpeza(self):
+        """setup_directories em thread de fundo; write_request espera o fim"""
+        self._limpeza = threading.Thread(target=self._limpar, daemon=True, name="tef-quarentena")
+        self._limpeza.start()
+        return self._limpeza
+
+    def _limpar(self):
+        try:
+            self.setup_directories()
+        except LaneOcupada as e:
+            # Outro processo atende a lane: os arquivos são dele
+            print(f"Quarentena adiada: {e}")
+
+    def listar_quarentena(self):
+        """Arquivos em quarentena, do lote mais antigo ao mais recente"""
+        if not os.path.isdir(self.dir_quarentena):
+            return []
+        return [os.path.join(self.dir_quarentena, lote, f)
+                for lote in sorted(os.listdir(self.dir_quarentena))
+                for f in sorted(os.listdir(os.path.join(self.dir_quarentena, lote)))]
+
+    def write_request(self, data_dict, medicao=None):
+        final_path = os.path.join(self.dir_req, "IntPos.001")
+        # A quarentena em andamento não pode levar o pedido novo junto
+        if self._limpeza is not None:
+            self._limpeza.join()
+        # Arma o watcher ANTES de publicar o pedido: o STS/resposta gerados
+        # logo após o rename ficam enfileirados para o wait_response
+        self.get_watcher()
+        # Campo inválido é erro do chamador, não de gravação (IntPosError)
+        with fase(medicao, "serializar"):
+            payload = tef_codec.serializar(data_dict, TefConfig.ENCODING, quebra=TefConfig.QUEBRA_LINHA)
+        try:
+            gravar_atomico(final_path, payload, medicao=medicao, tmp=os.path.join(self.dir_req, "IntPos.tmp"))
+            if self.captura: self.captura.registrar(tef_captura.REQ, self.lane, payload)
+            return True
+        except Exception as e:
+            print(f"Erro escrita: {e}")
+            if medicao: medicao.resultado, medicao.detalhe = ERRO, str(e)
+            return False
+
+    def wait_status(self, timeout=None, medicao=None, intervalo=0.1):
+        """Aguarda e consome o IntPos.Sts (reconhecimento do pedido)"""
+        sts_path = os.path.join(self.dir_resp, "IntPos.Sts")
+        if timeout is None:
+            timeout = TefConfig.TIMEOUT_STS
+        with fase(medicao, "aguardar_sts"):
+            reconhecido = self.get_watcher().aguardar(sts_path, timeout, intervalo=intervalo)
+        if not reconhecido:
+            if medicao: medicao.resultado = SEM_STS
+            if self.captura: self.captura.registrar(tef_captura.FALHA, self.lane, b"sem STS")
+            return False
+        if self.captura: self.captura.registrar(tef_captura.STS, self.lane)
+        try: os.remove(sts_path)
+        except: pass
+        return True
+
+    def _capturar_resposta(self, bruto):
+        if self.captura:
+            self.captura.registrar(tef_captura.RESP, self.lane, b"".join(bruto))
+
+    def _ler_resposta(self, caminho):
+        """
+        Lê o IntPos.001 assim que ele estiver completo: linha 999-999
+        recebida, ou tamanho e mtime parados por TefConfig.LEITURA_ESTAVEL
+        (CTFClient que não grava o terminador). Cada tentativa só lê os
+        bytes novos; arquivo trocado ou truncado reinicia o parser. A
+        contagem de bytes lidos precisa bater com o tamanho do arquivo.
+        Retorna (IntPosMensagem, None) ou (None, motivo).
+        """
+        prazo = time.monotonic() + TefConfig.LEITURA_PRAZO
+        espera = 0.002
+        parser, inode, bruto = None, None, []
+        assinatura, estavel_desde = None, 0.0
+        tentativas = 0
+        while True:
+            tentativas += 1
+            try:
+                with open(caminho, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    if parser is None or st.st_ino != inode or st.st_size < parser.bytes_lidos:
+                        parser, inode = tef_codec.IntPosParser(TefConfig.ENCODING), st.st_ino
+                        bruto = []
+                    f.seek(parser.bytes_lidos)
+                    pedaco = f.read()
+                    parser.feed(pedaco)
+                    if self.captura: bruto.append(pedaco)
+                    tamanho = max(st.st_size, os.fstat(f.fileno()).st_size)
+            except FileNotFoundError:
+                return None, "Resposta TEF removida durante a leitura."
+            except OSError:
+                # Windows: arquivo ainda aberto pelo CTFClient
+                tamanho = None
+
+            if parser is not None and tamanho is not None:
+                if parser.mensagem.completa and parser.bytes_lidos >= tamanho:
+                    self._capturar_resposta(bruto)
+                    return parser.close(), None
+                agora = time.monotonic()
+                atual = (tamanho, st.st_mtime_ns)
+                if atual != assinatura:
+                    assinatura, estavel_desde = atual, agora
+                elif parser.bytes_lidos == tamanho and agora - estavel_desde >= TefConfig.LEITURA_ESTAVEL:
+                    msg = parser.close()
+                    if msg.get("000-000"):
+                        self._capturar_resposta(bruto)
+                        return msg, None
+
+            if time.monotonic() >= prazo:
+                lidos = parser.bytes_lidos if parser else 0
+                return None, (f"Resposta TEF incompleta: {lidos} bytes lidos de {tamanho}, "
+                              f"sem 999-999, após {tentativas} leituras.")
+            time.sleep(espera)
+            espera = min(espera * 2, 0.05)
+
+    def wait_response(self, timeout=60, medicao=None, timeout_sts=None, intervalo=0.5, intervalo_sts=0.1,
+                      id_req=None):
+        """
+        Aguarda STS e IntPos.001 do pedido `id_req`. Uma resposta com outro
+        001-000 (sobra de um pedido que estourou o prazo) vai para a
+        quarentena e a espera continua no prazo que resta.
+        """
+        watcher = self.get_watcher()
+        # Aguarda STS
+        if not self.wait_status(timeout_sts, medicao, intervalo_sts):
+            return None, "Erro: CTFClient não respondeu (Sem STS)."
+
+        # Aguarda Resposta
+        resp_path = os.path.join(self.dir_resp, "IntPos.001")
+        prazo = time.monotonic() + timeout
+        while True:
+            with fase(medicao, "aguardar_resposta"):
+                chegou = watcher.aguardar(resp_path, max(0.0, prazo - time.monotonic()), intervalo=intervalo)
+            if not chegou:
+                if medicao: medicao.resultado = TIMEOUT
+                if self.captura: self.captura.registrar(tef_captura.FALHA, self.lane, b"timeout")
+                return None, "Timeout aguardando resposta TEF."
+
+            with fase(medicao, "leitura"):
+                data, erro = self._ler_resposta(resp_path)
+            if data is None:
+                # O arquivo fica em RESP: a próxima partida o põe em quarentena
+                if medicao: medicao.resultado, medicao.detalhe = PARCIAL, erro
+                if self.captura: self.captura.registrar(tef_captura.FALHA, self.lane, erro.encode("utf-8"))
+                return None, erro
+            recebido = data.get("001-000") or ""
+            # Sem 001-000 (CTFClient que não ecoa o campo) vale como a resposta esperada
+            if id_req is None or not recebido or recebido.lstrip("0") == str(id_req).lstrip("0"):
+                break
+            # Pode ser a única prova de uma venda aprovada: guarda, não apaga
+            movido = self._quarentenar(resp_path, f".{recebido}")
+            aviso = f"Resposta de outro pedido (001-000 {recebido}, esperado {id_req}) em quarentena: {movido}"
+            print(aviso)
+            if medicao: medicao.detalhe = aviso
+            if self.captura: self.captura.registrar(tef_captura.FALHA, self.lane, aviso.encode("utf-8"))
+            if movido is None:
+                return None, aviso
+        try: os.remove(resp_path)
+        except OSError: pass
+        return data, "Sucesso"
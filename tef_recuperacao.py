@@ -0,0 +1,86 @@
+import asyncio
+
+from tef_protocolo import TefConfig
+from tef_client import TefError, TefResultado
+
+# =============================================================================
+# RECUPERAÇÃO DE PENDENTES NA PARTIDA
+# =============================================================================
+# Intenção gravada no journal antes do lote de CNF/NCN (finalizar_pendentes)
+CONFIRMANDO = "CONFIRMANDO"
+ESTORNANDO = "ESTORNANDO"
+
+
+def planejar(pendentes, politica=None):
+    """
+    Decide CNF (True) ou NCN (False) para cada transação aberta: a intenção
+    gravada antes do crash vale; PENDENTE sem intenção segue
+    TefConfig.RECUPERACAO ("NCN" = desfaz venda cujo cupom não fechou).
+    """
+    politica = politica or TefConfig.RECUPERACAO
+    plano = []
+    for t in pendentes:
+        if t.status == CONFIRMANDO:
+            plano.append((t, True))
+        elif t.status == ESTORNANDO:
+            plano.append((t, False))
+        else:
+            plano.append((t, politica == "CNF"))
+    return plano
+
+
+async def recuperar(clientes, plano, trabalhadores=4, tentativas=3, ao_finalizar=None):
+    """
+    Reenvia o CNF/NCN de cada (Transacao, confirmar) do `plano` com
+    001-000 novo, aguardando o STS de cada um. `clientes` mapeia o nome da
+    lane para o TefClient (chave None = terminal padrão). As lanes correm
+    em paralelo, no máximo `trabalhadores` ao mesmo tempo; dentro de uma
+    lane os pedidos seguem em ordem (um CTFClient atende um por vez).
+    `ao_finalizar(transacao, confirmar, resultado)` é chamado a cada item.
+    Retorna os TefResultado na ordem do plano.
+    """
+    por_lane = {}
+    for i, (t, confirmar) in enumerate(plano):
+        lane = t.lane if t.lane in clientes else None
+        por_lane.setdefault(lane, []).append((i, t, confirmar))
+
+    resultados = [None] * len(plano)
+    vagas = asyncio.Semaphore(trabalhadores)
+
+    async def lane(nome, itens):
+        cliente = clientes[nome]
+        async with vagas:
+            for i, t, confirmar in itens:
+                finalizar = cliente.confirm if confirmar else cliente.undo
+                for tentativa in range(1, tentativas + 1):
+                    try:
+                        res = await finalizar(t.rede, t.nsu, t.finalizacao, t.doc_fiscal, multiplos=True)
+                        break
+                    except TefError as e:
+                        res = TefResultado(comando="CNF" if confirmar else "NCN", id_req=None, mensagem=str(e),
+                                           nsu=t.nsu, rede=t.rede, finalizacao=t.finalizacao)
+                res.tentativas = tentativa
+                res.lane = nome
+                resultados[i] = res
+                if ao_finalizar:
+                    ao_finalizar(t, confirmar, res)
+
+    await asyncio.gather(*(lane(nome, itens) for nome, itens in por_lane.items()))
+    return resultados
+
+
+def status_final(confirmar):
+    return "CONFIRMADO" if confirmar else "ESTORNADO"
+
+
+async def recuperar_journal(journal, clientes, politica=None, trabalhadores=4, tentativas=3):
+    """Recupera tudo que o journal tem em aberto; devolve (plano, resultados)"""
+    plano = planejar(journal.carregar_pendentes(), politica)
+
+    def ao_finalizar(t, confirmar, res):
+        if res.reconhecido:
+            journal.atualizar_status(t.id, status_final(confirmar))
+
+    resultados = await recuperar(clientes, plano, trabalhadores, tentativas, ao_finalizar)
+    journal.flush()
+    return plano, resultados
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+
+from tef_protocolo import TefConfig
+
+# =============================================================================
+# TIMEOUTS ADAPTATIVOS (POR COMANDO, POR LANE)
+# =============================================================================
+STS = "STS"
+RESPOSTA = "RESPOSTA"
+
+
+class JanelaLatencia:
+    """Últimas `tamanho` latências observadas, com percentis sob demanda"""
+
+    def __init__(self, tamanho=256):
+        self.amostras = deque(maxlen=tamanho)
+
+    def __len__(self):
+        return len(self.amostras)
+
+    def observar(self, segundos):
+        self.amostras.append(segundos)
+
+    def percentil(self, p):
+        ordenados = sorted(self.amostras)
+        if not ordenados:
+            return None
+        pos = (len(ordenados) - 1) * p / 100
+        i = int(pos)
+        j = min(i + 1, len(ordenados) - 1)
+        return ordenados[i] + (ordenados[j] - ordenados[i]) * (pos - i)
+
+
+class TimeoutsAdaptativos:
+    """
+    Prazos de STS e de resposta de uma lane, por comando. Com poucas
+    amostras vale o padrão fixo; depois, percentil TefConfig.TIMEOUT_PERCENTIL
+    da janela vezes TefConfig.TIMEOUT_MARGEM, limitado ao piso/teto de
+    TefConfig.TIMEOUT_LIMITES. Trocas bem-sucedidas entram com a latência
+    medida; um timeout entra com o prazo que esgotou (limite inferior do
+    que a resposta levaria), e assim a janela também sobe. `timeout_resposta`
+    explícito é o prazo de resposta de todo comando, sem piso nem janela.
+    """
+
+    def __init__(self, timeout_resposta=None, timeout_sts=None, tamanho=256):
+        self.fixo = timeout_resposta
+        self.padrao = {STS: timeout_sts or TefConfig.TIMEOUT_STS, RESPOSTA: timeout_resposta or 60}
+        self.tamanho = tamanho
+        self._janelas = {}  # (fase, comando) -> JanelaLatencia
+        self._lock = threading.Lock()
+
+    def observar(self, comando, fase, segundos):
+        with self._lock:
+            chave = (fase, comando)
+            if chave not in self._janelas:
+                self._janelas[chave] = JanelaLatencia(self.tamanho)
+            self._janelas[chave].observar(segundos)
+
+    def _limites(self, comando, fase):
+        limites = TefConfig.TIMEOUT_LIMITES
+        if fase == STS:
+            return limites.get(STS, (1.0, 15.0))
+        return limites.get(comando, limites.get(None, (10.0, 180.0)))
+
+    def prazo(self, comando, fase):
+        if fase == RESPOSTA and self.fixo is not None:
+            return self.fixo
+        piso, teto = self._limites(comando, fase)
+        with self._lock:
+            janela = self._janelas.get((fase, comando))
+            p = janela.percentil(TefConfig.TIMEOUT_PERCENTIL) \
+                if TefConfig.TIMEOUT_ADAPTATIVO and janela and len(janela) >= TefConfig.TIMEOUT_AMOSTRAS_MIN else None
+        if p is None:
+            # Sem histórico: padrão fixo, mas um comando lento já nasce com o piso dele
+            return max(self.padrao[fase], piso) if fase == RESPOSTA else self.padrao[fase]
+        return min(teto, max(piso, p * TefConfig.TIMEOUT_MARGEM))
+
+    def intervalo(self, comando, fase, padrao):
+        """Intervalo de polling: ~1/20 da mediana observada (5 ms a `padrao`)"""
+        with self._lock:
+            janela = self._janelas.get((fase, comando))
+            mediana = janela.percentil(50) if janela else None
+        if mediana is None:
+            return padrao
+        return min(padrao, max(0.005, mediana / 20))
+
+    def status(self):
+        with self._lock:
+            chaves = list(self._janelas)
+        return {f"{comando}/{fase}": {"amostras": len(self._janelas[(fase, comando)]),
+                                      "prazo_s": self.prazo(comando, fase)}
+                for fase, comando in chaves}
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import select
+import threading
+
+# =============================================================================
+# OBSERVADORES DE DIRETÓRIO (REQ / RESP)
+# =============================================================================
+# Máscaras do inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_NONBLOCK = getattr(os, "O_NONBLOCK", 0o4000)
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+
+class PollingWatcher:
+    """
+    Fallback portátil: verifica a existência do arquivo em intervalos fixos
+    (comportamento original do TefFileHandler).
+    """
+    backend = "polling"
+
+    def __init__(self, diretorios):
+        self.diretorios = list(diretorios)
+
+    def aguardar(self, caminho, timeout, intervalo=0.1):
+        """Retorna True assim que `caminho` existir, False no timeout"""
+        limite = time.monotonic() + timeout
+        while True:
+            if os.path.exists(caminho):
+                return True
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return False
+            time.sleep(min(intervalo, restante))
+
+    def aguardar_remocao(self, caminho, timeout, intervalo=0.1):
+        """Retorna True assim que `caminho` deixar de existir"""
+        limite = time.monotonic() + timeout
+        while True:
+            if not os.path.exists(caminho):
+                return True
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return False
+            time.sleep(min(intervalo, restante))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Acorda na criação / rename / fechamento de escrita de arquivos nos
+    diretórios observados (Linux). Os eventos ficam enfileirados no kernel
+    enquanto ninguém aguarda, então nada se perde entre o write_request e o
+    wait_response. Com várias threads esperando, uma só fica no select
+    (sem segurar o lock) e as demais acordam pela geração de eventos.
+    """
+    backend = "inotify"
+    MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM
+
+    def __init__(self, diretorios):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify indisponível")
+
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+
+        self._cond = threading.Condition()
+        self._geracao = 0  # lotes de eventos já drenados
+        self._lendo = False  # alguma thread está no select
+        self.diretorios = []
+        for d in diretorios:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(d), self.MASK)
+            if wd < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch falhou: {d}")
+            self.diretorios.append(d)
+
+    def fileno(self):
+        return self._fd
+
+    def _drenar(self, condicao, timeout):
+        """Bloqueia até chegar algum evento (ou timeout) e descarta a fila"""
+        with self._cond:
+            # Reavalia sob o lock: outra thread pode ter drenado nosso evento
+            if condicao():
+                return True
+            geracao = self._geracao
+            if self._lendo:
+                # Quem está no select avisa ao drenar (ou ao desistir: aí outra assume)
+                self._cond.wait_for(lambda: self._geracao != geracao or not self._lendo, max(0.0, timeout))
+                return self._geracao != geracao
+            self._lendo = True
+        prontos = []
+        try:
+            prontos, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+            if prontos:
+                try:
+                    while os.read(self._fd, 64 * 1024):
+                        pass
+                except BlockingIOError:
+                    pass
+        finally:
+            with self._cond:
+                self._lendo = False
+                if prontos:
+                    self._geracao += 1
+                self._cond.notify_all()
+        return bool(prontos)
+
+    def _esperar(self, condicao, timeout):
+        limite = time.monotonic() + timeout
+        while True:
+            # Verifica o estado real do disco: cobre eventos anteriores ao watch
+            if condicao():
+                return True
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return False
+            self._drenar(condicao, restante)
+
+    def aguardar(self, caminho, timeout, intervalo=None):
+        """Retorna True assim que `caminho` existir, False no timeout"""
+        return self._esperar(lambda: os.path.exists(caminho), timeout)
+
+    def aguardar_remocao(self, caminho, timeout, intervalo=None):
+        """Retorna True assim que `caminho` deixar de existir"""
+        return self._esperar(lambda: not os.path.exists(caminho), timeout)
+
+    def close(self):
+        if self._fd >= 0:
+            try: os.close(self._fd)
+            except OSError: pass
+            self._fd = -1
+
+
+def criar_watcher(diretorios, backend="auto"):
+    """
+    Cria o observador dos diretórios REQ/RESP.
+    backend: "auto" (inotify no Linux, polling nos demais), "inotify" ou "polling".
+    """
+    if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(diretorios)
+        except OSError:
+            if backend == "inotify":
+                raise
+    return PollingWatcher(diretorios)
@@ -0,0 +1,301 @@
+"""
+Ponto de entrada do TEF IP.
+
+    python tefip.py                         # interface gráfica (PDV)
+    python tefip.py credito 100,00 [--doc 1001] [--sem-confirmar]
+    python tefip.py debito | pix VALOR ...
+    python tefip.py parcelado VALOR PARCELAS ...
+    python tefip.py cancelar VALOR NSU DATA [--hora HHMMSS] [--rede REDE]
+    python tefip.py adm
+    python tefip.py pendentes               # journal + arquivos em quarentena
+    python tefip.py recuperar [--lanes]     # CNF/NCN das pendências abertas
+    python tefip.py quarentena              # move sobras de REQ/RESP agora
+    python tefip.py gateway [BASE ...]      # serviço compartilhado (tef_gateway)
+    python tefip.py arquivo [--buscar NSU]  # arquiva finalizadas / busca por NSU (tef_arquivo)
+
+Os modos sem interface não importam tkinter: servem para serviços,
+terminais sem display e scripts. Os módulos pesados só são importados
+pelo comando que precisa deles.
+"""
+import sys
+import argparse
+
+
+def _cliente(args):
+    """
+    TefClient direto nos diretórios, ou GatewayClient quando há gateway
+    configurado (REQ/RESP são dele: gravar ali em paralelo disputaria o
+    IntPos.001). --base força o acesso direto.
+    """
+    from tef_protocolo import TefConfig, TefFileHandler
+
+    if TefConfig.GATEWAY and not args.base:
+        from tef_gateway import GatewayClient
+        return GatewayClient()
+    from tef_client import TefClient
+    if args.base:
+        # Sequência da lane vem do handler (mesmo arquivo do gateway e do PDV)
+        return TefClient(TefFileHandler(args.base), timeout=args.timeout)
+    return TefClient(timeout=args.timeout)
+
+
+def _preparar(tef):
+    """Quarentena em segundo plano, só para quem é dono dos diretórios"""
+    if hasattr(tef, "handler"):
+        tef.handler.iniciar_limpeza()
+
+
+def _fechar(tef):
+    if hasattr(tef, "handler"):
+        tef.handler.close()
+    else:
+        tef.close()
+
+
+def _handler(args):
+    from tef_protocolo import TefFileHandler
+    return TefFileHandler(args.base)
+
+
+def _imprimir(res):
+    situacao = "APROVADO" if res.aprovado else ("RECONHECIDO" if res.reconhecido else "RECUSADO")
+    print(f"{res.comando} {situacao} id={res.id_req} nsu={res.nsu or '-'} rede={res.rede or '-'} {res.mensagem}")
+
+
+def cmd_gui(args):
+    import tkinter as tk
+    from integracao_tef_ip import ModernPDV
+
+    root = tk.Tk()
+    ModernPDV(root)
+    root.mainloop()
+    return 0
+
+
+def cmd_venda(args):
+    import asyncio
+    import tef_metricas
+    from tef_journal import TransacaoJournal
+    from tef_ledger import Transacao, para_cents
+
+    valor_cents = para_cents(args.valor)
+    if valor_cents <= 0:
+        print("Valor inválido.", file=sys.stderr)
+        return 2
+
+    tef = _cliente(args)
+    _preparar(tef)
+    tef_metricas.iniciar_exportadores()
+    journal = TransacaoJournal()
+
+    async def executar():
+        if args.comando == "parcelado":
+            return await tef.installment(valor_cents, args.parcelas, args.doc)
+        operacao = {"credito": tef.credit, "debito": tef.debit, "pix": tef.pix}[args.comando]
+        return await operacao(valor_cents, args.doc)
+
+    tipo = {"credito": "CREDITO", "debito": "DEBITO", "pix": "PIX_PAGAMENTO",
+            "parcelado": "CREDITO_PARCELADO"}[args.comando]
+
+    # Venda e CNF no mesmo loop: as conexões com o gateway pertencem a ele
+    async def fluxo():
+        res = await executar()
+        _imprimir(res)
+        if not res.aprovado:
+            return 1
+
+        t = Transacao(valor_cents, tipo, "PENDENTE", id_req=res.id_req, nsu=res.nsu, rede=res.rede,
+                      finalizacao=res.finalizacao, parcelas=getattr(args, "parcelas", ""),
+                      data_operacao=res.data_operacao, hora_operacao=res.hora_operacao,
+                      doc_fiscal=args.doc, lane=res.lane)
+        t.id = journal.registrar(t, commit=True)
+        if args.sem_confirmar:
+            print(f"Pendente no journal (id={t.id}); finalize pelo PDV.")
+            return 0
+
+        cnf = await tef.confirm(res.rede, res.nsu, res.finalizacao, args.doc)
+        _imprimir(cnf)
+        journal.atualizar_status(t.id, "CONFIRMADO", commit=True)
+        return 0
+
+    try:
+        return asyncio.run(fluxo())
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        journal.close()
+        _fechar(tef)
+
+
+def cmd_cancelar(args):
+    import asyncio
+    import tef_metricas
+    from tef_journal import TransacaoJournal, TransacaoAmbigua
+    from tef_ledger import para_cents
+
+    tef = _cliente(args)
+    _preparar(tef)
+    tef_metricas.iniciar_exportadores()
+
+    async def fluxo():
+        res = await tef.cancel(para_cents(args.valor), args.nsu, args.data, args.doc,
+                               hora=args.hora, rede=args.rede)
+        _imprimir(res)
+        if not res.aprovado:
+            return 1
+        cnf = await tef.confirm(res.rede, res.nsu, res.finalizacao, args.doc)
+        _imprimir(cnf)
+        journal = TransacaoJournal()
+        try: journal.atualizar_status_nsu(args.nsu, "CANCELADO", args.rede, args.data, commit=True)
+        except TransacaoAmbigua as e: print(f"Journal não atualizado: {e}", file=sys.stderr)
+        finally: journal.close()
+        return 0
+
+    try:
+        return asyncio.run(fluxo())
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        _fechar(tef)
+
+
+def cmd_adm(args):
+    import asyncio
+
+    tef = _cliente(args)
+    _preparar(tef)
+    try:
+        res = asyncio.run(tef.admin())
+        _imprimir(res)
+        return 0 if res.aprovado else 1
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        _fechar(tef)
+
+
+def cmd_pendentes(args):
+    from tef_journal import TransacaoJournal
+
+    journal = TransacaoJournal()
+    try:
+        for t in journal.carregar_pendentes():
+            print(f"{t.status} id={t.id} nsu={t.nsu} rede={t.rede} valor={t.valor_display} doc={t.doc_fiscal}")
+    finally:
+        journal.close()
+    for caminho in _handler(args).listar_quarentena():
+        print(f"QUARENTENA {caminho}")
+    return 0
+
+
+def cmd_recuperar(args):
+    import asyncio
+    from tef_journal import TransacaoJournal
+    from tef_protocolo import TefConfig
+    from tef_recuperacao import recuperar_journal
+
+    if args.lanes and not (TefConfig.GATEWAY and not args.base):
+        from tef_dispatcher import TefDispatcher
+        dispatcher = TefDispatcher.from_config(timeout=args.timeout)
+        clientes = {nome: lane.client for nome, lane in dispatcher.lanes.items()}
+        clientes[None] = next(iter(clientes.values()))
+        fechar = dispatcher.close
+    else:
+        # Com gateway, ele escolhe a lane de cada NSU
+        tef = _cliente(args)
+        clientes = {None: tef}
+        fechar = lambda: _fechar(tef)
+
+    journal = TransacaoJournal()
+    try:
+        plano, resultados = asyncio.run(recuperar_journal(journal, clientes, args.politica,
+                                                          TefConfig.RECUPERACAO_TRABALHADORES))
+        for (t, _), res in zip(plano, resultados):
+            print(f"id={t.id} nsu={t.nsu} lane={res.lane or '-'} ", end="")
+            _imprimir(res)
+        return 0 if all(r.reconhecido for r in resultados) else 1
+    finally:
+        journal.close()
+        fechar()
+
+
+def cmd_quarentena(args):
+    from tef_protocolo import LaneOcupada
+    try:
+        movidos = _handler(args).setup_directories()
+    except LaneOcupada as e:
+        # PDV ou gateway no meio de uma troca: os arquivos ainda são dele
+        print(e)
+        return 1
+    for caminho in movidos:
+        print(caminho)
+    return 0
+
+
+def cmd_gateway(args):
+    import tef_gateway
+    return tef_gateway.main(args.resto)
+
+
+def cmd_arquivo(args):
+    import tef_arquivo
+    return tef_arquivo.main(args.resto)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="TEF IP (Auttar)")
+    ap.add_argument("--base", help="diretório base do CTFClient (padrão: TefConfig)")
+    ap.add_argument("--timeout", type=float, default=None,
+                    help="prazo fixo de resposta em segundos (padrão: adaptativo, TefConfig.TIMEOUT_LIMITES)")
+    sub = ap.add_subparsers(dest="comando")
+
+    sub.add_parser("gui", help="interface gráfica (padrão)").set_defaults(func=cmd_gui)
+    for nome in ("credito", "debito", "pix", "parcelado"):
+        p = sub.add_parser(nome, help=f"venda {nome}")
+        p.add_argument("valor")
+        if nome == "parcelado":
+            p.add_argument("parcelas", type=int)
+        p.add_argument("--doc", default="1001", help="documento fiscal (002-000)")
+        p.add_argument("--sem-confirmar", action="store_true", help="deixa PENDENTE no journal (sem CNF)")
+        p.set_defaults(func=cmd_venda)
+
+    p = sub.add_parser("cancelar", help="cancelamento (CNC) + CNF")
+    p.add_argument("valor")
+    p.add_argument("nsu")
+    p.add_argument("data", help="DDMMAAAA")
+    p.add_argument("--hora")
+    p.add_argument("--rede")
+    p.add_argument("--doc", default="1001")
+    p.set_defaults(func=cmd_cancelar)
+
+    sub.add_parser("adm", help="menu administrativo").set_defaults(func=cmd_adm)
+    sub.add_parser("pendentes", help="lista pendências").set_defaults(func=cmd_pendentes)
+    p = sub.add_parser("recuperar", help="CNF/NCN das pendências do journal")
+    p.add_argument("--lanes", action="store_true", help="usa TefConfig.LANES (uma lane por CTFClient)")
+    p.add_argument("--politica", choices=("CNF", "NCN"), help="para PENDENTE sem intenção gravada")
+    p.set_defaults(func=cmd_recuperar)
+
+    sub.add_parser("quarentena", help="move sobras de REQ/RESP").set_defaults(func=cmd_quarentena)
+
+    p = sub.add_parser("gateway", help="gateway TEF local (REQ/RESP compartilhados)", add_help=False)
+    p.add_argument("resto", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_gateway)
+
+    p = sub.add_parser("arquivo", help="arquivo de transações finalizadas (busca por NSU)", add_help=False)
+    p.add_argument("resto", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_arquivo)
+
+    # REMAINDER não captura opções logo após o subcomando (gateway --endereco ...)
+    args, extras = ap.parse_known_args(argv)
+    if extras:
+        if not hasattr(args, "resto"):
+            ap.error(f"argumentos não reconhecidos: {' '.join(extras)}")
+        args.resto = extras + args.resto
+    return getattr(args, "func", cmd_gui)(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())